@@ -1,10 +1,70 @@
-from django.contrib import admin
+from datetime import timedelta
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
-from .models import Category, Listing, Bid, Comment, Watchlist, UserProfile
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from .models import Category, Listing, Bid, Comment, Watchlist, UserProfile, CategoryPriceStats, ShillSuspect
+from . import moderation
+from .exports import export_response
+from .paginators import EstimatedCountPaginator
+
+
+def _listing_title(listing):
+    return listing.title[:30] + '...' if len(listing.title) > 30 else listing.title
+
+
+def _export_action(kind, fmt):
+    def action(modeladmin, request, queryset):
+        return export_response(kind, queryset, fmt)
+    action.__name__ = f'export_{kind}_{fmt}'
+    action.short_description = f'Export selected {kind} as {fmt.upper()}'
+    return action
+
+
+class ListingActionForm(ActionForm):
+    days = forms.IntegerField(min_value=1, max_value=365, required=False, label='Days')
+    category = forms.ModelChoiceField(Category.objects.all(), required=False, empty_label='(no category)')
+
+
+def _action_form(request):
+    form = ListingActionForm(request.POST)
+    # Only the changelist sets the 'action' choices, so judge the extra fields alone
+    form.is_valid()
+    return form
+
+
+def _moderation_message(modeladmin, request, verb, result):
+    modeladmin.message_user(request, f'{verb} {result.rows} listings in {result.seconds:.2f}s.', messages.SUCCESS)
+
+
+@admin.action(description='Deactivate selected listings', permissions=['change'])
+def deactivate_listings(modeladmin, request, queryset):
+    _moderation_message(modeladmin, request, 'Deactivated', moderation.deactivate(queryset))
+
+
+@admin.action(description='Extend selected listings by the given days', permissions=['change'])
+def extend_listings(modeladmin, request, queryset):
+    days = _action_form(request).cleaned_data.get('days')
+    if not days:
+        modeladmin.message_user(request, 'Enter the number of days (1-365) to extend by.', messages.ERROR)
+        return
+    _moderation_message(modeladmin, request, 'Extended', moderation.extend(queryset, timedelta(days=days)))
+
+
+@admin.action(description='Move selected listings to the given category', permissions=['change'])
+def recategorize_listings(modeladmin, request, queryset):
+    form = _action_form(request)
+    if 'category' in form.errors:
+        modeladmin.message_user(request, 'Choose a valid category.', messages.ERROR)
+        return
+    _moderation_message(modeladmin, request, 'Moved', moderation.recategorize(queryset, form.cleaned_data['category']))
 
 
 @admin.register(Category)
@@ -13,9 +73,17 @@ class CategoryAdmin(admin.ModelAdmin):
     prepopulated_fields = {'slug': ('name',)}
     search_fields = ['name']
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            _listing_count=Count('listing', filter=Q(listing__is_active=True))
+        )
+    
     def listing_count(self, obj):
-        return obj.listing_set.filter(is_active=True).count()
+        if hasattr(obj, '_listing_count'):
+            return obj._listing_count
+        return obj.listing_set.filter(is_active=True).count() if obj.pk else 0
     listing_count.short_description = 'Active Listings'
+    listing_count.admin_order_field = '_listing_count'
 
 
 @admin.register(Listing)
@@ -26,17 +94,40 @@ class ListingAdmin(admin.ModelAdmin):
     date_hierarchy = 'end_date'
     readonly_fields = ['created_at', 'bid_count', 'view_listing']
     list_per_page = 25
+    list_select_related = ['seller']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    action_form = ListingActionForm
+    actions = [
+        deactivate_listings, extend_listings, recategorize_listings,
+        _export_action('listings', 'csv'), _export_action('listings', 'jsonl'),
+    ]
+    
+    def get_queryset(self, request):
+        # A correlated subquery rather than Count('bids') keeps the changelist
+        # queryset free of GROUP BY, so exports can stream it with values_list()
+        bid_counts = Bid.objects.filter(listing=OuterRef('pk')).order_by().values('listing').annotate(
+            count=Count('pk')
+        ).values('count')
+        return super().get_queryset(request).annotate(_bid_count=Coalesce(Subquery(bid_counts), 0))
     
     def seller_link(self, obj):
-        url = reverse('admin:auth_user_change', args=[obj.seller.id])
+        url = reverse('admin:auth_user_change', args=[obj.seller_id])
         return format_html('<a href="{}">{}</a>', url, obj.seller.username)
     seller_link.short_description = 'Seller'
+    seller_link.admin_order_field = 'seller__username'
     
     def bid_count(self, obj):
-        return obj.bid_set.count()
+        if hasattr(obj, '_bid_count'):
+            return obj._bid_count
+        return obj.bids.count() if obj.pk else 0
     bid_count.short_description = 'Total Bids'
+    bid_count.admin_order_field = '_bid_count'
     
     def view_listing(self, obj):
+        if not obj.pk:
+            return '-'
         url = reverse('listing_detail', args=[obj.pk])
         return format_html('<a href="{}" target="_blank">View on Site</a>', url)
     view_listing.short_description = 'View on Site'
@@ -48,21 +139,29 @@ class BidAdmin(admin.ModelAdmin):
     list_filter = ['created_at', 'listing__is_active']
     search_fields = ['listing__title', 'bidder__username']
     list_per_page = 50
+    list_select_related = ['listing', 'bidder']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = [_export_action('bids', 'csv'), _export_action('bids', 'jsonl')]
     
     def listing_link(self, obj):
-        url = reverse('admin:auctions_listing_change', args=[obj.listing.id])
-        return format_html('<a href="{}">{}</a>', url, obj.listing.title[:30] + '...' if len(obj.listing.title) > 30 else obj.listing.title)
+        url = reverse('admin:auctions_listing_change', args=[obj.listing_id])
+        return format_html('<a href="{}">{}</a>', url, _listing_title(obj.listing))
     listing_link.short_description = 'Listing'
+    listing_link.admin_order_field = 'listing__title'
     
     def bidder_link(self, obj):
-        url = reverse('admin:auth_user_change', args=[obj.bidder.id])
+        url = reverse('admin:auth_user_change', args=[obj.bidder_id])
         return format_html('<a href="{}">{}</a>', url, obj.bidder.username)
     bidder_link.short_description = 'Bidder'
+    bidder_link.admin_order_field = 'bidder__username'
     
     def is_winning_bid(self, obj):
-        if obj.listing.is_ended and obj.listing.winner == obj.bidder:
+        # Compare ids so the listing's winner never has to be fetched.
+        is_ended = obj.listing.is_ended()
+        if is_ended and obj.listing.winner_id == obj.bidder_id:
             return format_html('<span style="color: green;">✓ Winner</span>')
-        elif obj.listing.is_ended:
+        elif is_ended:
             return format_html('<span style="color: red;">✗ Lost</span>')
         else:
             return format_html('<span style="color: blue;">Active</span>')
@@ -75,16 +174,21 @@ class CommentAdmin(admin.ModelAdmin):
     list_filter = ['created_at']
     search_fields = ['listing__title', 'author__username', 'content']
     list_per_page = 50
+    list_select_related = ['listing', 'author']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     def listing_link(self, obj):
-        url = reverse('admin:auctions_listing_change', args=[obj.listing.id])
-        return format_html('<a href="{}">{}</a>', url, obj.listing.title[:30] + '...' if len(obj.listing.title) > 30 else obj.listing.title)
+        url = reverse('admin:auctions_listing_change', args=[obj.listing_id])
+        return format_html('<a href="{}">{}</a>', url, _listing_title(obj.listing))
     listing_link.short_description = 'Listing'
+    listing_link.admin_order_field = 'listing__title'
     
     def author_link(self, obj):
-        url = reverse('admin:auth_user_change', args=[obj.author.id])
+        url = reverse('admin:auth_user_change', args=[obj.author_id])
         return format_html('<a href="{}">{}</a>', url, obj.author.username)
     author_link.short_description = 'Author'
+    author_link.admin_order_field = 'author__username'
     
     def short_content(self, obj):
         return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
@@ -97,28 +201,82 @@ class WatchlistAdmin(admin.ModelAdmin):
     list_filter = ['added_at']
     search_fields = ['user__username', 'listing__title']
     list_per_page = 50
+    list_select_related = ['user', 'listing']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     def user_link(self, obj):
-        url = reverse('admin:auth_user_change', args=[obj.user.id])
+        url = reverse('admin:auth_user_change', args=[obj.user_id])
         return format_html('<a href="{}">{}</a>', url, obj.user.username)
     user_link.short_description = 'User'
+    user_link.admin_order_field = 'user__username'
     
     def listing_link(self, obj):
-        url = reverse('admin:auctions_listing_change', args=[obj.listing.id])
-        return format_html('<a href="{}">{}</a>', url, obj.listing.title[:30] + '...' if len(obj.listing.title) > 30 else obj.listing.title)
+        url = reverse('admin:auctions_listing_change', args=[obj.listing_id])
+        return format_html('<a href="{}">{}</a>', url, _listing_title(obj.listing))
     listing_link.short_description = 'Listing'
+    listing_link.admin_order_field = 'listing__title'
 
 
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ['user_link', 'location', 'bio_short']
     search_fields = ['user__username', 'location', 'bio']
+    list_select_related = ['user']
     
     def user_link(self, obj):
-        url = reverse('admin:auth_user_change', args=[obj.user.id])
+        url = reverse('admin:auth_user_change', args=[obj.user_id])
         return format_html('<a href="{}">{}</a>', url, obj.user.username)
     user_link.short_description = 'User'
+    user_link.admin_order_field = 'user__username'
     
     def bio_short(self, obj):
         return obj.bio[:50] + '...' if obj.bio and len(obj.bio) > 50 else (obj.bio or '')
     bio_short.short_description = 'Bio'
+
+
+@admin.register(CategoryPriceStats)
+class CategoryPriceStatsAdmin(admin.ModelAdmin):
+    list_display = ['category', 'closed_count', 'sell_through_rate', 'median_price', 'p25_price', 'p75_price', 'avg_bid_count', 'computed_at']
+    list_select_related = ['category']
+    readonly_fields = ['computed_at']
+
+
+@admin.register(ShillSuspect)
+class ShillSuspectAdmin(admin.ModelAdmin):
+    list_display = ['bidder_link', 'seller_link', 'score', 'status', 'evidence', 'updated_at']
+    list_filter = ['status']
+    search_fields = ['bidder__username', 'seller__username']
+    list_select_related = ['bidder', 'seller']
+    readonly_fields = ['bidder', 'seller', 'score', 'features', 'created_at', 'updated_at']
+    actions = ['mark_confirmed', 'mark_dismissed']
+    
+    def bidder_link(self, obj):
+        url = reverse('admin:auth_user_change', args=[obj.bidder_id])
+        return format_html('<a href="{}">{}</a>', url, obj.bidder.username)
+    bidder_link.short_description = 'Bidder'
+    bidder_link.admin_order_field = 'bidder__username'
+    
+    def seller_link(self, obj):
+        url = reverse('admin:auth_user_change', args=[obj.seller_id])
+        return format_html('<a href="{}">{}</a>', url, obj.seller.username)
+    seller_link.short_description = 'Seller'
+    seller_link.admin_order_field = 'seller__username'
+    
+    def evidence(self, obj):
+        features = obj.features
+        return (
+            f"{features.get('concentration', 0):.0%} of bids on this seller, "
+            f"lost {features.get('loss_rate', 0):.0%} of {features.get('auctions', 0)} auctions"
+        )
+    evidence.short_description = 'Evidence'
+    
+    def mark_confirmed(self, request, queryset):
+        updated = queryset.update(status='confirmed')
+        self.message_user(request, f'{updated} suspects confirmed.')
+    mark_confirmed.short_description = 'Mark selected as confirmed'
+    
+    def mark_dismissed(self, request, queryset):
+        updated = queryset.update(status='dismissed')
+        self.message_user(request, f'{updated} suspects dismissed.')
+    mark_dismissed.short_description = 'Mark selected as dismissed'
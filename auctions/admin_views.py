@@ -5,6 +5,7 @@ from django.db.models import Count, Sum, Q
 from django.utils import timezone
 from datetime import timedelta
 from .models import Listing, Bid, Category
+from .throttling import rejection_counts
 
 
 @staff_member_required
@@ -23,7 +24,7 @@ def admin_dashboard(request):
     # Listing statistics
     total_listings = Listing.objects.count()
     active_listings = Listing.objects.filter(is_active=True).count()
-    ended_listings = Listing.objects.filter(is_ended=True).count()
+    ended_listings = Listing.objects.filter(end_date__lte=timezone.now()).count()
     new_listings_today = Listing.objects.filter(
         created_at__gte=timezone.now() - timedelta(days=1)
     ).count()
@@ -45,11 +46,11 @@ def admin_dashboard(request):
     
     # Top users by activity
     top_bidders = User.objects.annotate(
-        bid_count=Count('bid')
+        bid_count=Count('bids')
     ).order_by('-bid_count')[:5]
     
     top_sellers = User.objects.annotate(
-        listing_count=Count('listing')
+        listing_count=Count('listings')
     ).order_by('-listing_count')[:5]
     
     context = {
@@ -67,6 +68,8 @@ def admin_dashboard(request):
         'recent_bids': recent_bids,
         'top_bidders': top_bidders,
         'top_sellers': top_sellers,
+        # {(url name, 'user' or 'ip'): requests refused by ThrottleMiddleware}
+        'throttled_requests': rejection_counts(),
     }
     
     return render(request, 'admin/dashboard.html', context)
\ No newline at end of file
@@ -0,0 +1,100 @@
+from decimal import Decimal
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from .caching import touch_catalog
+from .columnar import EPOCH, fetch_columns, iter_column_chunks
+from .models import Bid, CategoryPriceStats, Listing
+
+PERCENTILES = {
+    'p10_price': 10,
+    'p25_price': 25,
+    'median_price': 50,
+    'p75_price': 75,
+    'p90_price': 90,
+}
+
+# Upper edge, in seconds before close, of each bid_velocity bucket
+VELOCITY_WINDOWS = [
+    ('0-1h', 3600),
+    ('1-6h', 6 * 3600),
+    ('6-24h', 24 * 3600),
+    ('1-7d', 7 * 24 * 3600),
+]
+
+
+def _money(value):
+    return Decimal(str(round(float(value), 2)))
+
+
+def compute_category_price_stats(chunk_size=200000, now=None):
+    """
+    Aggregate closed auctions per category. Bids are streamed in chunks into
+    per-listing running maxima and counts, so memory grows with the number
+    of closed listings rather than the number of bids.
+    """
+    now = now or timezone.now()
+    closed = Listing.objects.filter(end_date__lte=now, category__isnull=False).order_by('pk')
+    pks, category_ids, end_dates = fetch_columns(
+        closed, {'pk': np.int64, 'category_id': np.int64, 'end_date': EPOCH}, chunk_size
+    )
+    categories, category_idx = np.unique(category_ids, return_inverse=True)
+    n = len(pks)
+    n_windows = len(VELOCITY_WINDOWS) + 1
+    edges = np.array([seconds for _, seconds in VELOCITY_WINDOWS], dtype=np.float64)
+
+    final_price = np.full(n, -np.inf)
+    bid_counts = np.zeros(n, dtype=np.int64)
+    window_counts = np.zeros(len(categories) * n_windows, dtype=np.int64)
+
+    bids = Bid.objects.filter(listing__end_date__lte=now, listing__category__isnull=False).order_by()
+    columns = {'listing_id': np.int64, 'amount': np.float64, 'created_at': EPOCH}
+    for listing_ids, amounts, created in iter_column_chunks(bids, columns, chunk_size):
+        idx = np.searchsorted(pks, listing_ids)
+        idx[idx == n] = 0
+        found = pks[idx] == listing_ids if n else np.zeros(len(idx), dtype=bool)
+        idx, amounts, created = idx[found], amounts[found], created[found]
+        np.maximum.at(final_price, idx, amounts)
+        bid_counts += np.bincount(idx, minlength=n)
+        window = np.searchsorted(edges, end_dates[idx] - created, side='left')
+        window_counts += np.bincount(category_idx[idx] * n_windows + window, minlength=len(window_counts))
+
+    window_counts = window_counts.reshape(len(categories), n_windows)
+    sold = bid_counts > 0
+    results = {}
+    for i, category_id in enumerate(categories.tolist()):
+        in_category = category_idx == i
+        prices = final_price[in_category & sold]
+        total_bids = window_counts[i].sum()
+        stats = {
+            'closed_count': int(in_category.sum()),
+            'sold_count': int(len(prices)),
+            'sell_through_rate': float(len(prices) / in_category.sum()),
+            'avg_bid_count': float(bid_counts[in_category].mean()),
+            'bid_velocity': {
+                name: float(window_counts[i][j] / total_bids) if total_bids else 0.0
+                for j, name in enumerate([name for name, _ in VELOCITY_WINDOWS] + ['7d+'])
+            },
+        }
+        if len(prices):
+            values = np.percentile(prices, list(PERCENTILES.values()))
+            stats.update({field: _money(value) for field, value in zip(PERCENTILES, values)})
+        else:
+            stats.update({field: None for field in PERCENTILES})
+        results[category_id] = stats
+    return results
+
+
+def rebuild_category_price_stats(chunk_size=200000):
+    results = compute_category_price_stats(chunk_size)
+    with transaction.atomic():
+        CategoryPriceStats.objects.all().delete()
+        CategoryPriceStats.objects.bulk_create([
+            CategoryPriceStats(category_id=category_id, **stats)
+            for category_id, stats in results.items()
+        ])
+        # The browse pages show them
+        touch_catalog()
+    return len(results)
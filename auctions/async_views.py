@@ -0,0 +1,151 @@
+"""
+Async versions of the read-heavy browse views, routed in place of the sync
+ones when ASYNC_BROWSE_VIEWS is on (the default under asgi.py). Independent
+queries are issued together and nothing blocks the event loop; bids and
+comments are still posted through the sync views.
+"""
+import asyncio
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import Paginator
+from django.http import Http404
+from django.shortcuts import render
+from django.utils import timezone
+
+from . import views
+from .caching import (
+    async_condition, cache_anonymous_page, catalog_etag, catalog_last_modified, listing_etag, listing_last_modified,
+)
+from .ending_soon import alistings_for_ids, ending_soon_index
+from .facets import facet_counts, filter_listings, parse_filters
+from .forms import BidForm, CommentForm
+from .models import Category, CategoryPriceStats, Listing, SimilarListing, Watchlist
+from .view_counts import count_views, order_by_trending
+
+
+async def _list(queryset):
+    return [obj async for obj in queryset]
+
+
+async def _value(value):
+    return value
+
+
+async def _user(request):
+    """Resolve the lazy request.user (session and user lookups) off the event loop."""
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+async def _render(request, template_name, context):
+    # Templates may still touch lazy relations, so render where the ORM is allowed
+    return await sync_to_async(render)(request, template_name, context)
+
+
+@async_condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)
+@cache_anonymous_page(catalog_etag)
+async def home(request):
+    filters = parse_filters(request.GET)
+    categories = await _list(Category.objects.all())
+    category_ids = {category.slug: category.pk for category in categories}
+    listings = filter_listings(
+        Listing.objects.filter(is_active=True).select_related('seller', 'category'), filters, category_ids
+    )
+
+    now = timezone.now()
+    status = filters.status
+    use_index = (
+        status == 'ending_soon' and not filters.search and not filters.prices and len(filters.categories) <= 1
+    )
+    if use_index:
+        category_id = category_ids.get(filters.categories[0]) if filters.categories else None
+        if filters.categories and category_id is None:
+            listings = []
+        else:
+            listings = await sync_to_async(ending_soon_index.ids)(now, category_id=category_id)
+    elif status == 'ending_soon':
+        listings = listings.filter(end_date__gt=now).order_by('end_date')
+    elif status == 'new':
+        listings = listings.order_by('-created_at')
+    elif status == 'no_bids':
+        listings = listings.filter(current_bid__isnull=True)
+    elif status == 'trending':
+        listings = order_by_trending(listings)
+
+    category_slug = filters.categories[0] if len(filters.categories) == 1 else None
+    # The facet cube is cached, so the results are counted live for the pages to match them
+    result_count, (_, facets), category_stats, ending_ids = await asyncio.gather(
+        _value(len(listings)) if use_index else listings.acount(),
+        sync_to_async(facet_counts)(filters, categories),
+        CategoryPriceStats.objects.filter(category__slug=category_slug).afirst() if category_slug else _value(None),
+        sync_to_async(ending_soon_index.ids)(now, before=now + timedelta(hours=1)),
+    )
+
+    paginator = Paginator(listings, 12)
+    paginator.count = result_count
+    page_obj = paginator.get_page(request.GET.get('page'))
+    page_obj.object_list, ending_within_hour = await asyncio.gather(
+        alistings_for_ids(list(page_obj.object_list)) if use_index else _list(page_obj.object_list),
+        alistings_for_ids(ending_ids[:5]),
+    )
+
+    context = {
+        'listings': page_obj,
+        'categories': categories,
+        'search_query': filters.search,
+        'selected_category': category_slug,
+        'selected_categories': filters.categories,
+        'selected_prices': filters.prices,
+        'selected_status': status,
+        'facets': facets,
+        'result_count': result_count,
+        'page_obj': page_obj,
+        'is_paginated': paginator.num_pages > 1,
+        'ending_within_hour': ending_within_hour,
+        'category_stats': category_stats,
+    }
+    return await _render(request, 'auctions/home.html', context)
+
+
+@count_views
+@async_condition(etag_func=listing_etag, last_modified_func=listing_last_modified)
+@cache_anonymous_page(listing_etag)
+async def listing_detail(request, pk):
+    if request.method not in ('GET', 'HEAD'):
+        return await sync_to_async(views.listing_detail)(request, pk)
+
+    user = await _user(request)
+    try:
+        listing = await Listing.objects.aget(pk=pk)
+    except Listing.DoesNotExist:
+        raise Http404('No Listing matches the given query.')
+
+    bids, comments, is_watched, similar = await asyncio.gather(
+        _list(listing.bids.select_related('bidder')),
+        _list(listing.comments.select_related('author')),
+        Watchlist.objects.filter(user=user, listing=listing).aexists() if user.is_authenticated else _value(False),
+        _list(
+            SimilarListing.objects.filter(listing=listing, similar__is_active=True)
+            .select_related('similar__seller', 'similar__category')
+        ),
+    )
+
+    bid_form = None
+    comment_form = None
+    if user.is_authenticated:
+        if listing.is_active and not listing.is_ended():
+            bid_form = BidForm(listing=listing, user=user)
+        comment_form = CommentForm()
+
+    context = {
+        'listing': listing,
+        'bids': bids,
+        'comments': comments,
+        'bid_form': bid_form,
+        'comment_form': comment_form,
+        'is_watched': is_watched,
+        'total_bids': len(bids),
+        'similar_listings': [s.similar for s in similar],
+    }
+    return await _render(request, 'auctions/listing_detail.html', context)
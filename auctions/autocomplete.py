@@ -0,0 +1,366 @@
+import bisect
+import heapq
+import re
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db.models import Count
+from django.urls import reverse
+
+from .models import Bid, Category, Listing, Watchlist
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Most suggestions a lookup can return
+MAX_SUGGESTIONS = 20
+
+# Precomputed top lists run deeper than a lookup needs, so removals rarely force a rescan
+TOP_DEPTH = 2 * MAX_SUGGESTIONS
+
+# Indexed phrases (and queries) are cut to this many characters
+MAX_PHRASE_LENGTH = 64
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def normalize(text):
+    return ' '.join(tokenize(text))[:MAX_PHRASE_LENGTH]
+
+
+def phrases(text):
+    """'Canon AE-1 camera' -> {'canon ae 1 camera', 'ae 1 camera', '1 camera', 'camera'}."""
+    words = tokenize(text)
+    return {' '.join(words[i:])[:MAX_PHRASE_LENGTH] for i in range(len(words))}
+
+
+class PrefixIndex:
+    """
+    Ranked prefix lookup over scored suggestions.
+
+    Each suggestion is indexed under the phrases starting at each of its
+    words, all kept in one sorted list, so the suggestions matching a query
+    are a contiguous slice found by bisecting. Slices larger than
+    `scan_limit` keep a precomputed top list, maintained as suggestions
+    change, so a lookup never ranks more than `scan_limit` entries.
+    """
+
+    def __init__(self, scan_limit=256):
+        self.scan_limit = scan_limit
+        self._phrases = []  # sorted (phrase, key) pairs
+        self._keys = {}     # key -> (phrases, score)
+        self._top = {}      # prefix -> [(-score, key)], best first, at most TOP_DEPTH
+
+    def __len__(self):
+        return len(self._keys)
+
+    def build(self, items):
+        """Replace the contents with {key: (text, score)}."""
+        self._keys = {key: (tuple(phrases(text)), score) for key, (text, score) in items.items()}
+        self._phrases = sorted((phrase, key) for key, (keyed, _) in self._keys.items() for phrase in keyed)
+        sizes = Counter(prefix for phrase, _ in self._phrases for prefix in self._prefixes([phrase]))
+        self._top = {prefix: self._scan(prefix) for prefix, size in sizes.items() if size > self.scan_limit}
+
+    def _range(self, prefix):
+        lo = bisect.bisect_left(self._phrases, (prefix,))
+        hi = bisect.bisect_left(self._phrases, (prefix + '\U0010ffff',), lo)
+        return lo, hi
+
+    def _scan(self, prefix, lo=None, hi=None):
+        if lo is None:
+            lo, hi = self._range(prefix)
+        keys = {key for _, key in self._phrases[lo:hi]}
+        return heapq.nsmallest(TOP_DEPTH, ((-self._keys[key][1], key) for key in keys))
+
+    def _prefixes(self, keyed):
+        return {phrase[:i] for phrase in keyed for i in range(1, len(phrase) + 1)}
+
+    def set(self, key, text, score):
+        """Add or re-score a suggestion."""
+        if key in self._keys:
+            self.discard(key)
+        keyed = tuple(phrases(text))
+        self._keys[key] = (keyed, score)
+        for phrase in keyed:
+            bisect.insort(self._phrases, (phrase, key))
+        entry = (-score, key)
+        for prefix in self._prefixes(keyed):
+            top = self._top.get(prefix)
+            if top is not None and (len(top) < TOP_DEPTH or entry < top[-1]):
+                bisect.insort(top, entry)
+                del top[TOP_DEPTH:]
+
+    def discard(self, key):
+        existing = self._keys.pop(key, None)
+        if existing is None:
+            return
+        keyed, score = existing
+        for phrase in keyed:
+            i = bisect.bisect_left(self._phrases, (phrase, key))
+            if i < len(self._phrases) and self._phrases[i] == (phrase, key):
+                del self._phrases[i]
+        entry = (-score, key)
+        for prefix in self._prefixes(keyed):
+            top = self._top.get(prefix)
+            if top is None:
+                continue
+            i = bisect.bisect_left(top, entry)
+            if i < len(top) and top[i] == entry:
+                del top[i]
+                if len(top) < MAX_SUGGESTIONS:
+                    # Whatever ranked below the list is unknown, so rebuild it from the slice
+                    top[:] = self._scan(prefix)
+
+    def search(self, query, limit):
+        """Keys with a phrase starting with the normalized query, best first."""
+        top = self._top.get(query)
+        if top is None:
+            lo, hi = self._range(query)
+            if hi - lo > self.scan_limit:
+                # Grew past the limit since the build; keep its top list from now on
+                top = self._top[query] = self._scan(query, lo, hi)
+            else:
+                keys = {key for _, key in self._phrases[lo:hi]}
+                top = heapq.nsmallest(limit, ((-self._keys[key][1], key) for key in keys))
+        return [key for _, key in top[:limit]]
+
+
+class AutocompleteIndex:
+    """
+    Process-local suggestions for the search box: active listing titles
+    ranked by popularity (watchers + bids) and categories ranked by their
+    number of active listings.
+
+    Loaded on first use and kept up to date by the Listing and Category
+    signal handlers. Popularity is a snapshot, refreshed when the index is
+    reloaded after AUTOCOMPLETE_INDEX_TTL seconds: one request rebuilds it
+    while the others go on using the old one, and the changes signalled
+    meanwhile are applied again to the new one before it is swapped in.
+    """
+
+    # What a load replaces
+    STATE = (
+        '_titles', '_categories', '_listings', '_title_listings', '_display',
+        '_category_info', '_category_counts', '_suggestions',
+    )
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()  # held by the one load running
+        self._changes = None                # [(method, args)] signalled while it runs
+        self._generation = 0                # bumped by clear(), which voids a load running
+        self._titles = PrefixIndex()
+        self._categories = PrefixIndex()
+        self._listings = {}         # listing pk -> (title key, category id)
+        self._title_listings = {}   # title key -> {listing pk: popularity}
+        self._display = {}          # title key -> title as first seen
+        self._category_info = {}    # category pk -> (name, slug)
+        self._category_counts = {}  # category pk -> active listings
+        self._suggestions = {}      # title key or ('category', pk) -> rendered suggestion
+        self._loaded_at = None
+
+    def __len__(self):
+        return len(self._titles)
+
+    def _read(self):
+        """A new index built from the database, without touching this one."""
+        listings = list(
+            Listing.objects.filter(is_active=True).order_by().values_list('pk', 'title', 'category_id')
+        )
+        popularity = {}
+        for model in (Watchlist, Bid):
+            counts = (
+                model.objects.filter(listing__is_active=True)
+                .order_by()
+                .values_list('listing_id')
+                .annotate(n=Count('pk'))
+            )
+            for listing_id, n in counts:
+                popularity[listing_id] = popularity.get(listing_id, 0) + n
+        categories = list(Category.objects.values_list('pk', 'name', 'slug'))
+
+        fresh = AutocompleteIndex()
+        for pk, title, category_id in listings:
+            fresh._add_listing(pk, title, category_id, popularity.get(pk, 0))
+        fresh._category_info = {pk: (name, slug) for pk, name, slug in categories}
+        fresh._titles.build({key: (key, fresh._title_score(key)) for key in fresh._title_listings})
+        fresh._categories.build({
+            pk: (name, fresh._category_counts.get(pk, 0)) for pk, (name, _) in fresh._category_info.items()
+        })
+        return fresh
+
+    def _load(self):
+        # Called holding _load_lock; suggestions are served from the old index until the swap
+        with self._lock:
+            generation = self._generation
+            self._changes = []
+        try:
+            fresh = self._read()
+            with self._lock:
+                if generation != self._generation:
+                    # Cleared meanwhile, so what was read may predate the change
+                    return
+                self._swap(fresh)
+                self._loaded_at = time.monotonic()
+                changes, self._changes = self._changes, None
+                for method, args in changes:
+                    method(*args)
+        finally:
+            with self._lock:
+                self._changes = None
+
+    def load(self):
+        with self._load_lock:
+            self._load()
+
+    def _swap(self, index):
+        for name in self.STATE:
+            setattr(self, name, getattr(index, name))
+
+    def clear(self):
+        with self._lock:
+            self._swap(AutocompleteIndex())
+            self._loaded_at = None
+            self._generation += 1
+
+    def _ensure_loaded(self):
+        ttl = getattr(settings, 'AUTOCOMPLETE_INDEX_TTL', 600)
+        loaded_at = self._loaded_at
+        if loaded_at is None:
+            # Nothing to serve yet: wait for the load running, or run one
+            with self._load_lock:
+                if self._loaded_at is None:
+                    self._load()
+        elif ttl and time.monotonic() - loaded_at > ttl and self._load_lock.acquire(blocking=False):
+            # One request reloads; the others go on with the index as it is
+            try:
+                if self._loaded_at == loaded_at:
+                    self._load()
+            finally:
+                self._load_lock.release()
+
+    def _record(self, method, *args):
+        """Note a change for the load running (if any) to apply again once it swaps its index in."""
+        if self._changes is not None:
+            self._changes.append((method, args))
+
+    def _title_score(self, key):
+        # Each listing counts once on top of its watchers and bids
+        listings = self._title_listings[key]
+        return len(listings) + sum(listings.values())
+
+    def _add_listing(self, pk, title, category_id, popularity):
+        key = normalize(title)
+        if not key:
+            return None
+        self._listings[pk] = (key, category_id)
+        self._title_listings.setdefault(key, {})[pk] = popularity
+        self._display.setdefault(key, title.strip())
+        self._suggestions.pop(key, None)
+        if category_id is not None:
+            self._category_counts[category_id] = self._category_counts.get(category_id, 0) + 1
+        return key
+
+    def _remove_listing(self, pk):
+        key, category_id = self._listings.pop(pk)
+        listings = self._title_listings[key]
+        del listings[pk]
+        if not listings:
+            del self._title_listings[key]
+            del self._display[key]
+        self._suggestions.pop(key, None)
+        if category_id is not None:
+            self._category_counts[category_id] -= 1
+        return key, category_id
+
+    def _rescore(self, title_key=None, category_id=None):
+        if title_key is not None:
+            if title_key in self._title_listings:
+                self._titles.set(title_key, title_key, self._title_score(title_key))
+            else:
+                self._titles.discard(title_key)
+        if category_id is not None and category_id in self._category_info:
+            name, _ = self._category_info[category_id]
+            self._categories.set(category_id, name, self._category_counts.get(category_id, 0))
+
+    def update(self, listing):
+        """Add, rename or drop a listing after it has been saved."""
+        with self._lock:
+            self._record(self.update, listing)
+            if self._loaded_at is None:
+                return
+            current = self._listings.get(listing.pk)
+            if listing.is_active and current == (normalize(listing.title), listing.category_id):
+                # Bids save the listing too; nothing the index holds has changed
+                return
+            popularity = 0
+            if current is not None:
+                popularity = self._title_listings[current[0]][listing.pk]
+                self._remove_listing(listing.pk)
+                self._rescore(*current)
+            if listing.is_active:
+                key = self._add_listing(listing.pk, listing.title, listing.category_id, popularity)
+                self._rescore(key, listing.category_id)
+
+    def remove(self, pk):
+        with self._lock:
+            self._record(self.remove, pk)
+            if pk in self._listings:
+                self._rescore(*self._remove_listing(pk))
+
+    def update_category(self, category):
+        with self._lock:
+            self._record(self.update_category, category)
+            if self._loaded_at is None:
+                return
+            self._category_info[category.pk] = (category.name, category.slug)
+            self._suggestions.pop(('category', category.pk), None)
+            self._rescore(category_id=category.pk)
+
+    def remove_category(self, pk):
+        with self._lock:
+            self._record(self.remove_category, pk)
+            self._category_info.pop(pk, None)
+            self._suggestions.pop(('category', pk), None)
+            self._categories.discard(pk)
+
+    def _title_suggestion(self, key):
+        suggestion = self._suggestions.get(key)
+        if suggestion is None:
+            title = self._display[key]
+            pks = self._title_listings[key]
+            if len(pks) == 1:
+                url = reverse('listing_detail', args=[next(iter(pks))])
+            else:
+                # Several listings share the title; send the user to the search results
+                url = '%s?%s' % (reverse('home'), urlencode({'search': title}))
+            suggestion = self._suggestions[key] = {'title': title, 'url': url}
+        return suggestion
+
+    def _category_suggestion(self, pk):
+        suggestion = self._suggestions.get(('category', pk))
+        if suggestion is None:
+            name, slug = self._category_info[pk]
+            url = '%s?%s' % (reverse('home'), urlencode({'category': slug}))
+            suggestion = self._suggestions[('category', pk)] = {'name': name, 'url': url}
+        return suggestion
+
+    def suggest(self, query, limit=10):
+        """Return {'categories': [...], 'listings': [...]} for what has been typed into the search box."""
+        self._ensure_loaded()
+        query = normalize(query)
+        if not query:
+            return {'categories': [], 'listings': []}
+        limit = max(1, min(limit, MAX_SUGGESTIONS))
+        with self._lock:
+            return {
+                'categories': [self._category_suggestion(pk) for pk in self._categories.search(query, min(limit, 3))],
+                'listings': [self._title_suggestion(key) for key in self._titles.search(query, limit)],
+            }
+
+
+autocomplete_index = AutocompleteIndex()
@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+
+USER_CACHE_KEY = 'auctions:user:%s'
+
+
+def user_cache_key(user_id):
+    return USER_CACHE_KEY % user_id
+
+
+def get_cache():
+    # Shared by every worker process, or a deleted entry lives on in the others (see auctions/checks.py)
+    return caches[getattr(settings, 'AUTH_USER_CACHE_ALIAS', 'default')]
+
+
+def invalidate_cached_user(user_id):
+    get_cache().delete(user_cache_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend that serves the per-request user lookup from the cache.
+    Entries are dropped whenever the user is saved or deleted; changes made
+    with QuerySet.update() must call invalidate_cached_user() themselves.
+    """
+
+    def get_user(self, user_id):
+        cache = get_cache()
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 5 * 60))
+        return user
@@ -0,0 +1,255 @@
+"""
+Append-only log of bid acceptances, rejections and auction closes, kept
+alongside the database as the history `Listing.current_bid` and `winner`
+can be rebuilt from (see `manage.py replay_bid_log`).
+
+Events are fixed-size binary records (RECORD) in segment files under
+BID_LOG_DIR. Each process appends to its own segment, so writers never
+share a file, and starts a new one after BID_LOG_SEGMENT_SIZE bytes.
+Segments are never rewritten. Appends are buffered and written with one
+write() + fsync() per batch: after BID_LOG_FSYNC_BATCH events, or at most
+BID_LOG_FSYNC_INTERVAL seconds after the oldest unsynced one. A crash can
+lose that window, and a torn final record is ignored on replay.
+"""
+import atexit
+import logging
+import os
+import struct
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .models import Listing
+
+logger = logging.getLogger(__name__)
+
+ACCEPTED = 1
+REJECTED = 2
+CLOSED = 3
+
+# Amounts are stored in cents; -1 means none (a close without a winner, or
+# a rejected bid whose amount didn't parse). User 0 means none.
+RECORD = np.dtype([
+    ('time', '<f8'),
+    ('listing', '<i8'),
+    ('user', '<i8'),
+    ('amount', '<i8'),
+    ('kind', 'u1'),
+    ('padding', 'V7'),
+])
+_PACK = struct.Struct('<dqqqB7x')
+assert _PACK.size == RECORD.itemsize
+
+MAGIC = b'BIDLOG01'
+HEADER = struct.Struct('<8sI4x')
+
+SEGMENT_SUFFIX = '.seg'
+
+# Larger than any Bid.amount (max_digits=10, decimal_places=2) and safe as int64 cents
+MAX_AMOUNT = Decimal(10) ** 12
+
+
+def log_dir():
+    return Path(getattr(settings, 'BID_LOG_DIR', settings.BASE_DIR / 'bid_log'))
+
+
+def to_cents(amount):
+    return -1 if amount is None else int((Decimal(amount) * 100).to_integral_value())
+
+
+def from_cents(cents):
+    return None if cents < 0 else Decimal(int(cents)) / 100
+
+
+class BidLog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buffer = bytearray()
+        self._pending_since = None
+        self._fd = None
+        self._segment_bytes = 0
+        self._flusher = None
+
+    def append(self, kind, listing_id, user_id=None, amount=None, at=None):
+        record = _PACK.pack(
+            time.time() if at is None else at, listing_id, user_id or 0, to_cents(amount), kind
+        )
+        with self._lock:
+            self._buffer += record
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            batch = getattr(settings, 'BID_LOG_FSYNC_BATCH', 256)
+            interval = getattr(settings, 'BID_LOG_FSYNC_INTERVAL', 0.05)
+            if (
+                len(self._buffer) >= batch * RECORD.itemsize
+                or time.monotonic() - self._pending_since >= interval
+            ):
+                self._flush_locked()
+            elif self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_periodically, args=(interval,), daemon=True)
+                self._flusher.start()
+
+    def _flush_periodically(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except OSError:
+                logger.exception('Could not write the bid log')
+
+    def _open_segment(self):
+        directory = log_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        # Named by creation time, then pid, so a directory listing is roughly chronological
+        path = directory / ('%020d-%d%s' % (time.time_ns(), os.getpid(), SEGMENT_SUFFIX))
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o644)
+        header = HEADER.pack(MAGIC, RECORD.itemsize)
+        os.write(self._fd, header)
+        self._segment_bytes = len(header)
+
+    def _flush_locked(self):
+        if not self._buffer:
+            return
+        segment_size = getattr(settings, 'BID_LOG_SEGMENT_SIZE', 64 * 1024 * 1024)
+        if self._fd is not None and self._segment_bytes + len(self._buffer) > segment_size:
+            os.close(self._fd)
+            self._fd = None
+        if self._fd is None:
+            self._open_segment()
+        data = memoryview(self._buffer)
+        while data:
+            written = os.write(self._fd, data)
+            data = data[written:]
+        os.fsync(self._fd)
+        self._segment_bytes += len(self._buffer)
+        self._buffer = bytearray()
+        self._pending_since = None
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        with self._lock:
+            self._flush_locked()
+            if self._fd is not None:
+                os.close(self._fd)
+            self._fd = None
+
+
+bid_log = BidLog()
+atexit.register(bid_log.close)
+# A forked worker starts with no buffer, segment or flusher thread of its own;
+# the parent's lock may even be held by its flusher at the moment of the fork
+os.register_at_fork(after_in_child=bid_log.__init__)
+
+
+def record_accepted(bid):
+    """Log an accepted bid once the transaction saving it commits."""
+    transaction.on_commit(lambda: bid_log.append(ACCEPTED, bid.listing_id, bid.bidder_id, bid.amount))
+
+
+def record_rejected(listing_id, user_id, posted_amount):
+    """Log a refused bid; `posted_amount` is the raw form value."""
+    try:
+        amount = Decimal(posted_amount)
+    except (InvalidOperation, TypeError, ValueError):
+        amount = None
+    if amount is not None and not (amount.is_finite() and 0 <= amount < MAX_AMOUNT):
+        amount = None
+    bid_log.append(REJECTED, listing_id, user_id, amount)
+
+
+def record_closed(listing):
+    """Log an auction close (with its winner and final price, if it has one) once it commits."""
+    amount = listing.current_bid if listing.winner_id else None
+    transaction.on_commit(lambda: bid_log.append(CLOSED, listing.pk, listing.winner_id, amount))
+
+
+def segments(directory=None):
+    directory = Path(directory) if directory is not None else log_dir()
+    if not directory.is_dir():
+        return []
+    return sorted(directory.glob('*' + SEGMENT_SUFFIX))
+
+
+def read_segment(path):
+    """Memory-map a segment's complete records as a RECORD array."""
+    size = os.path.getsize(path)
+    if size <= HEADER.size:
+        return np.empty(0, dtype=RECORD)
+    with open(path, 'rb') as f:
+        magic, itemsize = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or itemsize != RECORD.itemsize:
+        raise ValueError(f'{path} is not a bid log segment')
+    # A torn final record (crash mid-write) is left out
+    count = (size - HEADER.size) // RECORD.itemsize
+    if not count:
+        return np.empty(0, dtype=RECORD)
+    return np.memmap(path, dtype=RECORD, mode='r', offset=HEADER.size, shape=(count,))
+
+
+def replay(listing_ids=None, directory=None):
+    """
+    Rebuild listing state from the log. Returns {listing id: (current_bid,
+    winner id, closed)} for every listing with an accepted bid or a close
+    logged (or only those in `listing_ids`). Rejected bids alone say
+    nothing about a listing's state, which may come from bids placed
+    before the log existed.
+
+    current_bid is the highest accepted bid, or the price recorded at close
+    for bids placed before the log existed. A closed listing's winner is
+    the bidder of that bid, so the result doesn't depend on the order
+    events from different processes' segments were written in.
+    """
+    wanted = None if listing_ids is None else np.asarray(sorted(listing_ids), dtype=np.int64)
+    listings, users, amounts, closed, seen = [], [], [], [], []
+    for path in segments(directory):
+        events = read_segment(path)
+        if wanted is not None:
+            events = events[np.isin(events['listing'], wanted)]
+        kinds = events['kind']
+        is_closed = kinds == CLOSED
+        # User 0 is no one: a close without a winner prices nothing
+        priced = (kinds == ACCEPTED) | (is_closed & (events['amount'] >= 0) & (events['user'] > 0))
+        listings.append(events['listing'][priced])
+        users.append(events['user'][priced])
+        amounts.append(events['amount'][priced])
+        closed.append(events['listing'][is_closed])
+        seen.append(np.unique(events['listing'][(kinds == ACCEPTED) | is_closed]))
+    if not seen:
+        return {}
+
+    listings, users, amounts = np.concatenate(listings), np.concatenate(users), np.concatenate(amounts)
+    # Highest amount per listing: sort by listing then amount, keep the last of each run
+    order = np.lexsort((amounts, listings))
+    listings, users, amounts = listings[order], users[order], amounts[order]
+    last = np.append(listings[1:] != listings[:-1], True) if len(listings) else np.empty(0, dtype=bool)
+    top = {
+        listing: (from_cents(amount), user)
+        for listing, user, amount in zip(listings[last].tolist(), users[last].tolist(), amounts[last].tolist())
+    }
+    closed = set(np.concatenate(closed).tolist())
+
+    result = {}
+    for listing in np.unique(np.concatenate(seen)).tolist():
+        current_bid, user = top.get(listing, (None, None))
+        # Open auctions have no winner yet
+        result[listing] = (current_bid, user if listing in closed else None, listing in closed)
+    return result
+
+
+def find_drift(state, chunk_size=900):
+    """Yield (listing id, current_bid, winner id) for listings whose row differs from `state`."""
+    ids = sorted(state)
+    for start in range(0, len(ids), chunk_size):
+        rows = Listing.objects.filter(pk__in=ids[start:start + chunk_size]).values_list('pk', 'current_bid', 'winner_id')
+        for pk, current_bid, winner_id in rows:
+            replayed_bid, replayed_winner, _ = state[pk]
+            if (current_bid, winner_id) != (replayed_bid, replayed_winner):
+                yield pk, replayed_bid, replayed_winner
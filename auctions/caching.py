@@ -0,0 +1,294 @@
+"""
+Conditional responses and page caching for the browse and listing pages.
+
+The browse pages are validated against the catalog's last-modified time.
+It is kept in the database (a JobCheckpoint row, stamped once each change
+commits) so that every worker process and host agrees on it, and each
+process reuses what it read for CATALOG_VERSION_TTL seconds. A change is
+therefore seen everywhere within that time, whichever cache backend is
+configured. The trending pages also go by a second such time, stamped
+when view counts are written.
+"""
+import hashlib
+import logging
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .models import JobCheckpoint, Listing
+
+logger = logging.getLogger(__name__)
+
+CATALOG_CHECKPOINT = 'catalog:modified'
+TRENDING_CHECKPOINT = 'catalog:trending'
+
+
+class CatalogClock:
+    """
+    This process's copy of a last-modified time kept in the JobCheckpoint
+    row `name`.
+
+    Stamping writes that row, so a process stamps at most once per
+    CATALOG_VERSION_TTL: a change within that time of its last stamp is
+    covered by one more stamp when the time is up. Other processes take
+    as long to read it anyway.
+    """
+
+    def __init__(self, name=CATALOG_CHECKPOINT):
+        self.name = name
+        self._lock = threading.Lock()
+        self._modified = None
+        self._read_at = None
+        self._stamped_at = None
+        self._deferred = None
+
+    def get(self):
+        ttl = getattr(settings, 'CATALOG_VERSION_TTL', 1)
+        with self._lock:
+            if self._read_at is not None and time.monotonic() - self._read_at < ttl:
+                return self._modified
+        modified = JobCheckpoint.objects.filter(name=self.name).values_list('timestamp', flat=True).first()
+        if modified is None:
+            # Never stamped, so assume everything just changed
+            modified = self._write()
+        with self._lock:
+            self._modified, self._read_at = modified.timestamp(), time.monotonic()
+            return self._modified
+
+    def _write(self):
+        now = timezone.now()
+        if not JobCheckpoint.objects.filter(name=self.name).update(timestamp=now):
+            try:
+                with transaction.atomic():
+                    JobCheckpoint.objects.create(name=self.name, timestamp=now)
+            except IntegrityError:
+                # Created by another process meanwhile
+                JobCheckpoint.objects.filter(name=self.name).update(timestamp=now)
+        with self._lock:
+            # The process that made the change sees it at once
+            self._modified, self._read_at = now.timestamp(), time.monotonic()
+            self._stamped_at = time.monotonic()
+        return now
+
+    def stamp(self):
+        ttl = getattr(settings, 'CATALOG_VERSION_TTL', 1)
+        with self._lock:
+            since = None if self._stamped_at is None else time.monotonic() - self._stamped_at
+            if since is not None and since < ttl:
+                if self._deferred is None:
+                    self._deferred = threading.Timer(ttl - since, self._stamp_deferred)
+                    self._deferred.daemon = True
+                    self._deferred.start()
+                # The version this process just wrote is still the newest anyone reads
+                self._modified, self._read_at = time.time(), time.monotonic()
+                return
+        self._write()
+
+    def _stamp_deferred(self):
+        with self._lock:
+            self._deferred = None
+        try:
+            self._write()
+        except DatabaseError:
+            logger.exception('Could not stamp %s', self.name)
+        finally:
+            # The timer's thread has a connection of its own
+            connection.close()
+
+    def expire(self):
+        with self._lock:
+            self._read_at = None
+
+
+catalog_clock = CatalogClock()
+# When ListingViews last changed, for the pages ordered by trending
+trending_clock = CatalogClock(TRENDING_CHECKPOINT)
+
+
+def catalog_modified():
+    """Timestamp of the last change to anything shown on the browse pages."""
+    return catalog_clock.get()
+
+
+def touch_catalog():
+    """Mark the browse pages changed, once the current transaction commits."""
+    transaction.on_commit(catalog_clock.stamp)
+
+
+def touch_listing(listing_id):
+    Listing.objects.filter(pk=listing_id).update(updated_at=timezone.now())
+    touch_catalog()
+
+
+def _is_anonymous_get(request):
+    return request.method in ('GET', 'HEAD') and not request.user.is_authenticated
+
+
+def _normalized_query(request):
+    return '&'.join(
+        '%s=%s' % (key, value)
+        for key in sorted(request.GET)
+        for value in request.GET.getlist(key)
+        if value
+    )
+
+
+def catalog_etag(request, *args, **kwargs):
+    if not _is_anonymous_get(request):
+        return None
+    parts = [repr(catalog_modified()), request.path, _normalized_query(request)]
+    if request.GET.get('status') == 'trending':
+        # Reordered as views are counted, which leaves the catalog stamp alone
+        parts.append(repr(trending_clock.get()))
+    if request.GET.get('status') in ('ending_soon', 'trending'):
+        # These pages change as time passes, not only when data changes
+        parts.append(str(int(time.time() // 60)))
+    return hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    if not _is_anonymous_get(request):
+        return None
+    modified = catalog_modified()
+    if request.GET.get('status') == 'trending':
+        modified = max(modified, trending_clock.get())
+    return datetime.fromtimestamp(modified, tz=dt_timezone.utc)
+
+
+def _listing_state(request, pk):
+    if not hasattr(request, '_listing_state'):
+        request._listing_state = (
+            Listing.objects.filter(pk=pk).values_list('updated_at', 'end_date').first()
+        )
+    return request._listing_state
+
+
+def listing_etag(request, pk):
+    if not _is_anonymous_get(request):
+        return None
+    state = _listing_state(request, pk)
+    if state is None:
+        return None
+    updated_at, end_date = state
+    ended = timezone.now() > end_date
+    return '%s-%s-%d' % (pk, updated_at.timestamp(), ended)
+
+
+def listing_last_modified(request, pk):
+    if not _is_anonymous_get(request):
+        return None
+    state = _listing_state(request, pk)
+    if state is None:
+        return None
+    updated_at, end_date = state
+    if end_date < timezone.now():
+        return max(updated_at, end_date)
+    return updated_at
+
+
+def _page_cache_key(request, etag_func, *args, **kwargs):
+    """Cache key for this request's page, or None when it must not be cached."""
+    if not _is_anonymous_get(request) or len(get_messages(request)):
+        return None
+    etag = etag_func(request, *args, **kwargs)
+    if etag is None:
+        return None
+    return 'auctions:page:%s:%s' % (
+        hashlib.md5(request.path.encode()).hexdigest(),
+        hashlib.md5(('%s|%s' % (etag, _normalized_query(request))).encode()).hexdigest(),
+    )
+
+
+def _is_cacheable(request, response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+    )
+
+
+def cache_anonymous_page(etag_func):
+    """
+    Cache the rendered page for anonymous GETs for ANONYMOUS_PAGE_CACHE_TIMEOUT
+    seconds. Entries are keyed on the page's ETag, so any change that moves
+    the ETag makes the old entry unreachable. Works on sync and async views.
+    """
+    def decorator(view_func):
+        timeout = getattr(settings, 'ANONYMOUS_PAGE_CACHE_TIMEOUT', 30)
+
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def _async_wrapped_view(request, *args, **kwargs):
+                key = await sync_to_async(_page_cache_key)(request, etag_func, *args, **kwargs)
+                if key is None:
+                    return await view_func(request, *args, **kwargs)
+                cached = await cache.aget(key)
+                if cached is not None:
+                    content, content_type = cached
+                    return HttpResponse(content, content_type=content_type)
+                response = await view_func(request, *args, **kwargs)
+                if _is_cacheable(request, response):
+                    await cache.aset(key, (response.content, response.headers['Content-Type']), timeout)
+                return response
+            return _async_wrapped_view
+
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            key = _page_cache_key(request, etag_func, *args, **kwargs)
+            if key is None:
+                return view_func(request, *args, **kwargs)
+            cached = cache.get(key)
+            if cached is not None:
+                content, content_type = cached
+                return HttpResponse(content, content_type=content_type)
+            response = view_func(request, *args, **kwargs)
+            if _is_cacheable(request, response):
+                cache.set(key, (response.content, response.headers['Content-Type']), timeout)
+            return response
+        return _wrapped_view
+    return decorator
+
+
+def _validators(request, etag_func, last_modified_func, *args, **kwargs):
+    etag = etag_func(request, *args, **kwargs)
+    last_modified = last_modified_func(request, *args, **kwargs)
+    return (
+        quote_etag(etag) if etag is not None else None,
+        int(last_modified.timestamp()) if last_modified else None,
+    )
+
+
+def async_condition(etag_func, last_modified_func):
+    """
+    django.views.decorators.http.condition for async views. The validators
+    are sync functions and run in a worker thread.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        async def _wrapped_view(request, *args, **kwargs):
+            etag, last_modified = await sync_to_async(_validators)(
+                request, etag_func, last_modified_func, *args, **kwargs
+            )
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view_func(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD'):
+                if last_modified and not response.has_header('Last-Modified'):
+                    response.headers['Last-Modified'] = http_date(last_modified)
+                if etag:
+                    response.headers.setdefault('ETag', etag)
+            return response
+        return _wrapped_view
+    return decorator
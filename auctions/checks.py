@@ -0,0 +1,54 @@
+"""
+Caches that must be shared by every worker process.
+
+Sessions and cached user lookups are invalidated by deleting their cache
+entries, and throttle buckets are counts every worker must add to; both
+only work across processes when the cache is shared. A process-local
+backend (LocMemCache) is fine for a single process, such as runserver;
+with several workers each keeps its own copy. The deploy check below
+reports it, and gunicorn.conf.py refuses to start several workers with it.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Tags, Warning, register
+
+CACHED_SESSION_ENGINES = (
+    'auctions.sessions',
+    'django.contrib.sessions.backends.cache',
+    'django.contrib.sessions.backends.cached_db',
+)
+
+
+def shared_cache_uses():
+    """[(what, cache alias)] for every feature that needs its cache shared across processes."""
+    uses = []
+    if settings.SESSION_ENGINE in CACHED_SESSION_ENGINES:
+        uses.append(('sessions', settings.SESSION_CACHE_ALIAS))
+    if 'auctions.backends.CachedModelBackend' in settings.AUTHENTICATION_BACKENDS:
+        uses.append(('cached user lookups', getattr(settings, 'AUTH_USER_CACHE_ALIAS', 'default')))
+    if 'auctions.middleware.ThrottleMiddleware' in settings.MIDDLEWARE and getattr(settings, 'THROTTLE_RATES', None):
+        uses.append(('throttle buckets', getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default')))
+    return uses
+
+
+def process_local_caches():
+    """{cache alias: [what uses it]} for the shared_cache_uses() whose cache is process-local."""
+    local = {}
+    for what, alias in shared_cache_uses():
+        if isinstance(caches[alias], LocMemCache):
+            local.setdefault(alias, []).append(what)
+    return local
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_caches(app_configs, **kwargs):
+    return [
+        Warning(
+            f'{", ".join(uses)} use the {alias!r} cache, which is local to each process; '
+            'with several worker processes, each sees only its own entries.',
+            hint='Point it at a shared backend such as Redis (set REDIS_URL), or run a single process.',
+            id='auctions.W001',
+        )
+        for alias, uses in process_local_caches().items()
+    ]
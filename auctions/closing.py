@@ -0,0 +1,159 @@
+"""
+Closing ended auctions, from any number of worker processes or hosts.
+
+Workers claim batches of due listings by writing a lease (an owner name
+and an expiry) onto them: with SELECT ... FOR UPDATE SKIP LOCKED where the
+database has it, otherwise with one UPDATE whose WHERE clause re-checks
+that the listings are still unclaimed. A worker that dies leaves leases
+that expire after AUCTION_CLOSE_LEASE seconds, and the listings are then
+claimed again.
+
+Closing is idempotent. A listing is only closed by an UPDATE matching it
+while it is active and leased to the caller, and the winner's and seller's
+notifications are queued as NotificationEvents (sent by send_notifications)
+in the same transaction. However many workers run, and whichever of them
+crash, each auction is closed and notified once.
+"""
+import multiprocessing
+import os
+import socket
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Case, F, OuterRef, Q, Subquery, Value, When
+from django.utils import timezone
+
+from .autocomplete import autocomplete_index
+from .bid_log import bid_log, record_closed
+from .caching import touch_catalog
+from .ending_soon import ending_soon_index
+from .models import Bid, Listing, NotificationEvent
+
+BATCH_SIZE = 100
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def lease_duration():
+    return timedelta(seconds=getattr(settings, 'AUCTION_CLOSE_LEASE', 60))
+
+
+def due(now):
+    """Active listings past their end_date that no unexpired lease holds."""
+    return Listing.objects.filter(is_active=True, end_date__lte=now).filter(
+        Q(close_lease_expires__isnull=True) | Q(close_lease_expires__lte=now)
+    )
+
+
+def claim(owner, now=None, batch_size=BATCH_SIZE):
+    """Lease up to `batch_size` due listings, longest ended first, to `owner`. Returns their ids."""
+    now = now or timezone.now()
+    expires = now + lease_duration()
+    candidates = due(now).order_by('end_date')
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            # Rows another worker is claiming are passed over instead of waited for
+            ids = list(candidates.select_for_update(skip_locked=True).values_list('pk', flat=True)[:batch_size])
+            Listing.objects.filter(pk__in=ids).update(close_lease_owner=owner, close_lease_expires=expires)
+            return ids
+        # A single statement, so no other worker can claim between the selection and the write
+        due(now).filter(pk__in=candidates.values('pk')[:batch_size]).update(
+            close_lease_owner=owner, close_lease_expires=expires
+        )
+        return list(
+            Listing.objects.filter(is_active=True, close_lease_owner=owner, close_lease_expires=expires)
+            .order_by()
+            .values_list('pk', flat=True)
+        )
+
+
+def close_batch(ids, owner=None, now=None):
+    """
+    Close the listings in `ids` that are still active and leased to
+    `owner`, or, with no owner, not held by any unexpired lease. Returns
+    the ids this call closed.
+    """
+    now = now or timezone.now()
+    if owner is None:
+        held = due(now)
+    else:
+        # An auction extended after it was leased isn't due any more
+        held = Listing.objects.filter(is_active=True, end_date__lte=now, close_lease_owner=owner)
+    top = Bid.objects.filter(listing=OuterRef('pk')).order_by('-amount', 'pk')
+    with transaction.atomic():
+        # Lock the rows still held, then see which they are: the others were closed
+        # already, extended, or their lease expired and another worker holds them now.
+        # The write comes first: SQLite makes a transaction that reads first fail with
+        # "database is locked" where one that begins with a write waits its turn
+        held.filter(pk__in=ids).update(updated_at=now)
+        rows = (
+            held.filter(pk__in=ids)
+            .annotate(top_bidder=Subquery(top.values('bidder_id')[:1]), top_amount=Subquery(top.values('amount')[:1]))
+            .values_list('pk', 'seller_id', 'top_bidder', 'top_amount')
+        )
+        # Read under the lock, so no bid placed before the close is missed
+        rows = {pk: row for pk, *row in rows}
+        closed = list(rows)
+        sold = [pk for pk in closed if rows[pk][1] is not None]
+        Listing.objects.filter(pk__in=closed).update(
+            is_active=False,
+            withdrawn_at=None,
+            closed_at=now,
+            winner_id=Case(*(When(pk=pk, then=Value(rows[pk][1])) for pk in sold), default=None),
+            current_bid=Case(*(When(pk=pk, then=Value(rows[pk][2])) for pk in sold), default=F('current_bid')),
+            close_lease_owner='',
+            close_lease_expires=None,
+        )
+        events = []
+        for pk in closed:
+            seller_id, winner_id, amount = rows[pk]
+            events.append(NotificationEvent(user_id=seller_id, listing_id=pk, kind='ended', amount=amount))
+            if winner_id is not None:
+                events.append(NotificationEvent(user_id=winner_id, listing_id=pk, kind='won', amount=amount))
+            record_closed(Listing(pk=pk, winner_id=winner_id, current_bid=amount))
+        NotificationEvent.objects.bulk_create(events)
+    # What Listing.save() signals would do, once per batch
+    for pk in closed:
+        ending_soon_index.remove(pk)
+        autocomplete_index.remove(pk)
+    if closed:
+        touch_catalog()
+    return closed
+
+
+def close_listing(pk):
+    """Close one ended listing now, unless a worker is closing it. Returns whether this call did."""
+    return bool(close_batch([pk]))
+
+
+def run(owner=None, batch_size=BATCH_SIZE, progress=None):
+    """Claim and close batches until no listing is due. Returns the number closed."""
+    owner = owner or worker_name()
+    total = 0
+    try:
+        while True:
+            ids = claim(owner, batch_size=batch_size)
+            if not ids:
+                return total
+            total += len(close_batch(ids, owner))
+            if progress:
+                progress(total)
+    finally:
+        # Forked workers exit without running atexit hooks, so the closes this
+        # run logged would be lost with the process's buffer
+        bid_log.flush()
+
+
+def run_workers(workers=1, batch_size=BATCH_SIZE):
+    """run() in `workers` forked processes, each under its own lease owner. Returns the number closed."""
+    if workers < 2:
+        return run(batch_size=batch_size)
+    # Workers are forked and open their own connections; none may inherit ours
+    connections.close_all()
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) as executor:
+        return sum(executor.map(run, [None] * workers, [batch_size] * workers))
@@ -0,0 +1,44 @@
+from itertools import islice
+
+import numpy as np
+
+# Pseudo dtype: datetimes are converted to float seconds since the epoch
+EPOCH = 'epoch'
+
+
+def _to_array(values, dtype):
+    if dtype == EPOCH:
+        return np.array([v.timestamp() if v is not None else np.nan for v in values], dtype=np.float64)
+    if np.dtype(dtype).kind == 'f':
+        return np.array([np.nan if v is None else float(v) for v in values], dtype=dtype)
+    if np.dtype(dtype).kind in 'iu':
+        # Nullable foreign keys are read as -1
+        return np.array([-1 if v is None else v for v in values], dtype=dtype)
+    return np.array(values, dtype=dtype)
+
+
+def iter_column_chunks(queryset, columns, chunk_size=100000):
+    """
+    Yield the queryset as tuples of NumPy arrays, one array per column and
+    at most chunk_size rows per tuple. `columns` maps field lookups to dtypes.
+    """
+    fields = list(columns)
+    dtypes = [columns[field] for field in fields]
+    rows = queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+    while True:
+        block = list(islice(rows, chunk_size))
+        if not block:
+            return
+        yield tuple(_to_array(values, dtype) for values, dtype in zip(zip(*block), dtypes))
+
+
+def fetch_columns(queryset, columns, chunk_size=100000):
+    """Load a whole queryset as one NumPy array per column."""
+    chunks = [[] for _ in columns]
+    for arrays in iter_column_chunks(queryset, columns, chunk_size):
+        for i, array in enumerate(arrays):
+            chunks[i].append(array)
+    return tuple(
+        np.concatenate(parts) if parts else _to_array([], dtype)
+        for parts, dtype in zip(chunks, columns.values())
+    )
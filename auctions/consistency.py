@@ -0,0 +1,176 @@
+"""
+Check (and optionally repair) the invariants that tie a listing's
+denormalized columns to its bids:
+
+    current_bid    equals the highest bid, or is NULL when there are none
+    preset_bid     current_bid was pre-set to starting_bid with no bids
+                   (as populate_sample_data does)
+    winner         is the top bidder once the auction is closed, and unset
+                   while it is open or if it was withdrawn (withdrawn_at,
+                   set by auctions.moderation)
+    active_past_end   is_active is still set after end_date
+
+Listings are checked in primary-key ranges, one query per range that
+returns only the violating rows, spread over worker processes. Progress
+is a JobCheckpoint watermark below which every range has been checked
+(and repaired), so an interrupted run can be resumed.
+"""
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from django.db import connections, transaction
+from django.db.models import F, Max, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .caching import touch_catalog
+from .models import Bid, JobCheckpoint, Listing
+
+CHECKPOINT = 'consistency:listings'
+
+INVARIANTS = {
+    'current_bid': 'current_bid is not the highest bid',
+    'preset_bid': 'current_bid pre-set to starting_bid without any bids',
+    'winner': 'winner is not the top bidder of a closed auction (or is set on an open or withdrawn one)',
+    'active_past_end': 'still active after end_date (run close_ended_auctions)',
+}
+
+# Only these are repaired; closing auctions is left to close_ended_auctions, which also notifies
+REPAIRABLE = {'current_bid', 'preset_bid', 'winner'}
+
+
+def _checked(listings, now):
+    """Annotate listings with their top bid and keep only the rows breaking an invariant."""
+    top = Bid.objects.filter(listing=OuterRef('pk')).order_by('-amount', 'pk')
+    listings = listings.annotate(
+        top_amount=Subquery(top.values('amount')[:1]),
+        top_bidder=Subquery(top.values('bidder_id')[:1]),
+    )
+    # -1 and 0 stand in for NULL so that NULL = NULL compares as equal
+    bid_drift = ~Q(current_bid_or_none=F('top_amount_or_none'))
+    winner_drift = Q(is_active=False, withdrawn_at__isnull=True) & ~Q(winner_or_none=F('top_bidder_or_none'))
+    no_winner_owed = Q(is_active=True) | Q(withdrawn_at__isnull=False)
+    return listings.annotate(
+        current_bid_or_none=Coalesce('current_bid', Value(Decimal('-1'))),
+        top_amount_or_none=Coalesce('top_amount', Value(Decimal('-1'))),
+        winner_or_none=Coalesce('winner_id', Value(0)),
+        top_bidder_or_none=Coalesce('top_bidder', Value(0)),
+    ).filter(
+        bid_drift | winner_drift | (no_winner_owed & Q(winner__isnull=False)) | Q(is_active=True, end_date__lte=now)
+    )
+
+
+def _violations(row, now):
+    pk, current_bid, starting_bid, winner_id, is_active, withdrawn_at, end_date, top_amount, top_bidder = row
+    found = []
+    if current_bid != top_amount:
+        found.append('preset_bid' if top_amount is None and current_bid == starting_bid else 'current_bid')
+    expected_winner = None if is_active or withdrawn_at else top_bidder
+    if winner_id != expected_winner:
+        found.append('winner')
+    if is_active and end_date <= now:
+        found.append('active_past_end')
+    return {
+        'listing': pk,
+        'invariants': found,
+        'current_bid': top_amount,
+        'winner': expected_winner,
+        'found_current_bid': current_bid,
+        'found_winner': winner_id,
+    }
+
+
+FIELDS = [
+    'pk', 'current_bid', 'starting_bid', 'winner_id', 'is_active', 'withdrawn_at', 'end_date', 'top_amount', 'top_bidder',
+]
+
+
+def check_range(low, high, now):
+    """Violations for listings with low < pk <= high."""
+    rows = _checked(Listing.objects.filter(pk__gt=low, pk__lte=high).order_by('pk'), now).values_list(*FIELDS)
+    return high, [v for v in (_violations(row, now) for row in rows) if v['invariants']]
+
+
+def _check_range(args):
+    return check_range(*args)
+
+
+def repair(violations, now):
+    """
+    Bring current_bid and winner back in line with the bids. The flagged
+    rows are re-checked inside the transaction first, so a bid placed since
+    the scan isn't overwritten with a stale value.
+    """
+    ids = [v['listing'] for v in violations if REPAIRABLE.intersection(v['invariants'])]
+    if not ids:
+        return 0
+    with transaction.atomic():
+        rows = _checked(Listing.objects.select_for_update().filter(pk__in=ids), now).values_list(*FIELDS)
+        fixes = [_violations(row, now) for row in rows]
+        # bulk_update() doesn't set auto_now fields; the pages' validators need updated_at to move
+        updated_at = timezone.now()
+        listings = [
+            Listing(pk=v['listing'], current_bid=v['current_bid'], winner_id=v['winner'], updated_at=updated_at)
+            for v in fixes
+            if REPAIRABLE.intersection(v['invariants'])
+        ]
+        Listing.objects.bulk_update(listings, ['current_bid', 'winner', 'updated_at'], batch_size=1000)
+        if listings:
+            touch_catalog()
+    return len(listings)
+
+
+def _json(value):
+    return str(value) if isinstance(value, Decimal) else value
+
+
+def run(chunk_size=10000, workers=1, repair_drift=False, resume=False, report=None, progress=None):
+    """
+    Check every listing above the checkpoint (or all of them unless
+    `resume`), appending violations to `report` (a text file) as JSON lines.
+    Returns ({invariant: count}, listings repaired).
+    """
+    checkpoint, _ = JobCheckpoint.objects.get_or_create(name=CHECKPOINT)
+    if not resume or checkpoint.timestamp is None:
+        # A resumed run judges "past end_date" against the time the run began
+        checkpoint.position = 0
+        checkpoint.timestamp = timezone.now()
+        checkpoint.save()
+    now = checkpoint.timestamp
+    last_pk = Listing.objects.aggregate(last=Max('pk'))['last'] or 0
+    ranges = [(low, min(low + chunk_size, last_pk), now) for low in range(checkpoint.position, last_pk, chunk_size)]
+
+    counts = dict.fromkeys(INVARIANTS, 0)
+    repaired = 0
+    executor = None
+    if workers > 1 and len(ranges) > 1:
+        # Workers are forked and open their own connections; none may inherit ours
+        connections.close_all()
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'))
+        results = executor.map(_check_range, ranges)
+    else:
+        results = map(_check_range, ranges)
+    try:
+        # Results arrive in range order, so the checkpoint only passes fully checked ranges
+        for high, violations in results:
+            for violation in violations:
+                for invariant in violation['invariants']:
+                    counts[invariant] += 1
+                if report is not None:
+                    report.write(json.dumps({key: _json(value) for key, value in violation.items()}) + '\n')
+            if repair_drift:
+                repaired += repair(violations, now)
+            if report is not None:
+                report.flush()
+            checkpoint.position = high
+            checkpoint.save(update_fields=['position', 'updated_at'])
+            if progress:
+                progress(high, last_pk, counts)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    checkpoint.timestamp = None
+    checkpoint.save(update_fields=['timestamp', 'updated_at'])
+    return counts, repaired
@@ -0,0 +1,154 @@
+import bisect
+import threading
+import time
+
+from django.conf import settings
+
+from .models import Listing
+
+
+class EndingSoonIndex:
+    """
+    Process-local index of active listing ids sorted by end_date.
+
+    The index is loaded once from the database and then kept up to date by
+    the Listing signal handlers. Changes made by other processes are picked
+    up when the index is reloaded after ENDING_SOON_INDEX_TTL seconds, by
+    one request while the others go on reading the old one. Changes
+    signalled during a load are applied again once it is swapped in.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()  # held by the one load running
+        self._changes = None                # [(method, args)] signalled while it runs
+        self._generation = 0                # bumped by clear(), which voids a load running
+        self._entries = []    # sorted (end_date, pk) tuples
+        self._end_dates = []  # end_date of each entry, for bisecting on time
+        self._listings = {}   # pk -> (end_date, category_id)
+        self._loaded_at = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _read(self):
+        """(end_date, pk, category_id) of every active listing, soonest first."""
+        rows = list(
+            Listing.objects.filter(is_active=True)
+            .order_by()
+            .values_list('end_date', 'pk', 'category_id')
+        )
+        rows.sort()
+        return rows
+
+    def _load(self):
+        # Called holding _load_lock; ids() reads the old rows until the swap
+        with self._lock:
+            generation = self._generation
+            self._changes = []
+        try:
+            rows = self._read()
+            with self._lock:
+                if generation != self._generation:
+                    # Cleared meanwhile, so what was read may predate the change
+                    return
+                self._entries = [(end_date, pk) for end_date, pk, _ in rows]
+                self._end_dates = [end_date for end_date, _, _ in rows]
+                self._listings = {pk: (end_date, category_id) for end_date, pk, category_id in rows}
+                self._loaded_at = time.monotonic()
+                changes, self._changes = self._changes, None
+                for method, args in changes:
+                    method(*args)
+        finally:
+            with self._lock:
+                self._changes = None
+
+    def load(self):
+        with self._load_lock:
+            self._load()
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+            self._end_dates = []
+            self._listings = {}
+            self._loaded_at = None
+            self._generation += 1
+
+    def _ensure_loaded(self):
+        ttl = getattr(settings, 'ENDING_SOON_INDEX_TTL', 60)
+        loaded_at = self._loaded_at
+        if loaded_at is None:
+            # Nothing to serve yet: wait for the load running, or run one
+            with self._load_lock:
+                if self._loaded_at is None:
+                    self._load()
+        elif ttl and time.monotonic() - loaded_at > ttl and self._load_lock.acquire(blocking=False):
+            # One request reloads; the others go on with the index as it is
+            try:
+                if self._loaded_at == loaded_at:
+                    self._load()
+            finally:
+                self._load_lock.release()
+
+    def _record(self, method, *args):
+        """Note a change for the load running (if any) to apply again once it swaps its rows in."""
+        if self._changes is not None:
+            self._changes.append((method, args))
+
+    def _discard(self, pk):
+        existing = self._listings.pop(pk, None)
+        if existing is None:
+            return
+        i = bisect.bisect_left(self._entries, (existing[0], pk))
+        if i < len(self._entries) and self._entries[i] == (existing[0], pk):
+            del self._entries[i]
+            del self._end_dates[i]
+
+    def update(self, listing):
+        """Add, move or drop a listing after it has been saved."""
+        with self._lock:
+            self._record(self.update, listing)
+            if self._loaded_at is None:
+                return
+            self._discard(listing.pk)
+            if listing.is_active:
+                entry = (listing.end_date, listing.pk)
+                i = bisect.bisect_left(self._entries, entry)
+                self._entries.insert(i, entry)
+                self._end_dates.insert(i, listing.end_date)
+                self._listings[listing.pk] = (listing.end_date, listing.category_id)
+
+    def remove(self, pk):
+        with self._lock:
+            self._record(self.remove, pk)
+            self._discard(pk)
+
+    def ids(self, after, before=None, category_id=None):
+        """Return ids of listings ending after `after` (and before `before`), soonest first."""
+        self._ensure_loaded()
+        with self._lock:
+            start = bisect.bisect_right(self._end_dates, after)
+            stop = len(self._end_dates) if before is None else bisect.bisect_left(self._end_dates, before)
+            entries = self._entries[start:stop]
+            if category_id is None:
+                return [pk for _, pk in entries]
+            return [pk for _, pk in entries if self._listings[pk][1] == category_id]
+
+
+ending_soon_index = EndingSoonIndex()
+
+
+def _active_listings():
+    return Listing.objects.filter(is_active=True).select_related('seller', 'category')
+
+
+def listings_for_ids(ids):
+    """Fetch listings for an ordered list of ids, keeping the order and skipping stale ids."""
+    listings = _active_listings().in_bulk(ids)
+    return [listings[pk] for pk in ids if pk in listings]
+
+
+async def alistings_for_ids(ids):
+    listings = await _active_listings().ain_bulk(ids)
+    return [listings[pk] for pk in ids if pk in listings]
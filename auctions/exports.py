@@ -0,0 +1,128 @@
+import csv
+import json
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Bid, Listing
+
+LISTING_FIELDS = [
+    ('id', 'id'),
+    ('title', 'title'),
+    ('seller', 'seller__username'),
+    ('category', 'category__slug'),
+    ('starting_bid', 'starting_bid'),
+    ('final_price', 'current_bid'),
+    ('winner', 'winner__username'),
+    ('is_active', 'is_active'),
+    ('created_at', 'created_at'),
+    ('end_date', 'end_date'),
+]
+
+BID_FIELDS = [
+    ('id', 'id'),
+    ('listing_id', 'listing_id'),
+    ('listing', 'listing__title'),
+    ('bidder', 'bidder__username'),
+    ('amount', 'amount'),
+    ('created_at', 'created_at'),
+]
+
+# Spreadsheets run a cell starting with one of these as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+# Model, exported columns and the date field used by --since/--until
+EXPORTS = {
+    'listings': (Listing, LISTING_FIELDS, 'end_date', 'category__slug'),
+    'bids': (Bid, BID_FIELDS, 'created_at', 'listing__category__slug'),
+}
+
+
+class Echo:
+    """File-like object whose write() returns the value, for streaming csv.writer output."""
+
+    def write(self, value):
+        return value
+
+
+def filter_export(kind, queryset=None, since=None, until=None, category=None):
+    model, fields, date_field, category_field = EXPORTS[kind]
+    if queryset is None:
+        queryset = model.objects.all()
+    if since:
+        queryset = queryset.filter(**{f'{date_field}__gte': since})
+    if until:
+        queryset = queryset.filter(**{f'{date_field}__lt': until})
+    if category:
+        queryset = queryset.filter(**{category_field: category})
+    return queryset
+
+
+def export_rows(kind, queryset, chunk_size=2000):
+    """Yield one tuple per row, fetching chunk_size rows at a time."""
+    _, fields, _, _ = EXPORTS[kind]
+    columns = [column for _, column in fields]
+    # Ordering by pk keeps the scan on the primary key index
+    rows = queryset.order_by('pk').values_list(*columns).iterator(chunk_size=chunk_size)
+    if kind == 'listings':
+        return _final_prices(rows, columns.index('current_bid'), columns.index('winner__username'))
+    return rows
+
+
+def _final_prices(rows, price, winner):
+    """Blank the price of listings without a winner: unsold and withdrawn ones have a bid but no sale."""
+    for row in rows:
+        if row[winner] is None and row[price] is not None:
+            row = row[:price] + (None,) + row[price + 1:]
+        yield row
+
+
+def _format(value):
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def _csv_cell(value):
+    # Titles and usernames are user input; quote them so they stay text
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return _format(value)
+
+
+def stream_csv(kind, rows):
+    _, fields, _, _ = EXPORTS[kind]
+    writer = csv.writer(Echo())
+    yield writer.writerow([name for name, _ in fields])
+    for row in rows:
+        yield writer.writerow([_csv_cell(value) for value in row])
+
+
+def stream_jsonl(kind, rows):
+    _, fields, _, _ = EXPORTS[kind]
+    names = [name for name, _ in fields]
+    for row in rows:
+        record = {
+            name: value if value is None or isinstance(value, (bool, int)) else _format(value)
+            for name, value in zip(names, row)
+        }
+        yield json.dumps(record) + '\n'
+
+
+STREAMERS = {
+    'csv': (stream_csv, 'text/csv'),
+    'jsonl': (stream_jsonl, 'application/x-ndjson'),
+}
+
+
+def export_response(kind, queryset, fmt='csv', chunk_size=2000):
+    streamer, content_type = STREAMERS[fmt]
+    response = StreamingHttpResponse(
+        streamer(kind, export_rows(kind, queryset, chunk_size)),
+        content_type=content_type,
+    )
+    filename = f'{kind}-{timezone.now():%Y%m%d-%H%M%S}.{fmt}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,200 @@
+"""
+Faceted filtering for the browse page.
+
+Listings can be narrowed by any number of categories and price ranges plus
+one status, and every option shows how many listings it would leave. All
+counts come from one GROUP BY over the active listings matching the search
+text, giving a small cube of (category, price bucket, has bids, ended,
+viewed) -> count. The cube is cached per search text and catalog version, and the
+counts for any combination of selected options are summed from it in Python,
+so switching filters never runs another count query.
+"""
+import hashlib
+from collections import namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import BooleanField, Case, Count, ExpressionWrapper, IntegerField, Q, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .caching import catalog_modified
+from .models import Listing
+
+# (slug, label, lower bound, upper bound); bounds are inclusive below, exclusive above
+PRICE_BUCKETS = [
+    ('under-25', 'Under $25', None, Decimal('25')),
+    ('25-100', '$25 to $100', Decimal('25'), Decimal('100')),
+    ('100-500', '$100 to $500', Decimal('100'), Decimal('500')),
+    ('500-1000', '$500 to $1,000', Decimal('500'), Decimal('1000')),
+    ('1000-plus', '$1,000 and up', Decimal('1000'), None),
+]
+PRICE_SLUGS = [slug for slug, _, _, _ in PRICE_BUCKETS]
+
+STATUSES = [
+    ('ending_soon', 'Ending soon'),
+    ('new', 'Newly listed'),
+    ('no_bids', 'No bids yet'),
+    ('trending', 'Trending'),
+]
+
+FACETS_KEY = 'auctions:facets:%s'
+
+Filters = namedtuple('Filters', ['search', 'categories', 'prices', 'status'])
+
+
+def parse_filters(query):
+    """Normalize the browse page's GET parameters; unknown options are dropped."""
+    prices = set(query.getlist('price'))
+    status = query.get('status')
+    return Filters(
+        search=(query.get('search') or '').strip(),
+        categories=tuple(sorted({slug for slug in query.getlist('category') if slug})),
+        prices=tuple(slug for slug in PRICE_SLUGS if slug in prices),
+        status=status if status in dict(STATUSES) else None,
+    )
+
+
+def current_price():
+    return Coalesce('current_bid', 'starting_bid')
+
+
+def _price_q(slugs):
+    q = Q()
+    for slug, _, low, high in PRICE_BUCKETS:
+        if slug in slugs:
+            bucket = Q()
+            if low is not None:
+                bucket &= Q(price__gte=low)
+            if high is not None:
+                bucket &= Q(price__lt=high)
+            q |= bucket
+    return q
+
+
+def search_q(search):
+    return Q(title__icontains=search) | Q(description__icontains=search)
+
+
+def filter_listings(listings, filters, categories=None):
+    """
+    Apply the category, price and search filters (not status, which the
+    browse views also use for ordering) to a listing queryset.
+    `categories` maps slugs to ids when the caller has them loaded.
+    """
+    if filters.categories:
+        if categories is not None:
+            listings = listings.filter(category_id__in=[categories[s] for s in filters.categories if s in categories])
+        else:
+            listings = listings.filter(category__slug__in=filters.categories)
+    if filters.prices:
+        listings = listings.annotate(price=current_price()).filter(_price_q(filters.prices))
+    if filters.search:
+        listings = listings.filter(search_q(filters.search))
+    return listings
+
+
+def _bucket():
+    whens = []
+    for i, (_, _, low, high) in enumerate(PRICE_BUCKETS):
+        bounds = Q()
+        if low is not None:
+            bounds &= Q(price__gte=low)
+        if high is not None:
+            bounds &= Q(price__lt=high)
+        whens.append(When(bounds, then=Value(i)))
+    return Case(*whens, output_field=IntegerField())
+
+
+def facet_cube(search=''):
+    """
+    {(category id, price bucket index, has bids, ended, viewed): active listings},
+    for the listings matching `search`.
+    """
+    key = FACETS_KEY % hashlib.md5(('%r|%s' % (catalog_modified(), search)).encode()).hexdigest()
+    cube = cache.get(key)
+    if cube is not None:
+        return cube
+    listings = Listing.objects.filter(is_active=True)
+    if search:
+        listings = listings.filter(search_q(search))
+    rows = (
+        listings.order_by()
+        .annotate(price=current_price())
+        .values_list(
+            'category_id',
+            _bucket(),
+            ExpressionWrapper(Q(current_bid__isnull=False), output_field=BooleanField()),
+            ExpressionWrapper(Q(end_date__lte=timezone.now()), output_field=BooleanField()),
+            ExpressionWrapper(Q(view_stats__isnull=False), output_field=BooleanField()),
+        )
+        .annotate(n=Count('pk'))
+    )
+    cube = {
+        (category_id, bucket, bool(has_bids), bool(ended), bool(viewed)): n
+        for category_id, bucket, has_bids, ended, viewed, n in rows
+    }
+    # Listings pass their end date (and are viewed) without touching the catalog, so the cube also ages out
+    cache.set(key, cube, getattr(settings, 'FACET_CACHE_TIMEOUT', 60))
+    return cube
+
+
+def _status_matches(status, has_bids, ended, viewed):
+    if status == 'ending_soon':
+        return not ended
+    if status == 'no_bids':
+        return not has_bids
+    if status == 'trending':
+        return viewed
+    return True
+
+
+def facet_counts(filters, categories):
+    """
+    Counts for every option of every facet, given the other facets' current
+    selections. `categories` is the list of Category objects to show.
+
+    Returns (total listings matching all filters, {'categories': [...],
+    'prices': [...], 'statuses': [...]}), each option a dict of value,
+    label, count and selected.
+    """
+    cube = facet_cube(filters.search)
+    ids = {category.slug: category.pk for category in categories}
+    selected_ids = {ids[slug] for slug in filters.categories if slug in ids}
+    selected_buckets = {PRICE_SLUGS.index(slug) for slug in filters.prices}
+
+    by_category = {}
+    by_bucket = {}
+    by_status = dict.fromkeys(dict(STATUSES), 0)
+    total = 0
+    for (category_id, bucket, has_bids, ended, viewed), n in cube.items():
+        category_ok = category_id in selected_ids if filters.categories else True
+        price_ok = not selected_buckets or bucket in selected_buckets
+        status_ok = _status_matches(filters.status, has_bids, ended, viewed)
+        if price_ok and status_ok:
+            by_category[category_id] = by_category.get(category_id, 0) + n
+        if category_ok and status_ok:
+            by_bucket[bucket] = by_bucket.get(bucket, 0) + n
+        if category_ok and price_ok:
+            for status in by_status:
+                if _status_matches(status, has_bids, ended, viewed):
+                    by_status[status] += n
+            if status_ok:
+                total += n
+
+    facets = {
+        'categories': [
+            {'value': c.slug, 'label': c.name, 'count': by_category.get(c.pk, 0), 'selected': c.pk in selected_ids}
+            for c in categories
+        ],
+        'prices': [
+            {'value': slug, 'label': label, 'count': by_bucket.get(i, 0), 'selected': i in selected_buckets}
+            for i, (slug, label, _, _) in enumerate(PRICE_BUCKETS)
+        ],
+        'statuses': [
+            {'value': value, 'label': label, 'count': by_status[value], 'selected': value == filters.status}
+            for value, label in STATUSES
+        ],
+    }
+    return total, facets
@@ -0,0 +1,77 @@
+"""
+Reuse the rendered crispy layout of unbound forms.
+
+An empty BidForm or CommentForm renders to the same markup on every page
+apart from a few values (the CSRF token, the minimum bid). The layout is
+rendered once per process with markers in place of those values, and each
+request only fills them in. Forms opt in with `cache_layout = True` and
+name per-instance widget attributes in `dynamic_attrs`.
+"""
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.template import Context, Template
+from django.utils.html import conditional_escape
+from django.utils.safestring import mark_safe
+
+CSRF_MARKER = 'formcachecsrf7f3a'
+ATTR_MARKER = 'formcacheattr7f3a%d'
+
+_layouts = {}
+
+
+@lru_cache(maxsize=None)
+def _template(use_filter):
+    if use_filter:
+        return Template('{% load crispy_forms_tags %}{{ form|crispy }}')
+    return Template('{% load crispy_forms_tags %}{% crispy form %}')
+
+
+def _layout_key(form, use_filter):
+    return (
+        type(form),
+        use_filter,
+        form.prefix,
+        form.auto_id,
+        tuple(sorted((name, repr(value)) for name, value in form.initial.items())),
+    )
+
+
+def _render_layout(form, use_filter):
+    """Render `form` with markers for its dynamic values; returns the split markup."""
+    dynamic = list(getattr(form, 'dynamic_attrs', ()))
+    saved = []
+    for i, (field, attr) in enumerate(dynamic):
+        attrs = form.fields[field].widget.attrs
+        saved.append(attrs.get(attr))
+        attrs[attr] = ATTR_MARKER % i
+    try:
+        html = _template(use_filter).render(Context({'form': form, 'csrf_token': CSRF_MARKER}))
+    finally:
+        for (field, attr), value in zip(dynamic, saved):
+            form.fields[field].widget.attrs[attr] = value
+    markers = [CSRF_MARKER] + [ATTR_MARKER % i for i in range(len(dynamic))]
+    return re.split('(%s)' % '|'.join(markers), html)
+
+
+def render_form(form, csrf_token=None, use_filter=False):
+    """
+    Render `form` like {% crispy form %} (or {{ form|crispy }} with
+    use_filter), from the cached layout when the form allows it.
+    """
+    if not getattr(form, 'cache_layout', False) or form.is_bound or settings.DEBUG:
+        return _template(use_filter).render(Context({'form': form, 'csrf_token': csrf_token}))
+
+    key = _layout_key(form, use_filter)
+    parts = _layouts.get(key)
+    if parts is None:
+        parts = _layouts[key] = _render_layout(form, use_filter)
+
+    values = {}
+    if CSRF_MARKER in parts:
+        values[CSRF_MARKER] = conditional_escape(csrf_token or '')
+    for i, (field, attr) in enumerate(getattr(form, 'dynamic_attrs', ())):
+        value = form.fields[field].widget.attrs.get(attr)
+        values[ATTR_MARKER % i] = '' if value is None else conditional_escape(value)
+    return mark_safe(''.join(values.get(part, part) for part in parts))
@@ -1,8 +1,30 @@
 from django import forms
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
+from django.core.files.uploadedfile import UploadedFile
+from django.template.defaultfilters import filesizeformat
 from django.utils import timezone
 from .models import Listing, Bid, Comment, UserProfile
+from .storage import max_upload_size
+
+
+def validate_starting_bid(starting_bid):
+    if starting_bid and starting_bid <= 0:
+        raise forms.ValidationError("Starting bid must be greater than 0.")
+    return starting_bid
+
+
+def validate_end_date(end_date, now=None):
+    if end_date and end_date <= (now or timezone.now()):
+        raise forms.ValidationError("End date must be in the future.")
+    return end_date
+
+
+def validate_upload_size(upload):
+    # Only new uploads; their size is known without reading them
+    if isinstance(upload, UploadedFile) and upload.size > max_upload_size():
+        raise forms.ValidationError(f"Files must be no larger than {filesizeformat(max_upload_size())}.")
+    return upload
 
 
 class SignUpForm(UserCreationForm):
@@ -39,19 +61,20 @@ class ListingForm(forms.ModelForm):
         }
 
     def clean_starting_bid(self):
-        starting_bid = self.cleaned_data.get('starting_bid')
-        if starting_bid and starting_bid <= 0:
-            raise forms.ValidationError("Starting bid must be greater than 0.")
-        return starting_bid
+        return validate_starting_bid(self.cleaned_data.get('starting_bid'))
 
     def clean_end_date(self):
-        end_date = self.cleaned_data.get('end_date')
-        if end_date and end_date <= timezone.now():
-            raise forms.ValidationError("End date must be in the future.")
-        return end_date
+        return validate_end_date(self.cleaned_data.get('end_date'))
+
+    def clean_image(self):
+        return validate_upload_size(self.cleaned_data.get('image'))
 
 
 class BidForm(forms.ModelForm):
+    # See auctions.form_cache
+    cache_layout = True
+    dynamic_attrs = [('amount', 'min')]
+
     class Meta:
         model = Bid
         fields = ['amount']
@@ -63,6 +86,8 @@ class BidForm(forms.ModelForm):
         self.listing = kwargs.pop('listing', None)
         self.user = kwargs.pop('user', None)
         super().__init__(*args, **kwargs)
+        if self.listing is not None:
+            self.fields['amount'].widget.attrs['min'] = str(self.listing.minimum_bid())
 
     def clean_amount(self):
         amount = self.cleaned_data.get('amount')
@@ -81,6 +106,8 @@ class BidForm(forms.ModelForm):
 
 
 class CommentForm(forms.ModelForm):
+    cache_layout = True
+
     class Meta:
         model = Comment
         fields = ['content']
@@ -98,6 +125,9 @@ class UserProfileForm(forms.ModelForm):
             'birth_date': forms.DateInput(attrs={'type': 'date'}),
         }
 
+    def clean_avatar(self):
+        return validate_upload_size(self.cleaned_data.get('avatar'))
+
 
 class UserUpdateForm(forms.ModelForm):
     email = forms.EmailField()
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from auctions.recommendations import DEFAULT_WEIGHTS, rebuild_similar_listings
+
+
+class Command(BaseCommand):
+    help = 'Precompute the top-K similar listings for every active listing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=10, help='Neighbours stored per listing')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert')
+        for signal, weight in DEFAULT_WEIGHTS.items():
+            parser.add_argument(
+                f'--{signal}-weight',
+                type=float,
+                default=weight,
+                help=f'Weight of the {signal} signal (0 disables it)',
+            )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        stored = rebuild_similar_listings(
+            top_k=options['top_k'],
+            batch_size=options['batch_size'],
+            weights={signal: options[f'{signal}_weight'] for signal in DEFAULT_WEIGHTS},
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Stored {stored} recommendations in {time.monotonic() - started:.1f}s.'
+            )
+        )
@@ -0,0 +1,64 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from auctions import consistency
+
+
+class Command(BaseCommand):
+    help = 'Check listings against their bids (current_bid, winner, closing) and optionally repair drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Worker processes scanning primary-key ranges',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=10000,
+            help='Listing ids per range',
+        )
+        parser.add_argument(
+            '--repair',
+            action='store_true',
+            help='Rewrite current_bid and winner where they disagree with the bids',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Continue an interrupted run from its checkpoint',
+        )
+        parser.add_argument(
+            '--report',
+            default='consistency_report.jsonl',
+            help='File the violations are written to, one JSON object per line',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+
+        def progress(position, last_pk, counts):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  checked up to listing {position} of {last_pk}: {sum(counts.values())} violations')
+
+        # A resumed run adds to the report of the run it continues
+        with open(options['report'], 'a' if options['resume'] else 'w') as report:
+            counts, repaired = consistency.run(
+                chunk_size=options['chunk_size'],
+                workers=options['workers'],
+                repair_drift=options['repair'],
+                resume=options['resume'],
+                report=report,
+                progress=progress,
+            )
+        for invariant, count in counts.items():
+            if count:
+                self.stdout.write(f'{consistency.INVARIANTS[invariant]}: {count}')
+        total = sum(counts.values())
+        summary = f'{total} violations in {time.monotonic() - started:.1f}s, written to {options["report"]}'
+        if options['repair']:
+            summary += f'; repaired {repaired} listings'
+        self.stdout.write(self.style.SUCCESS(summary) if not total else self.style.WARNING(summary))
@@ -0,0 +1,37 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+
+from auctions import storage
+
+
+class Command(BaseCommand):
+    help = 'Remove deduplicated media files that no listing or profile uses any more'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-period',
+            type=int,
+            default=None,
+            help='Seconds an unreferenced file is kept (default: MEDIA_BLOB_GRACE_PERIOD)',
+        )
+        parser.add_argument(
+            '--recount',
+            action='store_true',
+            help='Recompute reference counts from the database first (after bulk updates or deletes)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report what would be removed without removing it',
+        )
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, storage.DeduplicatingStorage):
+            raise CommandError('The default storage is not auctions.storage.DeduplicatingStorage')
+        if options['recount']:
+            corrected = storage.recount_references()
+            self.stdout.write(f'Corrected {corrected} reference counts')
+        removed, freed = storage.collect_garbage(options['grace_period'], dry_run=options['dry_run'])
+        verb = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {removed} files ({filesizeformat(freed)})'))
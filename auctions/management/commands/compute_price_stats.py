@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from auctions.analytics import rebuild_category_price_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute per-category price statistics from closed auctions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=200000,
+            help='Bids loaded per chunk',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = rebuild_category_price_stats(options['chunk_size'])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Updated price stats for {count} categories in {time.monotonic() - started:.1f}s.'
+            )
+        )
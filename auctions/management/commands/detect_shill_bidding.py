@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from auctions import shill_detection
+
+
+class Command(BaseCommand):
+    help = 'Scan bids since the last run and queue suspected shill bidding for review'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.6,
+            help='Minimum score (0-1) for a bidder/seller pair to be flagged',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=100000,
+            help='Bids processed per transaction',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        scored, flagged = shill_detection.run(options['threshold'], options['chunk_size'])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Scored {scored} bidder/seller pairs, flagged {flagged} new suspects '
+                f'in {time.monotonic() - started:.1f}s.'
+            )
+        )
@@ -0,0 +1,56 @@
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from auctions.exports import STREAMERS, export_rows, filter_export
+
+
+class Command(BaseCommand):
+    help = 'Stream listings (with winner and final price) or bids as CSV or JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=['listings', 'bids'])
+        parser.add_argument('--format', choices=list(STREAMERS), default='csv')
+        parser.add_argument('--output', help='Write to this file instead of stdout')
+        parser.add_argument(
+            '--since',
+            help='Only rows on or after this date (listing end date, bid time)',
+        )
+        parser.add_argument(
+            '--until',
+            help='Only rows before this date (listing end date, bid time)',
+        )
+        parser.add_argument('--category', help='Only rows in this category slug')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def parse_moment(self, value):
+        if not value:
+            return None
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                raise CommandError(f'Invalid date "{value}".')
+            moment = datetime.combine(day, time.min)
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        return moment
+
+    def handle(self, *args, **options):
+        kind = options['kind']
+        queryset = filter_export(
+            kind,
+            since=self.parse_moment(options['since']),
+            until=self.parse_moment(options['until']),
+            category=options['category'],
+        )
+        streamer, _ = STREAMERS[options['format']]
+        chunks = streamer(kind, export_rows(kind, queryset, options['chunk_size']))
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+            for chunk in chunks:
+                output.write(chunk)
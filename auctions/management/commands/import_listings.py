@@ -0,0 +1,202 @@
+import csv
+import json
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from auctions.caching import touch_catalog
+from auctions.forms import validate_end_date, validate_starting_bid
+from auctions.models import Category, Listing
+
+
+class Command(BaseCommand):
+    help = 'Import listings from a CSV or JSONL file in chunked bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file to import, or - for stdin')
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'jsonl'],
+            help='Input format (guessed from the file extension by default)',
+        )
+        parser.add_argument(
+            '--seller',
+            help='Username of the seller for rows without a seller column',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Rows inserted per transaction',
+        )
+        parser.add_argument(
+            '--offset',
+            type=int,
+            default=0,
+            help='Skip this many data rows (resume after the last committed row)',
+        )
+        parser.add_argument(
+            '--errors',
+            help='Write rejected rows to this CSV file',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        batch_size = options['batch_size']
+        offset = options['offset']
+
+        self.categories = dict(Category.objects.values_list('slug', 'pk'))
+        self.sellers = {}
+        self.default_seller_id = None
+        if options['seller']:
+            self.default_seller_id = self.resolve_seller(options['seller'])
+            if self.default_seller_id is None:
+                raise CommandError(f'Seller "{options["seller"]}" does not exist.')
+
+        source = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        error_file = None
+        if options['errors']:
+            # A resumed import adds to the rows rejected by the run it continues
+            error_file = open(options['errors'], 'a' if offset else 'w', newline='', encoding='utf-8')
+        error_writer = csv.writer(error_file) if error_file else None
+        if error_writer and not error_file.tell():
+            error_writer.writerow(['row', 'error'])
+
+        started = time.monotonic()
+        imported = rejected = 0
+        last_row = offset
+        batch = []
+        try:
+            for row_number, row in self.read_rows(source, fmt):
+                if row_number <= offset:
+                    continue
+                try:
+                    batch.append(self.build_listing(row))
+                except ValidationError as e:
+                    rejected += 1
+                    if error_writer:
+                        error_writer.writerow([row_number, '; '.join(e.messages)])
+                last_row = row_number
+                if len(batch) >= batch_size:
+                    imported += self.flush(batch, last_row)
+                    batch = []
+            if batch:
+                imported += self.flush(batch, last_row)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if error_file:
+                error_file.close()
+
+        if imported:
+            touch_catalog()
+
+        elapsed = time.monotonic() - started
+        rate = imported / elapsed * 60 if elapsed else 0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Imported {imported} listings, rejected {rejected} rows '
+                f'in {elapsed:.1f}s ({rate:.0f} rows/min).'
+            )
+        )
+
+    def read_rows(self, source, fmt):
+        """Yield (row number, dict) pairs without reading the whole file."""
+        if fmt == 'csv':
+            for row_number, row in enumerate(csv.DictReader(source), start=1):
+                yield row_number, row
+            return
+        for row_number, line in enumerate(source, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                row = {'_error': f'Invalid JSON: {e}'}
+            yield row_number, row
+
+    def resolve_seller(self, username):
+        if username not in self.sellers:
+            self.sellers[username] = User.objects.filter(username=username).values_list('pk', flat=True).first()
+        return self.sellers[username]
+
+    def text(self, row, field):
+        """The field as a string: numbers are converted, a list or object rejects the row."""
+        value = row.get(field)
+        if value is None:
+            return ''
+        if isinstance(value, (list, dict)):
+            raise ValidationError(f'{field.capitalize().replace("_", " ")} must be text.')
+        return str(value)
+
+    def build_listing(self, row):
+        if not isinstance(row, dict):
+            raise ValidationError('Row must be an object.')
+        if '_error' in row:
+            raise ValidationError(row['_error'])
+
+        errors = []
+        title = self.text(row, 'title').strip()
+        if not title:
+            errors.append('Title is required.')
+        elif len(title) > 200:
+            errors.append('Title must be at most 200 characters.')
+
+        starting_bid = None
+        try:
+            starting_bid = Decimal(self.text(row, 'starting_bid').strip())
+            validate_starting_bid(starting_bid)
+            if starting_bid != starting_bid.quantize(Decimal('0.01')) or starting_bid >= Decimal('1e8'):
+                errors.append('Starting bid must have at most 8 digits and 2 decimal places.')
+        except InvalidOperation:
+            errors.append('Starting bid must be a number.')
+        except ValidationError as e:
+            errors.extend(e.messages)
+
+        end_date = parse_datetime(self.text(row, 'end_date').strip())
+        if end_date is None:
+            errors.append('End date must be an ISO 8601 date and time.')
+        else:
+            if timezone.is_naive(end_date):
+                end_date = timezone.make_aware(end_date)
+            try:
+                validate_end_date(end_date)
+            except ValidationError as e:
+                errors.extend(e.messages)
+
+        category_id = None
+        slug = self.text(row, 'category').strip()
+        if slug:
+            category_id = self.categories.get(slug)
+            if category_id is None:
+                errors.append(f'Unknown category "{slug}".')
+
+        seller = self.text(row, 'seller').strip()
+        seller_id = self.resolve_seller(seller) if seller else self.default_seller_id
+        if seller_id is None:
+            errors.append(f'Unknown seller "{seller}".' if seller else 'Seller is required.')
+
+        if errors:
+            raise ValidationError(errors)
+        return Listing(
+            title=title,
+            description=self.text(row, 'description'),
+            starting_bid=starting_bid,
+            end_date=end_date,
+            category_id=category_id,
+            seller_id=seller_id,
+        )
+
+    def flush(self, batch, last_row):
+        with transaction.atomic():
+            Listing.objects.bulk_create(batch)
+        self.stdout.write(f'Committed through row {last_row} (resume with --offset {last_row})')
+        return len(batch)
@@ -0,0 +1,91 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from auctions import moderation
+from auctions.models import Category, Listing
+
+
+class Command(BaseCommand):
+    help = 'Deactivate, extend or recategorize listings in bulk (e.g. every listing of a banned seller)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['deactivate', 'extend', 'recategorize'])
+        parser.add_argument(
+            '--seller',
+            action='append',
+            default=[],
+            help='Select the listings of this username (repeatable)',
+        )
+        parser.add_argument(
+            '--category',
+            help='Select the listings in this category slug',
+        )
+        parser.add_argument(
+            '--ids',
+            help='Select these listing ids (comma-separated)',
+        )
+        parser.add_argument(
+            '--active-only',
+            action='store_true',
+            help='Only select active listings',
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            help='For extend: days to push end_date back by',
+        )
+        parser.add_argument(
+            '--to',
+            help='For recategorize: the category slug to move to ("none" for uncategorized)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=moderation.CHUNK_SIZE,
+            help='Listings updated per transaction',
+        )
+
+    def _selected(self, options):
+        if not (options['seller'] or options['category'] or options['ids']):
+            raise CommandError('Select listings with --seller, --category or --ids')
+        listings = Listing.objects.all()
+        if options['seller']:
+            sellers = list(User.objects.filter(username__in=options['seller']).values_list('pk', flat=True))
+            if len(sellers) != len(set(options['seller'])):
+                raise CommandError('Unknown seller in %s' % ', '.join(options['seller']))
+            listings = listings.filter(seller_id__in=sellers)
+        if options['category']:
+            listings = listings.filter(category__slug=options['category'])
+        if options['ids']:
+            try:
+                ids = [int(pk) for pk in options['ids'].split(',') if pk.strip()]
+            except ValueError:
+                raise CommandError('--ids must be comma-separated integers')
+            listings = listings.filter(pk__in=ids)
+        if options['active_only']:
+            listings = listings.filter(is_active=True)
+        return listings
+
+    def handle(self, *args, **options):
+        listings = self._selected(options)
+        action = options['action']
+        chunk_size = options['chunk_size']
+        if action == 'deactivate':
+            result = moderation.deactivate(listings, chunk_size)
+        elif action == 'extend':
+            if not options['days'] or options['days'] < 1:
+                raise CommandError('extend needs --days (a positive number)')
+            result = moderation.extend(listings, timedelta(days=options['days']), chunk_size)
+        else:
+            if not options['to']:
+                raise CommandError('recategorize needs --to')
+            category = None
+            if options['to'] != 'none':
+                try:
+                    category = Category.objects.get(slug=options['to'])
+                except Category.DoesNotExist:
+                    raise CommandError(f'No category {options["to"]!r}')
+            result = moderation.recategorize(listings, category, chunk_size)
+        self.stdout.write(self.style.SUCCESS(f'{action}: {result.rows} listings updated in {result.seconds:.2f}s'))
@@ -0,0 +1,69 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from auctions.bid_log import find_drift, replay, segments
+from auctions.caching import touch_catalog
+from auctions.models import Listing
+
+
+class Command(BaseCommand):
+    help = 'Rebuild current_bid and winner from the bid event log and report (or fix) listings that drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--listing',
+            type=int,
+            action='append',
+            dest='listings',
+            help='Only replay this listing (repeatable)',
+        )
+        parser.add_argument(
+            '--apply',
+            action='store_true',
+            help='Write the rebuilt values to the listings that differ',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Listings written per UPDATE batch',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        paths = segments()
+        state = replay(options['listings'])
+        replayed = time.monotonic() - started
+        self.stdout.write(
+            f'Replayed {len(paths)} segments into {len(state)} listings in {replayed:.2f}s.'
+        )
+
+        # bulk_update() doesn't set auto_now fields; the pages' validators need updated_at to move
+        updated_at = timezone.now()
+        drifted = [
+            Listing(pk=pk, current_bid=current_bid, winner_id=winner_id, updated_at=updated_at)
+            for pk, current_bid, winner_id in find_drift(state)
+        ]
+        for listing in drifted[:20]:
+            self.stdout.write(
+                f'  listing {listing.pk}: current_bid={listing.current_bid} winner={listing.winner_id}'
+            )
+        if len(drifted) > 20:
+            self.stdout.write(f'  ... and {len(drifted) - 20} more')
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('No listings have drifted from the log.'))
+        elif options['apply']:
+            with transaction.atomic():
+                Listing.objects.bulk_update(
+                    drifted, ['current_bid', 'winner', 'updated_at'], batch_size=options['batch_size']
+                )
+                touch_catalog()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(drifted)} listings from the log.'))
+        else:
+            self.stdout.write(
+                self.style.WARNING(f'{len(drifted)} listings differ from the log; rerun with --apply to fix them.')
+            )
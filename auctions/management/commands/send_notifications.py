@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from auctions.notifications import PooledMailSender, run_cycle
+
+
+class Command(BaseCommand):
+    help = 'Queue ending-soon alerts for watchers and send batched notification digests'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--connections',
+            type=int,
+            help='Mail connections used in parallel (default: NOTIFICATION_MAIL_CONNECTIONS)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Messages sent per mail connection batch',
+        )
+
+    def handle(self, *args, **options):
+        stats = run_cycle(sender=PooledMailSender(options['connections'], options['batch_size']))
+        self.stdout.write(
+            f'Queued {stats["collected"]} ending-soon events in {stats["collect_seconds"]:.2f}s.'
+        )
+        rate = stats['digests'] / stats['send_seconds'] if stats['send_seconds'] else 0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Sent {stats["digests"]} digests covering {stats["events_delivered"]} events '
+                f'in {stats["send_seconds"]:.2f}s ({rate:.0f} digests/s).'
+            )
+        )
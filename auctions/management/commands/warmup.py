@@ -0,0 +1,14 @@
+import time
+
+from django.core.management.base import BaseCommand
+from auctions.warmup import warm_up
+
+
+class Command(BaseCommand):
+    help = 'Warm template, URL, form and index caches and report how long each step takes'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        for name, count, seconds in warm_up():
+            self.stdout.write(f'{name}: {count} in {seconds * 1000:.0f}ms')
+        self.stdout.write(self.style.SUCCESS(f'Warmed up in {time.monotonic() - started:.2f}s.'))
@@ -0,0 +1,322 @@
+import logging
+import math
+import mimetypes
+import os
+import re
+import stat
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import MiddlewareNotUsed, SuspiciousFileOperation
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from . import throttling
+from .storage import is_blob
+from .query_shapes import QueryShapes, RepeatedQueries
+
+logger = logging.getLogger(__name__)
+
+# Mirrors django.http.FileResponse: archives are sent as-is, not decoded by the client
+ARCHIVE_TYPES = {
+    'bzip2': 'application/x-bzip',
+    'gzip': 'application/gzip',
+    'xz': 'application/x-xz',
+}
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+# Precompressed static variants, preferred in this order when the client accepts them equally
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _iter_file(f, start, length):
+    try:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _accepted_encodings(header):
+    """{content coding: q-value} from an Accept-Encoding header."""
+    accepted = {}
+    for item in header.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def _parse_range(header, size):
+    """Return (start, end) for a single satisfiable byte range, 'invalid' or None."""
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        # Multiple or malformed ranges: ignore the header and send the whole file
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start > end or start >= size:
+        return 'invalid'
+    return start, end
+
+
+class FileServingMiddleware:
+    """
+    Serve collected static files and uploaded media from the Django process.
+
+    Precompressed .br/.gz siblings written by collectstatic are used when the
+    client accepts them, manifest-hashed static files and deduplicated media
+    blobs get far-future Cache-Control headers, and every file supports
+    conditional GET and single byte-range requests.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.roots = []
+        if settings.STATIC_URL and settings.STATIC_ROOT:
+            self.roots.append(('/' + settings.STATIC_URL.lstrip('/'), str(settings.STATIC_ROOT), True))
+        if settings.MEDIA_URL and settings.MEDIA_ROOT:
+            self.roots.append(('/' + settings.MEDIA_URL.lstrip('/'), str(settings.MEDIA_ROOT), False))
+        self._immutable_names = None
+
+    def _match(self, request):
+        if request.method in ('GET', 'HEAD'):
+            for prefix, root, is_static in self.roots:
+                if request.path.startswith(prefix):
+                    return root, request.path[len(prefix):], is_static
+        return None
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        match = self._match(request)
+        if match is not None:
+            response = self.serve(request, *match)
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        # Only file requests leave the event loop; everything else passes straight through
+        match = self._match(request)
+        if match is not None:
+            response = await sync_to_async(self.serve, thread_sensitive=False)(request, *match)
+            if response is not None:
+                return response
+        return await self.get_response(request)
+
+    @property
+    def immutable_names(self):
+        if self._immutable_names is None:
+            self._immutable_names = set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+        return self._immutable_names
+
+    def cache_control(self, name, is_static):
+        if not is_static and not is_blob(name):
+            return 'public, max-age=%d' % getattr(settings, 'MEDIA_MAX_AGE', 3600)
+        # Blobs are named by their content hash, so like hashed static files they never change
+        if not is_static or name in self.immutable_names:
+            return 'public, max-age=%d, immutable' % getattr(settings, 'STATIC_IMMUTABLE_MAX_AGE', 31536000)
+        return 'public, max-age=%d' % getattr(settings, 'STATIC_MAX_AGE', 60)
+
+    def serve(self, request, root, name, is_static):
+        try:
+            path = safe_join(root, name)
+        except (SuspiciousFileOperation, ValueError):
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+
+        tag = '%x-%x' % (int(st.st_mtime), st.st_size)
+        etag = quote_etag(tag)
+        last_modified = int(st.st_mtime)
+        content_type, encoding = mimetypes.guess_type(path)
+        if encoding:
+            content_type = ARCHIVE_TYPES.get(encoding, 'application/octet-stream')
+
+        # Ranges are served from the identity representation, which If-Range names
+        range_header = request.META.get('HTTP_RANGE')
+        if range_header and not self._if_range_matches(request, etag, last_modified):
+            range_header = None
+
+        content_encoding = None
+        size = st.st_size
+        if is_static and not range_header:
+            accepted = _accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+            default = accepted.get('*', 0)
+            # Highest q-value first; q=0 refuses a coding
+            for token, suffix in sorted(ENCODINGS, key=lambda encoding: -accepted.get(encoding[0], default)):
+                if accepted.get(token, default) <= 0:
+                    continue
+                try:
+                    variant = os.stat(path + suffix)
+                except OSError:
+                    continue
+                path, size, content_encoding = path + suffix, variant.st_size, token
+                # Each encoding is a representation of its own, with its own validator
+                etag = quote_etag('%s-%s' % (tag, suffix[1:]))
+                break
+
+        headers = {
+            'Cache-Control': self.cache_control(name, is_static),
+            'Last-Modified': http_date(last_modified),
+            'ETag': etag,
+            'Accept-Ranges': 'bytes',
+        }
+        if is_static:
+            headers['Vary'] = 'Accept-Encoding'
+
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            for header, value in headers.items():
+                not_modified.headers.setdefault(header, value)
+            return not_modified
+
+        start, end, status = 0, size - 1, 200
+        if range_header:
+            byte_range = _parse_range(range_header, size)
+            if byte_range == 'invalid':
+                response = HttpResponse(status=416)
+                response.headers['Content-Range'] = 'bytes */%d' % size
+                return response
+            if byte_range is not None:
+                start, end = byte_range
+                status = 206
+
+        length = end - start + 1 if size else 0
+        if request.method == 'HEAD':
+            response = HttpResponse(status=status)
+        else:
+            response = StreamingHttpResponse(_iter_file(open(path, 'rb'), start, length), status=status)
+        response.headers['Content-Type'] = content_type or 'application/octet-stream'
+        response.headers['Content-Length'] = str(length)
+        if content_encoding:
+            response.headers['Content-Encoding'] = content_encoding
+        if status == 206:
+            response.headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+        for header, value in headers.items():
+            response.headers[header] = value
+        return response
+
+    def _if_range_matches(self, request, etag, last_modified):
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if not if_range:
+            return True
+        if if_range.startswith(('"', 'W/')):
+            return if_range == etag
+        return parse_http_date_safe(if_range) == last_modified
+
+
+class ThrottleMiddleware:
+    """
+    Apply the THROTTLE_RATES token buckets (see auctions.throttling) once the
+    URL is resolved. Refused requests get a bare 429 with Retry-After and
+    never reach the view; URLs without a rule cost a dict lookup.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.rules = throttling.load_rules()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            self.process_view = self._async_process_view
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def _rule(self, request):
+        match = request.resolver_match
+        rule = self.rules.get(match.view_name) if match is not None else None
+        if rule is None:
+            return None
+        methods, limits = rule
+        if methods is not None and request.method not in methods:
+            return None
+        return match.view_name, limits
+
+    def _throttle(self, request, name, limits):
+        refused = throttling.check(request, name, limits)
+        if not refused:
+            return None
+        wait, scope = refused
+        throttling.record_rejection(name, scope)
+        response = HttpResponse('Too many requests, slow down.\n', status=429, content_type='text/plain')
+        response.headers['Retry-After'] = str(math.ceil(wait))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        rule = self._rule(request)
+        return self._throttle(request, *rule) if rule is not None else None
+
+    async def _async_process_view(self, request, view_func, view_args, view_kwargs):
+        rule = self._rule(request)
+        if rule is None:
+            return None
+        # Resolving request.user may touch the session store and database, and
+        # the buckets are network round trips to a shared cache; none of it
+        # may block the event loop
+        return await sync_to_async(self._throttle)(request, *rule)
+
+
+class RepeatedQueryMiddleware:
+    """
+    Under DEBUG, report requests that run one query shape more than
+    REPEATED_QUERY_THRESHOLD times (see auctions.query_shapes), logging a
+    warning or, with REPEATED_QUERY_ACTION = 'raise', failing the request.
+    """
+
+    def __init__(self, get_response):
+        self.threshold = getattr(settings, 'REPEATED_QUERY_THRESHOLD', None)
+        if not settings.DEBUG or not self.threshold:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.action = getattr(settings, 'REPEATED_QUERY_ACTION', 'warn')
+
+    def __call__(self, request):
+        with QueryShapes(self.threshold) as shapes:
+            response = self.get_response(request)
+        if shapes.repeated():
+            message = f'Repeated queries in {request.method} {request.path}:\n{shapes.report()}'
+            if self.action == 'raise':
+                raise RepeatedQueries(message)
+            logger.warning(message)
+        return response
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0002_listing_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarListing',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_listings', to='auctions.listing')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='auctions.listing')),
+            ],
+            options={
+                'ordering': ['rank'],
+                'indexes': [models.Index(fields=['listing', 'rank'], name='auctions_si_listing_7ac831_idx')],
+                'unique_together': {('listing', 'similar')},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0003_similarlisting'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryPriceStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('closed_count', models.PositiveIntegerField(default=0)),
+                ('sold_count', models.PositiveIntegerField(default=0)),
+                ('sell_through_rate', models.FloatField(default=0)),
+                ('median_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('p10_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('p25_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('p75_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('p90_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('avg_bid_count', models.FloatField(default=0)),
+                ('bid_velocity', models.JSONField(blank=True, default=dict)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='price_stats', to='auctions.category')),
+            ],
+            options={
+                'verbose_name_plural': 'category price stats',
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0007_mediablob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingViews',
+            fields=[
+                ('listing', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='view_stats', serialize=False, to='auctions.listing')),
+                ('views', models.PositiveBigIntegerField(default=0)),
+                ('trending', models.FloatField(db_index=True, default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'listing views',
+            },
+        ),
+    ]
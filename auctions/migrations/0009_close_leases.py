@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-19 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0008_listingviews'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='close_lease_expires',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='close_lease_owner',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='notificationevent',
+            name='kind',
+            field=models.CharField(choices=[('outbid', 'Outbid'), ('ending_soon', 'Ending soon'), ('won', 'Won'), ('ended', 'Auction ended')], max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['end_date'], name='listing_open_end_date'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['close_lease_owner'], name='listing_open_lease'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-19 10:12
+
+from django.db import migrations, models
+from django.db.models import F
+from django.utils import timezone
+
+
+def mark_withdrawn(apps, schema_editor):
+    # Until now a withdrawal was only recognisable as a listing deactivated before its end_date
+    Listing = apps.get_model('auctions', 'Listing')
+    Listing.objects.filter(is_active=False, end_date__gt=timezone.now(), winner__isnull=True).update(
+        withdrawn_at=F('updated_at')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0009_close_leases'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='withdrawn_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(mark_withdrawn, migrations.RunPython.noop),
+    ]
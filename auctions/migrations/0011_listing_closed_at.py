@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-19 10:31
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_closed(apps, schema_editor):
+    # Auctions were closed soon after they ended; shill detection has counted
+    # those that ended before its checkpoint, and goes on from there
+    Listing = apps.get_model('auctions', 'Listing')
+    Listing.objects.filter(is_active=False, withdrawn_at__isnull=True).update(closed_at=F('end_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0010_listing_withdrawn_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='closed_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(mark_closed, migrations.RunPython.noop),
+    ]
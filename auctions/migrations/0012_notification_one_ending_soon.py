@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-19 10:40
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def drop_duplicate_reminders(apps, schema_editor):
+    # Left by send_notifications runs that overlapped; the first of each is kept
+    NotificationEvent = apps.get_model('auctions', 'NotificationEvent')
+    reminders = NotificationEvent.objects.filter(kind='ending_soon')
+    first = reminders.values('user', 'listing').order_by().annotate(first=Min('pk')).values('first')
+    reminders.exclude(pk__in=first).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0011_listing_closed_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_reminders, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='notificationevent',
+            constraint=models.UniqueConstraint(condition=models.Q(('kind', 'ending_soon')), fields=('user', 'listing', 'kind'), name='notification_one_ending_soon'),
+        ),
+    ]
@@ -1,3 +1,5 @@
+from decimal import Decimal
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
@@ -25,14 +27,27 @@ class Listing(models.Model):
     current_bid = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     image = models.ImageField(upload_to='listing_images/', null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     end_date = models.DateTimeField()
     is_active = models.BooleanField(default=True)
+    # Set when moderation takes the listing down (see auctions/moderation.py); it then has no winner
+    withdrawn_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Set when the auction is closed (see auctions/closing.py)
+    closed_at = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
     seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='listings')
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
     winner = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='won_auctions')
+    # Held by the close_ended_auctions worker closing the listing; see auctions/closing.py
+    close_lease_owner = models.CharField(max_length=100, blank=True, default='', editable=False)
+    close_lease_expires = models.DateTimeField(null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Open listings by end_date, for close_ended_auctions and the lease it holds
+            models.Index(fields=['end_date'], condition=models.Q(is_active=True), name='listing_open_end_date'),
+            models.Index(fields=['close_lease_owner'], condition=models.Q(is_active=True), name='listing_open_lease'),
+        ]
 
     def __str__(self):
         return self.title
@@ -46,13 +61,17 @@ class Listing(models.Model):
     def get_highest_bid(self):
         return self.bids.order_by('-amount').first()
 
+    def minimum_bid(self):
+        """Lowest amount the next bid can be, going by current_bid."""
+        if self.current_bid is not None:
+            return self.current_bid + Decimal('0.01')
+        return self.starting_bid
+
     def close_auction(self):
         if self.is_active and self.is_ended():
-            highest_bid = self.get_highest_bid()
-            if highest_bid:
-                self.winner = highest_bid.bidder
-            self.is_active = False
-            self.save()
+            from .closing import close_listing
+            close_listing(self.pk)
+            self.refresh_from_db()
 
 
 class Bid(models.Model):
@@ -102,3 +121,152 @@ class UserProfile(models.Model):
 
     def __str__(self):
         return f"{self.user.username}'s Profile"
+
+
+class SimilarListing(models.Model):
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='similar_listings')
+    similar = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ['rank']
+        unique_together = ['listing', 'similar']
+        indexes = [models.Index(fields=['listing', 'rank'])]
+
+    def __str__(self):
+        return f"{self.similar_id} similar to {self.listing_id} (#{self.rank})"
+
+
+class CategoryPriceStats(models.Model):
+    category = models.OneToOneField(Category, on_delete=models.CASCADE, related_name='price_stats')
+    closed_count = models.PositiveIntegerField(default=0)
+    sold_count = models.PositiveIntegerField(default=0)
+    sell_through_rate = models.FloatField(default=0)
+    median_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    p10_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    p25_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    p75_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    p90_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    avg_bid_count = models.FloatField(default=0)
+    bid_velocity = models.JSONField(default=dict, blank=True)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "category price stats"
+
+    def __str__(self):
+        return f"Price stats for {self.category.name}"
+
+
+class JobCheckpoint(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    position = models.BigIntegerField(default=0)
+    timestamp = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} at {self.position}"
+
+
+class BidderSellerStats(models.Model):
+    bidder = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    bid_count = models.PositiveIntegerField(default=0)
+    late_bid_count = models.PositiveIntegerField(default=0)
+    auctions = models.PositiveIntegerField(default=0)
+    auctions_won = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "bidder seller stats"
+        unique_together = ['bidder', 'seller']
+
+    def __str__(self):
+        return f"{self.bidder_id} bidding on {self.seller_id}"
+
+
+class ShillSuspect(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending review'),
+        ('confirmed', 'Confirmed'),
+        ('dismissed', 'Dismissed'),
+    ]
+
+    bidder = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    features = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-score']
+        unique_together = ['bidder', 'seller']
+
+    def __str__(self):
+        return f"{self.bidder.username} shilling for {self.seller.username}?"
+
+
+class NotificationEvent(models.Model):
+    KIND_CHOICES = [
+        ('outbid', 'Outbid'),
+        ('ending_soon', 'Ending soon'),
+        ('won', 'Won'),
+        ('ended', 'Auction ended'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notification_events')
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='+')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sent_at']),
+            models.Index(fields=['user', 'sent_at']),
+            models.Index(fields=['listing', 'kind', 'user']),
+        ]
+        constraints = [
+            # One reminder per watcher and listing, however many send_notifications runs overlap
+            models.UniqueConstraint(
+                fields=['user', 'listing', 'kind'],
+                condition=models.Q(kind='ending_soon'),
+                name='notification_one_ending_soon',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} for {self.user_id} on {self.listing_id}"
+
+
+class MediaBlob(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    size = models.BigIntegerField()
+    references = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['references', 'last_used']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.references} references)"
+
+
+class ListingViews(models.Model):
+    listing = models.OneToOneField(Listing, on_delete=models.CASCADE, primary_key=True, related_name='view_stats')
+    views = models.PositiveBigIntegerField(default=0)
+    # Log of the exponentially decayed view count; see auctions/view_counts.py
+    trending = models.FloatField(default=0, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "listing views"
+
+    def __str__(self):
+        return f"{self.views} views of {self.listing_id}"
@@ -0,0 +1,89 @@
+"""
+Bulk moderation of listings: deactivate, extend end_date, recategorize.
+
+Each operation is a set-based UPDATE over the selected listings, run in
+transactions of `chunk_size` ids so a large batch never holds the database
+lock for long. The per-row work save() would trigger through signals
+(index updates, catalog invalidation) is replaced by one invalidation once
+the batch is done: the browse caches are expired together and this
+process's in-memory indexes are reloaded on next use. Other processes
+pick the change up when their indexes expire.
+"""
+import time
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .autocomplete import autocomplete_index
+from .caching import touch_catalog
+from .ending_soon import ending_soon_index
+from .models import Listing, NotificationEvent
+
+CHUNK_SIZE = 500
+
+Result = namedtuple('Result', ['rows', 'seconds'])
+
+
+def invalidate():
+    """Expire everything derived from listings, once for a whole batch."""
+    touch_catalog()
+    ending_soon_index.clear()
+    autocomplete_index.clear()
+
+
+def _apply(listings, update, chunk_size=CHUNK_SIZE):
+    """Run update(chunk of ids, now) -> rows changed over `listings` in chunked transactions."""
+    started = time.monotonic()
+    ids = list(listings.order_by('pk').values_list('pk', flat=True))
+    now = timezone.now()
+    rows = 0
+    try:
+        for start in range(0, len(ids), chunk_size):
+            with transaction.atomic():
+                rows += update(ids[start:start + chunk_size], now)
+    finally:
+        # Chunks committed before a failure still need it
+        if rows:
+            invalidate()
+    return Result(rows, time.monotonic() - started)
+
+
+def deactivate(listings, chunk_size=CHUNK_SIZE):
+    """
+    Take listings off the site without closing them: they are marked
+    withdrawn, so no winner is ever set, and pending notifications about
+    them are dropped.
+    """
+    def update(ids, now):
+        withdrawn = Listing.objects.filter(pk__in=ids, is_active=True).update(
+            is_active=False, withdrawn_at=now, updated_at=now
+        )
+        # Only for the listings withdrawn here: closed ones keep their won/ended events
+        NotificationEvent.objects.filter(
+            listing_id__in=ids, listing__withdrawn_at=now, sent_at__isnull=True
+        ).delete()
+        return withdrawn
+    return _apply(listings, update, chunk_size)
+
+
+def extend(listings, by, chunk_size=CHUNK_SIZE):
+    """Push back the end_date of active listings by the timedelta `by`."""
+    def update(ids, now):
+        # Watchers are reminded again before the new end
+        NotificationEvent.objects.filter(listing_id__in=ids, kind='ending_soon').delete()
+        return Listing.objects.filter(pk__in=ids, is_active=True).update(end_date=F('end_date') + by, updated_at=now)
+    return _apply(listings, update, chunk_size)
+
+
+def recategorize(listings, category, chunk_size=CHUNK_SIZE):
+    """Move listings to `category` (a Category, or None for uncategorized)."""
+    def update(ids, now):
+        moved = Listing.objects.filter(pk__in=ids)
+        if category is None:
+            moved = moved.filter(category__isnull=False)
+        else:
+            moved = moved.exclude(category=category)
+        return moved.update(category=category, updated_at=now)
+    return _apply(listings, update, chunk_size)
@@ -0,0 +1,243 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction
+from django.db.models import CharField, DateTimeField, Exists, OuterRef, Value
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from .models import Bid, NotificationEvent, Watchlist
+
+logger = logging.getLogger(__name__)
+
+
+def record_outbid(bid):
+    """Queue an outbid event for the bidder who held the top bid before `bid`."""
+    previous = (
+        Bid.objects.filter(listing_id=bid.listing_id, amount__lt=bid.amount)
+        .exclude(bidder_id=bid.bidder_id)
+        .order_by('-amount')
+        .values_list('bidder_id', flat=True)
+        .first()
+    )
+    if previous is not None:
+        NotificationEvent.objects.create(
+            user_id=previous, listing_id=bid.listing_id, kind='outbid', amount=bid.amount
+        )
+
+
+def collect_ending_soon(now, window):
+    """
+    Queue one ending-soon event per watcher of every listing ending within
+    `window`, as a single INSERT ... SELECT.
+    """
+    already_queued = NotificationEvent.objects.filter(
+        user=OuterRef('user'), listing=OuterRef('listing'), kind='ending_soon'
+    )
+    watchers = (
+        Watchlist.objects.filter(
+            listing__is_active=True,
+            listing__end_date__gt=now,
+            listing__end_date__lte=now + window,
+        )
+        .exclude(Exists(already_queued))
+        .order_by()
+        .annotate(
+            event_kind=Value('ending_soon', output_field=CharField()),
+            event_created_at=Value(now, output_field=DateTimeField()),
+        )
+        .values_list('user_id', 'listing_id', 'event_kind', 'event_created_at')
+    )
+    select_sql, params = watchers.query.sql_with_params()
+    qn = connection.ops.quote_name
+    columns = ', '.join(qn(column) for column in ('user_id', 'listing_id', 'kind', 'created_at'))
+    # A run overlapping this one may queue the same reminders between the
+    # EXISTS check and the insert; the unique constraint drops the duplicates
+    insert = connection.ops.insert_statement(on_conflict=OnConflict.IGNORE)
+    suffix = connection.ops.on_conflict_suffix_sql([], OnConflict.IGNORE, [], [])
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'{insert} {qn(NotificationEvent._meta.db_table)} ({columns}) {select_sql} {suffix}',
+            params,
+        )
+        return cursor.rowcount
+
+
+def due_user_ids(now, interval):
+    """Users with pending events who have not had a digest within `interval`."""
+    recently_sent = NotificationEvent.objects.filter(user=OuterRef('user_id'), sent_at__gt=now - interval)
+    return (
+        NotificationEvent.objects.filter(sent_at__isnull=True)
+        .exclude(Exists(recently_sent))
+        .order_by('user_id')
+        .values_list('user_id', flat=True)
+        .distinct()
+    )
+
+
+def build_digest(email, username, events):
+    """One message summarising a user's pending events, the newest per listing and kind."""
+    latest = {kind: {} for kind, _ in NotificationEvent.KIND_CHOICES}
+    for event in events:
+        latest[event['kind']][event['listing_id']] = event
+    outbid, ending, won, ended = latest['outbid'], latest['ending_soon'], latest['won'], latest['ended']
+    lines = [f'Hi {username},', '']
+    if won:
+        lines.append('Congratulations, you won:')
+        lines.extend(f'  - {e["listing__title"]} for ${e["amount"]}' for e in won.values())
+        lines.append('Please contact the sellers to arrange payment and delivery.')
+        lines.append('')
+    if ended:
+        lines.append('Your auctions that have ended:')
+        lines.extend(
+            f'  - {e["listing__title"]}: ' + (f'sold for ${e["amount"]}' if e['amount'] is not None else 'no bids')
+            for e in ended.values()
+        )
+        lines.append('')
+    if outbid:
+        lines.append("You've been outbid on:")
+        lines.extend(f'  - {e["listing__title"]}: new high bid ${e["amount"]}' for e in outbid.values())
+        lines.append('')
+    if ending:
+        lines.append('Auctions on your watchlist ending soon:')
+        lines.extend(
+            f'  - {e["listing__title"]}: ends {e["listing__end_date"]:%Y-%m-%d %H:%M} UTC' for e in ending.values()
+        )
+        lines.append('')
+    count = sum(len(by_listing) for by_listing in latest.values())
+    subject = f'{count} update{"s" if count != 1 else ""} on your auctions'
+    return EmailMessage(subject=subject, body='\n'.join(lines), from_email=settings.DEFAULT_FROM_EMAIL, to=[email])
+
+
+class PooledMailSender:
+    """
+    Send messages in batches over a small pool of mail connections, each
+    opened once and reused until close(). Messages are sent one by one, so
+    a failure loses only the message it hit.
+    """
+
+    def __init__(self, pool_size=None, batch_size=100):
+        self.pool_size = pool_size or getattr(settings, 'NOTIFICATION_MAIL_CONNECTIONS', 4)
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._idle = queue.SimpleQueue()
+        self._connections = []
+
+    def _acquire(self):
+        # No more connections are ever opened than batches run at once, at most pool_size
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            connection = get_connection(fail_silently=False)
+            with self._lock:
+                self._connections.append(connection)
+            return connection
+
+    def _send_batch(self, batch):
+        connection = self._acquire()
+        sent = []
+        try:
+            for message, event_ids in batch:
+                try:
+                    # Opens the connection if it isn't; send_messages() then leaves it open
+                    connection.open()
+                    if not connection.send_messages([message]):
+                        continue
+                except Exception:
+                    logger.exception('Failed to send a notification digest to %s', ', '.join(message.to))
+                    # Reconnect for the rest of the batch
+                    connection.close()
+                    continue
+                sent.extend(event_ids)
+        finally:
+            self._idle.put(connection)
+        return sent
+
+    def send(self, items):
+        """Send (message, event ids) pairs and return the ids of the events delivered."""
+        batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+        if len(batches) <= 1:
+            return [event_id for batch in batches for event_id in self._send_batch(batch)]
+        with ThreadPoolExecutor(max_workers=self.pool_size) as pool:
+            return [event_id for sent in pool.map(self._send_batch, batches) for event_id in sent]
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._idle = queue.SimpleQueue()
+        for connection in connections:
+            try:
+                connection.close()
+            except Exception:
+                logger.exception('Failed to close a mail connection')
+
+
+def send_digests(now, interval, sender, batch_size=1000):
+    """Send one digest per due user; returns (digests sent, events delivered)."""
+    digests = delivered = 0
+    users = due_user_ids(now, interval)
+    last_user_id = 0
+    while True:
+        user_ids = list(users.filter(user_id__gt=last_user_id)[:batch_size])
+        if not user_ids:
+            return digests, delivered
+        last_user_id = user_ids[-1]
+        events = (
+            NotificationEvent.objects.filter(user_id__in=user_ids, sent_at__isnull=True)
+            .order_by('user_id', 'created_at')
+            .values(
+                'id', 'user_id', 'user__email', 'user__username', 'kind', 'amount',
+                'listing_id', 'listing__title', 'listing__end_date',
+            )
+        )
+        items = []
+        for _, user_events in groupby(events, key=lambda e: e['user_id']):
+            user_events = list(user_events)
+            event_ids = [e['id'] for e in user_events]
+            email = user_events[0]['user__email']
+            if not email:
+                # Nothing to deliver to; mark as handled so they don't pile up
+                NotificationEvent.objects.filter(pk__in=event_ids).update(sent_at=now)
+                continue
+            items.append((build_digest(email, user_events[0]['user__username'], user_events), event_ids))
+        sent_ids = sender.send(items)
+        for start in range(0, len(sent_ids), batch_size):
+            NotificationEvent.objects.filter(pk__in=sent_ids[start:start + batch_size]).update(sent_at=now)
+        sent = set(sent_ids)
+        digests += sum(1 for _, event_ids in items if event_ids[0] in sent)
+        delivered += len(sent_ids)
+
+
+def run_cycle(now=None, sender=None):
+    """Collect events, send due digests and prune old ones; returns timings and counts."""
+    now = now or timezone.now()
+    interval = timedelta(seconds=getattr(settings, 'NOTIFICATION_DIGEST_INTERVAL', 15 * 60))
+    window = timedelta(seconds=getattr(settings, 'NOTIFICATION_ENDING_SOON_WINDOW', 60 * 60))
+    sender = sender or PooledMailSender()
+
+    started = time.monotonic()
+    collected = collect_ending_soon(now, window)
+    collected_in = time.monotonic() - started
+
+    started = time.monotonic()
+    try:
+        digests, delivered = send_digests(now, interval, sender)
+    finally:
+        sender.close()
+    sent_in = time.monotonic() - started
+
+    NotificationEvent.objects.filter(sent_at__lt=now - timedelta(days=7)).delete()
+    return {
+        'collected': collected,
+        'collect_seconds': collected_in,
+        'digests': digests,
+        'events_delivered': delivered,
+        'send_seconds': sent_in,
+    }
@@ -0,0 +1,113 @@
+"""
+Repeated-query (N+1) detection.
+
+QueryShapes records the SQL run inside it, grouped by statement shape:
+literals, parameters and IN lists are normalized away, so the query loading
+`bid.listing` for one bid has the same shape as for every other. A shape
+run more than `threshold` times is reported with where it came from: the
+template tag being rendered and the innermost frames of this project's code.
+
+Used by RepeatedQueryMiddleware under DEBUG, and by
+auctions.testing.QueryBudgetMixin in tests.
+"""
+import re
+import sys
+from collections import Counter
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PARAMETER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACE = re.compile(r'\s+')
+
+# Project frames shown per call site
+STACK_DEPTH = 4
+
+
+class RepeatedQueries(Exception):
+    pass
+
+
+def normalize_sql(sql):
+    """Reduce a statement to its shape: `WHERE "id" IN (1, 2, 3)` -> `WHERE "id" IN (...)`."""
+    sql = _STRING.sub('?', sql.replace('%s', '?'))
+    sql = _NUMBER.sub('?', sql)
+    sql = _PARAMETER_LIST.sub('(...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+# Installed packages may live under BASE_DIR (a virtualenv in the project); this module is never the cause
+_NOT_PROJECT = ('site-packages', 'dist-packages', Path(__file__).name)
+
+
+def call_site(frame):
+    """Where a query was triggered from: (template location or None, project stack frames)."""
+    base = str(Path(settings.BASE_DIR).resolve())
+    template = None
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        if template is None and code.co_name == 'render_annotated':
+            # The innermost template node being rendered
+            node = frame.f_locals.get('self')
+            token = getattr(node, 'token', None)
+            origin = getattr(node, 'origin', None)
+            if token is not None and origin is not None:
+                template = f'{origin.template_name}, line {token.lineno}: {token.contents}'
+        filename = code.co_filename
+        in_project = filename.startswith(base) and not any(part in filename for part in _NOT_PROJECT)
+        if in_project and len(stack) < STACK_DEPTH:
+            stack.append(f'{Path(filename).relative_to(base)}:{frame.f_lineno} in {code.co_name}')
+        frame = frame.f_back
+    return template, tuple(stack)
+
+
+class QueryShapes:
+    """Context manager counting the queries run on every database connection by shape."""
+
+    def __init__(self, threshold=5):
+        self.threshold = threshold
+        self.shapes = {}  # shape -> [times run, first statement, Counter of call sites]
+        self._stack = None
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        shape = normalize_sql(sql)
+        entry = self.shapes.get(shape)
+        if entry is None:
+            entry = self.shapes[shape] = [0, sql, Counter()]
+        entry[0] += 1
+        entry[2][call_site(sys._getframe(1))] += 1
+        return execute(sql, params, many, context)
+
+    @property
+    def count(self):
+        return sum(entry[0] for entry in self.shapes.values())
+
+    def repeated(self):
+        """[(shape, times run, example statement, Counter of call sites)] over the threshold, most run first."""
+        found = [(shape, *entry) for shape, entry in self.shapes.items() if entry[0] > self.threshold]
+        return sorted(found, key=lambda item: -item[1])
+
+    def report(self):
+        lines = []
+        for shape, times, example, sites in self.repeated():
+            lines.append(f'{times} x {example}')
+            for (template, stack), count in sites.most_common(3):
+                lines.append(f'  {count} x from:')
+                if template:
+                    lines.append(f'    template {template}')
+                lines.extend(f'    {frame}' for frame in stack)
+        return '\n'.join(lines)
@@ -0,0 +1,179 @@
+import re
+from itertools import islice
+
+import numpy as np
+from scipy import sparse
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .caching import touch_catalog
+from .columnar import EPOCH, fetch_columns
+from .models import Bid, Listing, SimilarListing, Watchlist
+
+TOKEN_RE = re.compile(r'[a-z0-9]{2,}')
+
+DEFAULT_WEIGHTS = {
+    'watch': 1.0,
+    'bid': 1.0,
+    'title': 0.5,
+    'category': 0.2,
+}
+
+
+def _cooccurrence(user_ids, listing_idx, n_listings, max_items_per_user):
+    """Cosine similarity between listings from a user x listing incidence matrix."""
+    if not len(user_ids):
+        return sparse.csr_matrix((n_listings, n_listings))
+    _, user_idx = np.unique(user_ids, return_inverse=True)
+    incidence = sparse.csr_matrix(
+        (np.ones(len(user_idx)), (user_idx, listing_idx)),
+        shape=(user_idx.max() + 1, n_listings),
+    )
+    incidence.sum_duplicates()
+    incidence.data[:] = 1.0
+    # Users touching a huge number of listings carry little signal and would
+    # make the product dense
+    incidence = incidence[np.diff(incidence.indptr) <= max_items_per_user]
+    norms = np.sqrt(np.asarray(incidence.sum(axis=0)).ravel())
+    norms[norms == 0] = 1.0
+    incidence = incidence @ sparse.diags(1.0 / norms)
+    return (incidence.T @ incidence).tocsr()
+
+
+def _title_similarity(titles, max_term_listings):
+    """Cosine similarity of TF-IDF title vectors, ignoring very common terms."""
+    n = len(titles)
+    vocabulary = {}
+    rows, cols = [], []
+    for i, title in enumerate(titles):
+        for term in set(TOKEN_RE.findall(title.lower())):
+            rows.append(i)
+            cols.append(vocabulary.setdefault(term, len(vocabulary)))
+    if not rows:
+        return sparse.csr_matrix((n, n))
+    terms = sparse.csr_matrix(
+        (np.ones(len(rows)), (np.array(rows), np.array(cols))),
+        shape=(n, len(vocabulary)),
+    )
+    document_frequency = np.bincount(cols, minlength=len(vocabulary))
+    keep = (document_frequency >= 2) & (document_frequency <= max_term_listings)
+    idf = np.log(n / np.maximum(document_frequency, 1))
+    terms = terms @ sparse.diags(np.where(keep, idf, 0.0))
+    norms = np.sqrt(np.asarray(terms.multiply(terms).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    terms = sparse.diags(1.0 / norms) @ terms
+    return (terms @ terms.T).tocsr()
+
+
+def _category_candidates(categories, end_dates, k):
+    """Pair every listing with the k+1 soonest-ending listings in its category."""
+    order = np.lexsort((end_dates, categories))
+    sorted_categories = categories[order]
+    boundaries = np.flatnonzero(np.diff(sorted_categories)) + 1
+    rows, cols = [], []
+    for group in np.split(order, boundaries):
+        if categories[group[0]] < 0 or len(group) < 2:
+            continue
+        heads = group[:k + 1]
+        rows.append(np.repeat(group, len(heads)))
+        cols.append(np.tile(heads, len(group)))
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(rows), np.concatenate(cols)
+
+
+def _top_k(rows, cols, scores, k):
+    """Keep the k highest-scoring entries of every row, returning (rows, cols, scores, ranks)."""
+    order = np.lexsort((-scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+    ranks = np.arange(len(rows)) - np.searchsorted(rows, rows, side='left')
+    keep = ranks < k
+    return rows[keep], cols[keep], scores[keep], ranks[keep]
+
+
+def compute_similar_listings(top_k=10, weights=None, max_items_per_user=500, max_term_listings=1000):
+    """
+    Return (listing ids, similar ids, scores, ranks) arrays with the top_k
+    neighbours of every active listing.
+    """
+    weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+    pks, categories, end_dates = fetch_columns(
+        Listing.objects.filter(is_active=True).order_by('pk'),
+        {'pk': np.int64, 'category_id': np.int64, 'end_date': EPOCH},
+    )
+    n = len(pks)
+    if n < 2:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0), empty
+
+    def index_of(listing_ids):
+        positions = np.searchsorted(pks, listing_ids)
+        positions[positions == n] = 0
+        return positions, pks[positions] == listing_ids
+
+    signals = []
+    for model, user_field, weight in ((Watchlist, 'user_id', weights['watch']), (Bid, 'bidder_id', weights['bid'])):
+        if not weight:
+            continue
+        user_ids, listing_ids = fetch_columns(
+            model.objects.filter(listing__is_active=True).order_by(),
+            {user_field: np.int64, 'listing_id': np.int64},
+        )
+        positions, found = index_of(listing_ids)
+        signals.append(weight * _cooccurrence(user_ids[found], positions[found], n, max_items_per_user))
+
+    if weights['title']:
+        # Matched up by pk: listings added or closed since pks was read must not shift the rows
+        titles = dict(Listing.objects.filter(is_active=True).order_by().values_list('pk', 'title'))
+        titles = [titles.get(pk, '') for pk in pks.tolist()]
+        signals.append(weights['title'] * _title_similarity(titles, max_term_listings))
+
+    combined = sparse.csr_matrix((n, n))
+    for signal in signals:
+        combined = combined + signal
+    combined = combined.tocoo()
+    rows, cols, scores = combined.row.astype(np.int64), combined.col.astype(np.int64), combined.data
+
+    if weights['category']:
+        same_category = (categories[rows] == categories[cols]) & (categories[rows] >= 0)
+        scores = scores + weights['category'] * same_category
+        # Listings with no behavioural or title overlap still get neighbours
+        # from their own category, ranked below any real match
+        candidate_rows, candidate_cols = _category_candidates(categories, end_dates, top_k)
+        rows = np.concatenate([rows, candidate_rows])
+        cols = np.concatenate([cols, candidate_cols])
+        scores = np.concatenate([scores, np.full(len(candidate_rows), weights['category'] / 2)])
+        merged = sparse.coo_matrix((scores, (rows, cols)), shape=(n, n)).tocsr()
+        merged.sum_duplicates()
+        merged = merged.tocoo()
+        rows, cols, scores = merged.row.astype(np.int64), merged.col.astype(np.int64), merged.data
+
+    off_diagonal = (rows != cols) & (scores > 0)
+    rows, cols, scores, ranks = _top_k(rows[off_diagonal], cols[off_diagonal], scores[off_diagonal], top_k)
+    return pks[rows], pks[cols], scores, ranks
+
+
+def rebuild_similar_listings(top_k=10, batch_size=5000, **options):
+    """Recompute the recommendations and replace the SimilarListing table atomically."""
+    listing_ids, similar_ids, scores, ranks = compute_similar_listings(top_k=top_k, **options)
+    qn = connection.ops.quote_name
+    # Plain executemany: building model instances costs more than the whole computation
+    insert = 'INSERT INTO %s (%s) VALUES (%%s, %%s, %%s, %%s)' % (
+        qn(SimilarListing._meta.db_table),
+        ', '.join(qn(column) for column in ('listing_id', 'similar_id', 'score', 'rank')),
+    )
+    rows = zip(listing_ids.tolist(), similar_ids.tolist(), scores.tolist(), ranks.tolist())
+    # The listing pages show their recommendations, so those with any before or after
+    # the rebuild are revalidated: their ETags and cached pages go with updated_at
+    recommended = Listing.objects.filter(pk__in=SimilarListing.objects.values('listing_id'))
+    with transaction.atomic(), connection.cursor() as cursor:
+        recommended.update(updated_at=timezone.now())
+        SimilarListing.objects.all().delete()
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            cursor.executemany(insert, batch)
+        recommended.update(updated_at=timezone.now())
+        touch_catalog()
+    return len(listing_ids)
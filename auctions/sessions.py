@@ -0,0 +1,37 @@
+"""
+Cached, database-backed sessions that skip redundant writes.
+
+Use with SESSION_ENGINE = 'auctions.sessions'.
+"""
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+
+
+class SessionStore(CachedDBStore):
+    """
+    Reads come from the cache and fall back to the database; writes go to
+    both. A session marked as modified whose data is identical to what was
+    loaded (e.g. a key re-assigned to the same value) is not written again.
+    """
+
+    _loaded_state = None
+
+    def _serialized(self, data):
+        return self.serializer().dumps(data)
+
+    def load(self):
+        data = super().load()
+        self._loaded_state = self._serialized(data)
+        return data
+
+    def save(self, must_create=False):
+        unchanged = (
+            not must_create
+            and not settings.SESSION_SAVE_EVERY_REQUEST
+            and self._loaded_state is not None
+            and self._serialized(self._session) == self._loaded_state
+        )
+        if unchanged:
+            return
+        super().save(must_create)
+        self._loaded_state = self._serialized(self._session)
@@ -0,0 +1,227 @@
+"""
+Incremental shill-bidding detection.
+
+Bids and closed auctions are folded into per (bidder, seller) statistics
+once each, behind watermarks kept in JobCheckpoint rows: the highest bid
+pk scanned, and the latest Listing.closed_at. Rows are only passed once
+they are COMMIT_LAG_SECONDS old, so a transaction still open when a scan
+runs commits before the watermark passes its rows.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .columnar import EPOCH, fetch_columns
+from .models import Bid, BidderSellerStats, JobCheckpoint, Listing, ShillSuspect
+
+BIDS_CHECKPOINT = 'shill_detection:bids'
+CLOSED_CHECKPOINT = 'shill_detection:closed_listings'
+
+# A bid counts as "late" when placed within this many seconds of the end
+LATE_BID_SECONDS = 3600
+
+# How long after a bid or close is stamped its transaction may still commit
+COMMIT_LAG_SECONDS = 60
+
+STAT_FIELDS = ['bid_count', 'late_bid_count', 'auctions', 'auctions_won']
+
+# Pairs per lookup query, keeping IN clauses under database parameter limits
+PAIR_BATCH_SIZE = 2000
+
+
+def _checkpoint(name):
+    checkpoint, _ = JobCheckpoint.objects.get_or_create(name=name)
+    return checkpoint
+
+
+def _group_pairs(bidders, sellers, *values):
+    """Sum each value array per distinct (bidder, seller) pair."""
+    pairs, inverse = np.unique(np.stack([bidders, sellers], axis=1), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    sums = [np.bincount(inverse, weights=v, minlength=len(pairs)).astype(np.int64) for v in values]
+    return pairs, sums
+
+
+def _load_stats(pairs):
+    """Current statistics for each pair, as a (len(pairs), len(STAT_FIELDS)) array."""
+    stats = {
+        (row[0], row[1]): row[2:]
+        for row in BidderSellerStats.objects.filter(
+            bidder_id__in=set(pairs[:, 0].tolist()),
+            seller_id__in=set(pairs[:, 1].tolist()),
+        ).values_list('bidder_id', 'seller_id', *STAT_FIELDS)
+    }
+    empty = (0,) * len(STAT_FIELDS)
+    return np.array([stats.get(pair, empty) for pair in map(tuple, pairs.tolist())], dtype=np.int64).reshape(
+        len(pairs), len(STAT_FIELDS)
+    )
+
+
+def apply_deltas(pairs, deltas):
+    """Add per-pair deltas ({field: array}) to BidderSellerStats with batched upserts."""
+    for start in range(0, len(pairs), PAIR_BATCH_SIZE):
+        batch = pairs[start:start + PAIR_BATCH_SIZE]
+        values = _load_stats(batch)
+        for j, field in enumerate(STAT_FIELDS):
+            if field in deltas:
+                values[:, j] += deltas[field][start:start + PAIR_BATCH_SIZE]
+        BidderSellerStats.objects.bulk_create(
+            [
+                BidderSellerStats(bidder_id=bidder_id, seller_id=seller_id, **dict(zip(STAT_FIELDS, row)))
+                for (bidder_id, seller_id), row in zip(batch.tolist(), values.tolist())
+            ],
+            update_conflicts=True,
+            unique_fields=['bidder', 'seller'],
+            update_fields=STAT_FIELDS,
+        )
+
+
+def scan_new_bids(chunk_size=100000, now=None):
+    """Fold bids placed since the last run into the pair statistics."""
+    cutoff = ((now or timezone.now()) - timedelta(seconds=COMMIT_LAG_SECONDS)).timestamp()
+    checkpoint = _checkpoint(BIDS_CHECKPOINT)
+    touched = []
+    while True:
+        bid_ids, bidders, sellers, created, end_dates = fetch_columns(
+            Bid.objects.filter(pk__gt=checkpoint.position).order_by('pk')[:chunk_size],
+            {
+                'pk': np.int64,
+                'bidder_id': np.int64,
+                'listing__seller_id': np.int64,
+                'created_at': EPOCH,
+                'listing__end_date': EPOCH,
+            },
+        )
+        # Stop at the first recent bid: a lower pk may belong to a transaction not yet committed
+        recent = np.flatnonzero(created >= cutoff)
+        settled = recent[0] if len(recent) else len(bid_ids)
+        if not settled:
+            break
+        bid_ids, bidders, sellers = bid_ids[:settled], bidders[:settled], sellers[:settled]
+        late = (end_dates[:settled] - created[:settled]) <= LATE_BID_SECONDS
+        pairs, (bid_count, late_count) = _group_pairs(bidders, sellers, np.ones(len(bid_ids)), late)
+        with transaction.atomic():
+            apply_deltas(pairs, {'bid_count': bid_count, 'late_bid_count': late_count})
+            checkpoint.position = int(bid_ids[-1])
+            checkpoint.save()
+        touched.append(pairs)
+        if settled < chunk_size:
+            break
+    return touched
+
+
+def scan_closed_listings(batch_size=5000, now=None):
+    """Count auctions taken part in and won for auctions closed since the last run."""
+    cutoff = (now or timezone.now()) - timedelta(seconds=COMMIT_LAG_SECONDS)
+    checkpoint = _checkpoint(CLOSED_CHECKPOINT)
+    # Keyed on the close: an auction is closed once, however its end_date moved before
+    closed = Listing.objects.filter(is_active=False, withdrawn_at__isnull=True, closed_at__lte=cutoff)
+    if checkpoint.timestamp:
+        closed = closed.filter(closed_at__gt=checkpoint.timestamp)
+    listing_ids, = fetch_columns(closed.order_by('pk'), {'pk': np.int64})
+    touched = []
+    with transaction.atomic():
+        for start in range(0, len(listing_ids), batch_size):
+            batch = listing_ids[start:start + batch_size].tolist()
+            bid_listings, bidders, sellers, winners = fetch_columns(
+                Bid.objects.filter(listing_id__in=batch).order_by(),
+                {
+                    'listing_id': np.int64,
+                    'bidder_id': np.int64,
+                    'listing__seller_id': np.int64,
+                    'listing__winner_id': np.int64,
+                },
+            )
+            if not len(bid_listings):
+                continue
+            # One participation per bidder per listing
+            _, first = np.unique(np.stack([bid_listings, bidders], axis=1), axis=0, return_index=True)
+            bidders, sellers = bidders[first], sellers[first]
+            won = bidders == winners[first]
+            pairs, (auctions, auctions_won) = _group_pairs(bidders, sellers, np.ones(len(bidders)), won)
+            apply_deltas(pairs, {'auctions': auctions, 'auctions_won': auctions_won})
+            touched.append(pairs)
+        checkpoint.timestamp = cutoff
+        checkpoint.save()
+    return touched
+
+
+def _totals(field, ids):
+    """Total bids per bidder or per seller, aligned with ids."""
+    totals = {}
+    unique_ids = np.unique(ids).tolist()
+    for start in range(0, len(unique_ids), PAIR_BATCH_SIZE):
+        totals.update(
+            BidderSellerStats.objects.filter(**{f'{field}__in': unique_ids[start:start + PAIR_BATCH_SIZE]})
+            .values(field).annotate(total=Sum('bid_count')).values_list(field, 'total')
+        )
+    return np.array([totals.get(i, 0) for i in ids.tolist()], dtype=np.float64)
+
+
+def score_pairs(pairs, min_bids=5, min_auctions=3):
+    """
+    Score (bidder, seller) pairs. A shill concentrates their bids on one
+    seller, keeps losing that seller's auctions and rarely bids late.
+    Returns (pairs, scores, features).
+    """
+    if not len(pairs):
+        return pairs, np.empty(0), []
+    values = np.concatenate([
+        _load_stats(pairs[start:start + PAIR_BATCH_SIZE]) for start in range(0, len(pairs), PAIR_BATCH_SIZE)
+    ]).astype(np.float64)
+    bid_count, late_bid_count, auctions, auctions_won = values.T
+    bidder_total = _totals('bidder_id', pairs[:, 0])
+    seller_total = _totals('seller_id', pairs[:, 1])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        concentration = np.nan_to_num(bid_count / bidder_total)
+        seller_share = np.nan_to_num(bid_count / seller_total)
+        loss_rate = np.nan_to_num((auctions - auctions_won) / auctions)
+        late_share = np.nan_to_num(late_bid_count / bid_count)
+    scores = concentration * loss_rate * (1 - 0.5 * late_share)
+    scores[(bid_count < min_bids) | (auctions < min_auctions)] = 0.0
+    features = [
+        {
+            'bid_count': int(bid_count[i]),
+            'auctions': int(auctions[i]),
+            'auctions_won': int(auctions_won[i]),
+            'concentration': round(float(concentration[i]), 4),
+            'seller_share': round(float(seller_share[i]), 4),
+            'loss_rate': round(float(loss_rate[i]), 4),
+            'late_share': round(float(late_share[i]), 4),
+        }
+        for i in range(len(pairs))
+    ]
+    return pairs, scores, features
+
+
+def flag_suspects(pairs, scores, features, threshold=0.6):
+    """Queue pairs scoring at or above threshold for review; reviewed pairs are left alone."""
+    flagged = 0
+    for (bidder_id, seller_id), score, feature in zip(pairs.tolist(), scores.tolist(), features):
+        if score < threshold:
+            continue
+        suspect, created = ShillSuspect.objects.get_or_create(
+            bidder_id=bidder_id,
+            seller_id=seller_id,
+            defaults={'score': score, 'features': feature},
+        )
+        if not created and suspect.status == 'pending':
+            suspect.score = score
+            suspect.features = feature
+            suspect.save(update_fields=['score', 'features', 'updated_at'])
+        flagged += created
+    return flagged
+
+
+def run(threshold=0.6, chunk_size=100000, now=None):
+    """Process bids and closed auctions since the last run; returns (pairs scored, newly flagged)."""
+    touched = scan_new_bids(chunk_size, now) + scan_closed_listings(now=now)
+    if not touched:
+        return 0, 0
+    pairs = np.unique(np.concatenate(touched), axis=0)
+    pairs, scores, features = score_pairs(pairs)
+    return len(pairs), flag_suspects(pairs, scores, features, threshold)
@@ -0,0 +1,85 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from .autocomplete import autocomplete_index
+from .backends import invalidate_cached_user
+from .bid_log import record_accepted
+from .caching import touch_catalog, touch_listing
+from .ending_soon import ending_soon_index
+from .models import Bid, Category, Comment, Listing, UserProfile
+from .notifications import record_outbid
+from .storage import change_references, instance_blobs, remember_blobs, stored_blobs
+
+
+@receiver(post_save, sender=Listing)
+def listing_saved(sender, instance, **kwargs):
+    ending_soon_index.update(instance)
+    autocomplete_index.update(instance)
+    touch_catalog()
+
+
+@receiver(post_delete, sender=Listing)
+def listing_deleted(sender, instance, **kwargs):
+    ending_soon_index.remove(instance.pk)
+    autocomplete_index.remove(instance.pk)
+    touch_catalog()
+
+
+@receiver(post_save, sender=Bid)
+@receiver(post_delete, sender=Bid)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def listing_activity_changed(sender, instance, **kwargs):
+    touch_listing(instance.listing_id)
+
+
+@receiver(post_save, sender=Bid)
+def bid_placed(sender, instance, created, **kwargs):
+    if created:
+        record_outbid(instance)
+        record_accepted(instance)
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, **kwargs):
+    autocomplete_index.update_category(instance)
+    touch_catalog()
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    autocomplete_index.remove_category(instance.pk)
+    touch_catalog()
+
+
+@receiver(post_init, sender=Listing)
+@receiver(post_init, sender=UserProfile)
+def media_loaded(sender, instance, **kwargs):
+    # What the row holds, so saving doesn't have to read it again
+    remember_blobs(instance)
+
+
+@receiver(pre_save, sender=Listing)
+@receiver(pre_save, sender=UserProfile)
+def media_saving(sender, instance, update_fields=None, **kwargs):
+    instance._stored_blobs = stored_blobs(instance, update_fields)
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_save, sender=UserProfile)
+def media_saved(sender, instance, update_fields=None, **kwargs):
+    change_references(instance_blobs(instance, update_fields), instance.__dict__.pop('_stored_blobs', ()))
+    remember_blobs(instance, update_fields)
+
+
+@receiver(post_delete, sender=Listing)
+@receiver(post_delete, sender=UserProfile)
+def media_deleted(sender, instance, **kwargs):
+    change_references(removed=instance_blobs(instance))
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def user_changed(sender, instance, **kwargs):
+    invalidate_cached_user(instance.pk)
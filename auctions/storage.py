@@ -0,0 +1,327 @@
+import gzip
+import hashlib
+import os
+import re
+import tempfile
+from collections import Counter
+from datetime import timedelta
+from functools import lru_cache
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import models, transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; only .gz files are written without it
+    brotli = None
+
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.html', '.txt', '.json', '.xml', '.map', '.ico')
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Manifest storage that also writes .gz and .br siblings for text assets
+    at collectstatic time, so they can be served without compressing per
+    request.
+    """
+
+    min_compress_size = 256
+
+    def stored_name(self, name):
+        # Until collectstatic has written a manifest, fall back to unhashed names
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if not isinstance(processed, Exception):
+                names.add(name)
+                if hashed_name:
+                    names.add(hashed_name)
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        for name in sorted(names):
+            if name.endswith(COMPRESSIBLE_EXTENSIONS) and self.exists(name):
+                self.compress(name)
+
+    def compress(self, name):
+        path = self.path(name)
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < self.min_compress_size:
+            return
+        variants = [('.gz', lambda d: gzip.compress(d, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append(('.br', lambda d: brotli.compress(d, quality=11)))
+        for suffix, compressor in variants:
+            compressed = compressor(data)
+            # Not worth serving if it saves less than 5%
+            if len(compressed) < len(data) * 0.95:
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
+            elif os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+BLOB_DIR = 'blobs'
+# blobs/ab/cd/abcd...(64 hex digits)[.ext]
+_BLOB_NAME = re.compile(r'^%s/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.[a-z0-9]{1,8})?$' % BLOB_DIR)
+_EXTENSION = re.compile(r'^\.[a-z0-9]{1,8}$')
+
+
+class FileTooLarge(SuspiciousFileOperation):
+    pass
+
+
+def max_upload_size():
+    return getattr(settings, 'MEDIA_MAX_UPLOAD_SIZE', 10 * 1024 * 1024)
+
+
+def is_blob(name):
+    return bool(name) and _BLOB_NAME.match(name) is not None
+
+
+class DeduplicatingStorage(FileSystemStorage):
+    """
+    Media storage that keeps each distinct file once.
+
+    An upload is hashed while it is streamed in chunks to a temporary file
+    and then moved to blobs/<ab>/<cd>/<sha256><ext>. If that blob already
+    exists the copy is discarded and the existing name is returned, so a
+    photo uploaded for many listings is stored once. Uploads larger than
+    MEDIA_MAX_UPLOAD_SIZE are refused with FileTooLarge as soon as that
+    many bytes have been read.
+
+    Each blob has a MediaBlob row. Its `references` count is kept by
+    auctions.signals for the model fields using this storage. Unreferenced
+    blobs are removed by collect_garbage (`manage.py collect_media_blobs`),
+    never by delete(), since other rows may share the file.
+    """
+
+    chunk_size = 64 * 1024
+
+    def get_available_name(self, name, max_length=None):
+        # The stored name comes from the content, not the upload's name
+        return name
+
+    def blob_name(self, digest, name):
+        extension = os.path.splitext(name)[1].lower()
+        if not _EXTENSION.match(extension):
+            extension = ''
+        return f'{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+    def _temp_dir(self):
+        directory = os.path.join(self.location, BLOB_DIR, 'tmp')
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def _save(self, name, content):
+        limit = max_upload_size()
+        try:
+            size = content.size
+        except AttributeError:
+            size = None
+        if size is not None and size > limit:
+            raise FileTooLarge(f'{name} is {size} bytes, over the {limit} byte limit')
+
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(suffix='.part', dir=self._temp_dir())
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks(self.chunk_size):
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    size += len(chunk)
+                    if size > limit:
+                        raise FileTooLarge(f'{name} is over the {limit} byte limit')
+                    digest.update(chunk)
+                    f.write(chunk)
+            name = self.blob_name(digest.hexdigest(), name)
+            self._store(name, temp_path, size)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return name
+
+    def _store(self, name, temp_path, size):
+        from .models import MediaBlob
+
+        path = self.path(name)
+        # The row lock keeps collect_garbage from removing a blob this upload is reusing
+        with transaction.atomic():
+            blob, created = MediaBlob.objects.select_for_update().get_or_create(name=name, defaults={'size': size})
+            if not created:
+                MediaBlob.objects.filter(pk=blob.pk).update(last_used=timezone.now())
+            if not os.path.exists(path):
+                directory = os.path.dirname(path)
+                if self.directory_permissions_mode is not None:
+                    old_umask = os.umask(0o777 & ~self.directory_permissions_mode)
+                    try:
+                        os.makedirs(directory, self.directory_permissions_mode, exist_ok=True)
+                    finally:
+                        os.umask(old_umask)
+                else:
+                    os.makedirs(directory, exist_ok=True)
+                # mkstemp creates the file readable by its owner only
+                os.chmod(temp_path, self.file_permissions_mode if self.file_permissions_mode is not None else 0o644)
+                os.replace(temp_path, path)
+
+    def delete(self, name):
+        if is_blob(name):
+            return
+        super().delete(name)
+
+    def remove_blob(self, name):
+        super().delete(name)
+
+
+@lru_cache(maxsize=None)
+def blob_fields(model):
+    """Names of `model`'s file fields whose files are stored as blobs."""
+    return [
+        field.attname for field in model._meta.concrete_fields
+        if isinstance(field, models.FileField) and isinstance(field.storage, DeduplicatingStorage)
+    ]
+
+
+def remember_blobs(instance, update_fields=None):
+    """Note the file names `instance`'s row holds, as loaded or just saved, for stored_blobs()."""
+    fields = blob_fields(type(instance))
+    if update_fields is not None:
+        fields = [field for field in fields if field in update_fields]
+    remembered = instance.__dict__.setdefault('_row_blobs', {})
+    for field in fields:
+        # Deferred fields aren't in __dict__, and reading them would query
+        if field in instance.__dict__:
+            value = instance.__dict__[field]
+            remembered[field] = getattr(value, 'name', value)
+
+
+def stored_blobs(instance, update_fields=None):
+    """The blob names `instance`'s row holds now, before it is saved."""
+    fields = blob_fields(type(instance))
+    if update_fields is not None:
+        fields = [field for field in fields if field in update_fields]
+    if not fields or instance._state.adding:
+        return []
+    remembered = instance.__dict__.get('_row_blobs', {})
+    names = [remembered[field] for field in fields if field in remembered]
+    # Only fields deferred when the row was loaded and assigned since need reading
+    unknown = [field for field in fields if field not in remembered]
+    if unknown:
+        names += type(instance)._base_manager.filter(pk=instance.pk).values_list(*unknown).first() or ()
+    return [name for name in names if is_blob(name)]
+
+
+def instance_blobs(instance, update_fields=None):
+    fields = blob_fields(type(instance))
+    if update_fields is not None:
+        fields = [field for field in fields if field in update_fields]
+    return [name for name in (getattr(instance, field).name for field in fields) if is_blob(name)]
+
+
+def change_references(added=(), removed=()):
+    """Adjust the reference counts for blob names gained and lost by a row."""
+    from .models import MediaBlob
+
+    delta = Counter(added)
+    delta.subtract(removed)
+    now = timezone.now()
+    for name, n in delta.items():
+        if n:
+            # Counts repaired by recount_references may be lower than the rows being changed
+            MediaBlob.objects.filter(name=name).update(references=Greatest(F('references') + n, 0), last_used=now)
+
+
+def recount_references(storage=None):
+    """
+    Recompute every blob's reference count from the rows that use it.
+    Updates and bulk operations bypass the signals keeping the counts, so
+    run this before collecting garbage after such changes. Blobs on disk
+    without a row get one. Returns the number of counts corrected.
+    """
+    from .models import MediaBlob
+
+    storage = storage or default_storage
+    counts = Counter()
+    for model in apps.get_app_config('auctions').get_models():
+        for field in blob_fields(model):
+            rows = model._base_manager.filter(**{f'{field}__startswith': BLOB_DIR + '/'}).order_by()
+            for name, n in rows.values_list(field).annotate(n=Count('pk')):
+                counts[name] += n
+
+    known = set()
+    corrected = []
+    for blob in MediaBlob.objects.only('name', 'references').iterator(chunk_size=2000):
+        known.add(blob.name)
+        if blob.references != counts[blob.name]:
+            blob.references = counts[blob.name]
+            corrected.append(blob)
+    MediaBlob.objects.bulk_update(corrected, ['references'], batch_size=1000)
+
+    missing = [
+        MediaBlob(name=name, size=storage.size(name), references=counts[name])
+        for name in _blob_files(storage) if name not in known
+    ]
+    MediaBlob.objects.bulk_create(missing, batch_size=1000, ignore_conflicts=True)
+    return len(corrected) + len(missing)
+
+
+def _blob_files(storage):
+    root = os.path.join(storage.location, BLOB_DIR)
+    for directory, _, files in os.walk(root):
+        for filename in files:
+            name = os.path.relpath(os.path.join(directory, filename), storage.location).replace(os.sep, '/')
+            if is_blob(name):
+                yield name
+
+
+def collect_garbage(grace_period=None, dry_run=False, storage=None):
+    """
+    Remove blobs that no row references and nothing has uploaded or
+    released for `grace_period` seconds (MEDIA_BLOB_GRACE_PERIOD), plus
+    temporary files left by interrupted uploads. The grace period covers
+    uploads saved to storage but not yet to their row.
+    Returns (blobs removed, bytes freed).
+    """
+    from .models import MediaBlob
+
+    storage = storage or default_storage
+    if grace_period is None:
+        grace_period = getattr(settings, 'MEDIA_BLOB_GRACE_PERIOD', 24 * 60 * 60)
+    cutoff = timezone.now() - timedelta(seconds=grace_period)
+    removed = freed = 0
+    candidates = MediaBlob.objects.filter(references=0, last_used__lt=cutoff).values_list('pk', 'name', 'size')
+    for pk, name, size in list(candidates.iterator()):
+        if dry_run:
+            removed += 1
+            freed += size
+            continue
+        with transaction.atomic():
+            # Re-checked under the lock DeduplicatingStorage takes to reuse a blob
+            blob = MediaBlob.objects.select_for_update().filter(pk=pk, references=0, last_used__lt=cutoff).first()
+            if blob is not None:
+                blob.delete()
+                storage.remove_blob(name)
+                removed += 1
+                freed += size
+
+    if not dry_run:
+        temp_dir = os.path.join(storage.location, BLOB_DIR, 'tmp')
+        if os.path.isdir(temp_dir):
+            for entry in os.scandir(temp_dir):
+                if entry.is_file() and entry.stat().st_mtime < cutoff.timestamp():
+                    os.remove(entry.path)
+    return removed, freed
@@ -0,0 +1,17 @@
+from django import template
+
+from ..form_cache import render_form
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def cached_crispy(context, form):
+    """Drop-in for {% crispy form %} that reuses the form's cached layout."""
+    return render_form(form, context.get('csrf_token'))
+
+
+@register.filter(name='cached_crispy')
+def cached_crispy_filter(form):
+    """Drop-in for {{ form|crispy }} that reuses the form's cached layout."""
+    return render_form(form, use_filter=True)
@@ -1,3 +1,1191 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core import mail
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import analytics, async_views, autocomplete, bid_log, caching, closing, consistency, ending_soon, exports, moderation, notifications, recommendations, shill_detection, storage, throttling, view_counts, views
+from .caching import CATALOG_CHECKPOINT, CatalogClock
+from .middleware import FileServingMiddleware, ThrottleMiddleware
+from .models import (
+    Bid, BidderSellerStats, Category, Comment, JobCheckpoint, Listing, ListingViews, MediaBlob, NotificationEvent,
+    ShillSuspect, SimilarListing, UserProfile, Watchlist,
+)
+from .testing import QueryBudgetMixin
+
+
+# The templates aren't part of the tree; these stand-ins touch what the
+# real pages show, so a relation a page walks per row shows up as N+1
+_CARD = (
+    '{{ listing.title }} {{ listing.seller.username }} {{ listing.category.name }} '
+    '{{ listing.current_bid }} {{ listing.end_date }}'
+)
+PAGE_TEMPLATES = {
+    'base.html': (
+        '{% if user.is_authenticated %}{{ user.username }}{% endif %}'
+        '{% for message in messages %}{{ message }}{% endfor %}{% block content %}{% endblock %}'
+    ),
+    'auctions/listing_card.html': _CARD,
+    'auctions/home.html': (
+        '{% extends "base.html" %}{% block content %}'
+        '{% for category in categories %}{{ category.name }}{% endfor %}'
+        '{% for listing in listings %}{% include "auctions/listing_card.html" %}{% endfor %}'
+        '{% for listing in ending_within_hour %}{% include "auctions/listing_card.html" %}{% endfor %}'
+        '{{ category_stats.median_price }}{% endblock %}'
+    ),
+    'auctions/listing_detail.html': (
+        '{% extends "base.html" %}{% block content %}{% include "auctions/listing_card.html" %}'
+        '{{ listing.description }}{% if listing.winner_id %}{{ listing.winner.username }}{% endif %}'
+        '{{ total_bids }}{% for bid in bids %}{{ bid.bidder.username }} {{ bid.amount }}{% endfor %}'
+        '{% for comment in comments %}{{ comment.author.username }} {{ comment.content }}{% endfor %}'
+        '{{ bid_form.as_p }}{{ comment_form.as_p }}{{ is_watched }}'
+        '{% for listing in similar_listings %}{% include "auctions/listing_card.html" %}{% endfor %}'
+        '{% endblock %}'
+    ),
+    'auctions/create_listing.html': (
+        '{% extends "base.html" %}{% block content %}{{ form.as_p }}'
+        '{% for stats in price_stats %}{{ stats.category.name }} {{ stats.median_price }}{% endfor %}{% endblock %}'
+    ),
+    'auctions/watchlist.html': (
+        '{% extends "base.html" %}{% block content %}{% for item in watchlist_items %}'
+        '{% include "auctions/listing_card.html" with listing=item.listing %}{% endfor %}{% endblock %}'
+    ),
+    'auctions/my_listings.html': (
+        '{% extends "base.html" %}{% block content %}{% for listing in listings %}'
+        '{% include "auctions/listing_card.html" %}{% if listing.winner_id %}{{ listing.winner.username }}{% endif %}'
+        '{% endfor %}{% endblock %}'
+    ),
+    'auctions/my_bids.html': (
+        '{% extends "base.html" %}{% block content %}{% for bid in bids %}{{ bid.amount }} '
+        '{% include "auctions/listing_card.html" with listing=bid.listing %}{% endfor %}{% endblock %}'
+    ),
+    'auctions/profile.html': (
+        '{% extends "base.html" %}{% block content %}{{ profile_user.username }} {{ profile.bio }}'
+        '{% for listing in user_listings %}{% include "auctions/listing_card.html" %}{% endfor %}'
+        '{% for bid in user_bids %}{{ bid.amount }} '
+        '{% include "auctions/listing_card.html" with listing=bid.listing %}{% endfor %}'
+        '{% for listing in won_auctions %}{% include "auctions/listing_card.html" %}{% endfor %}{% endblock %}'
+    ),
+    'auctions/edit_profile.html': (
+        '{% extends "base.html" %}{% block content %}{{ user_form.as_p }}{{ profile_form.as_p }}{% endblock %}'
+    ),
+    'auctions/won_auctions.html': (
+        '{% extends "base.html" %}{% block content %}{% for listing in won_auctions %}'
+        '{% include "auctions/listing_card.html" %}{% endfor %}{% endblock %}'
+    ),
+    'registration/signup.html': '{% extends "base.html" %}{% block content %}{{ form.as_p }}{% endblock %}',
+    'admin/dashboard.html': (
+        '{% extends "base.html" %}{% block content %}{{ total_users }} {{ total_listings }} {{ total_bids }}'
+        '{% for category in category_stats %}{{ category.name }} {{ category.listing_count }}{% endfor %}'
+        '{% for listing in recent_listings %}{% include "auctions/listing_card.html" %}{% endfor %}'
+        '{% for bid in recent_bids %}{{ bid.bidder.username }} {{ bid.listing.title }} {{ bid.amount }}{% endfor %}'
+        '{% for user in top_bidders %}{{ user.username }} {{ user.bid_count }}{% endfor %}'
+        '{% for user in top_sellers %}{{ user.username }} {{ user.listing_count }}{% endfor %}'
+        '{{ throttled_requests }}{% endblock %}'
+    ),
+}
+
+
+@override_settings(TEMPLATES=[{
+    'BACKEND': 'django.template.backends.django.DjangoTemplates',
+    'OPTIONS': {
+        'context_processors': [
+            'django.template.context_processors.request',
+            'django.contrib.auth.context_processors.auth',
+            'django.contrib.messages.context_processors.messages',
+        ],
+        'loaders': [('django.template.loaders.locmem.Loader', PAGE_TEMPLATES)],
+    },
+}])
+class ViewQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Every page, with a handful of related rows so an N+1 shows up as a repeated query."""
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.seller = User.objects.create_user('seller', 'seller@example.com', 'pw')
+        cls.bidder = User.objects.create_user('bidder', 'bidder@example.com', 'pw')
+        cls.staff = User.objects.create_user('staff', 'staff@example.com', 'pw', is_staff=True)
+        for user in (cls.seller, cls.bidder, cls.staff):
+            UserProfile.objects.create(user=user)
+        categories = [
+            Category.objects.create(name='Cameras', slug='cameras'),
+            Category.objects.create(name='Books', slug='books'),
+        ]
+        cls.listings = [
+            Listing.objects.create(
+                title=f'Listing {i}',
+                description='Description',
+                starting_bid=Decimal('10.00'),
+                end_date=now + timedelta(days=1 + i),
+                seller=cls.seller,
+                category=categories[i % 2],
+            )
+            for i in range(6)
+        ]
+        cls.listing = cls.listings[0]
+        for rank, similar in enumerate(cls.listings[1:3]):
+            SimilarListing.objects.create(listing=cls.listing, similar=similar, score=1.0 - rank / 10, rank=rank)
+        for i, listing in enumerate(cls.listings):
+            Bid.objects.create(listing=listing, bidder=cls.bidder, amount=Decimal('11.00') + i)
+            Watchlist.objects.create(user=cls.bidder, listing=listing)
+            Comment.objects.create(listing=cls.listing, author=cls.bidder, content=f'Comment {i}')
+        for listing in cls.listings[3:]:
+            listing.is_active = False
+            listing.winner = cls.bidder
+            listing.save()
+        # Normally stamped when the first change commits, which never happens inside a TestCase
+        JobCheckpoint.objects.update_or_create(name=CATALOG_CHECKPOINT, defaults={'timestamp': timezone.now()})
+
+    def budget_requests(self):
+        listing = [self.listing.pk]
+        return {
+            'home': (5, {}),
+            'listing_detail': (10, {'args': listing, 'user': self.bidder}),
+            'create_listing': (4, {'user': self.seller}),
+            'add_to_watchlist': (7, {'args': listing, 'user': self.seller}),
+            'remove_from_watchlist': (4, {'args': listing, 'user': self.bidder}),
+            'my_watchlist': (3, {'user': self.bidder}),
+            'my_listings': (4, {'user': self.seller}),
+            'my_bids': (3, {'user': self.bidder}),
+            'signup': (0, {}),
+            'profile': (6, {'user': self.bidder}),
+            'user_profile': (7, {'args': ['seller'], 'user': self.bidder}),
+            'edit_profile': (3, {'user': self.bidder}),
+            'toggle_watchlist': (5, {'args': listing, 'user': self.seller}),
+            'won_auctions': (3, {'user': self.bidder}),
+            'autocomplete': (4, {'data': {'q': 'list'}}),
+            'admin_dashboard': (14, {'user': self.staff}),
+        }
+
+    def test_home_counts_the_listings_it_pages(self):
+        # The cached facet cube's total lags behind the listings
+        real_facet_counts = views.facet_counts
+
+        def stale_facet_counts(filters, categories):
+            return 99, real_facet_counts(filters, categories)[1]
+
+        self.client.force_login(self.bidder)
+        with mock.patch.object(views, 'facet_counts', stale_facet_counts):
+            response = self.client.get(reverse('home'))
+        self.assertEqual(response.context['result_count'], 3)
+        self.assertFalse(response.context['is_paginated'])
+
+        contexts = []
+
+        async def capture(request, template_name, context):
+            contexts.append(context)
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        request.user = self.bidder
+        with mock.patch.object(async_views, 'facet_counts', stale_facet_counts), \
+                mock.patch.object(async_views, '_render', capture):
+            async_to_sync(async_views.home)(request)
+        self.assertEqual(contexts[0]['result_count'], 3)
+        self.assertFalse(contexts[0]['is_paginated'])
+
+
+class CatalogClockTests(TransactionTestCase):
+    def stamped(self, clock):
+        return JobCheckpoint.objects.filter(name=clock.name).values_list('timestamp', flat=True).first()
+
+    @override_settings(CATALOG_VERSION_TTL=0.2)
+    def test_stamps_within_the_ttl_are_written_once_when_it_is_up(self):
+        clock = CatalogClock('test:modified')
+        clock.stamp()
+        first = self.stamped(clock)
+        clock.stamp()
+        clock.stamp()
+        self.assertEqual(self.stamped(clock), first)
+        deferred = clock._deferred
+        self.assertIsNotNone(deferred)
+        deferred.join(5)
+        self.assertGreater(self.stamped(clock), first)
+        self.assertIsNone(clock._deferred)
+
+    def test_counted_views_change_the_trending_etag(self):
+        seller = User.objects.create_user('seller', 'seller@example.com', 'pw')
+        listing = Listing.objects.create(
+            title='Listing',
+            description='Description',
+            starting_bid=Decimal('10.00'),
+            end_date=timezone.now() + timedelta(days=1),
+            seller=seller,
+        )
+        request = RequestFactory().get('/', {'status': 'trending'})
+        request.user = AnonymousUser()
+        before = caching.catalog_etag(request)
+        view_counts.write_views({listing.pk: 3}, time.time())
+        self.assertNotEqual(caching.catalog_etag(request), before)
+
+    def test_rebuilds_revalidate_the_pages_that_show_them(self):
+        seller = User.objects.create_user('seller', 'seller@example.com', 'pw')
+        for title in ['Red vintage camera'] * 3 + ['Blue garden chair'] * 3:
+            Listing.objects.create(
+                title=title,
+                description='Description',
+                starting_bid=Decimal('10.00'),
+                end_date=timezone.now() + timedelta(days=1),
+                seller=seller,
+            )
+        before = timezone.now()
+        with mock.patch('auctions.caching.catalog_clock.stamp') as stamp:
+            recommendations.rebuild_similar_listings(weights={'watch': 0, 'bid': 0, 'category': 0}, max_term_listings=3)
+            self.assertEqual(stamp.call_count, 1)
+            analytics.rebuild_category_price_stats()
+            self.assertEqual(stamp.call_count, 2)
+        self.assertTrue(SimilarListing.objects.exists())
+        self.assertFalse(Listing.objects.filter(updated_at__lt=before).exists())
+
+
+class CloseEndedAuctionsTests(TestCase):
+    """Leased closing: every ended auction is closed, and notified, by exactly one worker."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', 'seller@example.com', 'pw')
+        cls.bidder = User.objects.create_user('bidder', 'bidder@example.com', 'pw')
+        cls.listings = [
+            Listing.objects.create(
+                title=f'Listing {i}',
+                description='Description',
+                starting_bid=Decimal('10.00'),
+                end_date=timezone.now() + timedelta(days=1),
+                seller=cls.seller,
+            )
+            for i in range(6)
+        ]
+        for listing in cls.listings[::2]:
+            Bid.objects.create(listing=listing, bidder=cls.bidder, amount=Decimal('12.00'))
+        Listing.objects.update(end_date=timezone.now() - timedelta(minutes=1))
+
+    def test_workers_claim_disjoint_batches(self):
+        first = closing.claim('first', batch_size=4)
+        second = closing.claim('second', batch_size=4)
+        self.assertEqual(len(first), 4)
+        self.assertEqual(len(second), 2)
+        self.assertFalse(set(first) & set(second))
+        self.assertEqual(closing.claim('third'), [])
+
+    def test_expired_lease_is_claimed_again(self):
+        ids = closing.claim('crashed')
+        later = timezone.now() + closing.lease_duration() + timedelta(seconds=1)
+        self.assertEqual(sorted(closing.claim('rescuer', now=later)), sorted(ids))
+        # The first owner lost its lease and closes nothing
+        self.assertEqual(closing.close_batch(ids, 'crashed'), [])
+        self.assertEqual(sorted(closing.close_batch(ids, 'rescuer')), sorted(ids))
+
+    def test_each_auction_closed_and_notified_once(self):
+        self.assertEqual(closing.run(batch_size=4), 6)
+        self.assertEqual(closing.run(), 0)
+        self.assertFalse(Listing.objects.filter(is_active=True).exists())
+        sold = self.listings[::2]
+        for listing in Listing.objects.filter(pk__in=[l.pk for l in sold]):
+            self.assertEqual(listing.winner, self.bidder)
+            self.assertEqual(listing.current_bid, Decimal('12.00'))
+            self.assertEqual(listing.close_lease_owner, '')
+        self.assertFalse(Listing.objects.filter(winner__isnull=False, pk__in=[l.pk for l in self.listings[1::2]]))
+        self.assertEqual(NotificationEvent.objects.filter(kind='ended', user=self.seller).count(), 6)
+        self.assertEqual(NotificationEvent.objects.filter(kind='won', user=self.bidder).count(), 3)
+
+    def test_close_auction_skips_leased_listing(self):
+        listing = Listing.objects.get(pk=self.listings[0].pk)
+        closing.claim('worker')
+        listing.close_auction()
+        self.assertTrue(listing.is_active)
+        Listing.objects.update(close_lease_owner='', close_lease_expires=None)
+        listing.close_auction()
+        self.assertFalse(listing.is_active)
+        self.assertEqual(listing.winner, self.bidder)
+
+    def test_extended_auction_is_not_closed_under_its_lease(self):
+        ids = closing.claim('worker')
+        moderation.extend(Listing.objects.filter(pk=self.listings[0].pk), timedelta(days=1))
+        closed = closing.close_batch(ids, 'worker')
+        self.assertNotIn(self.listings[0].pk, closed)
+        self.assertEqual(len(closed), 5)
+        self.assertTrue(Listing.objects.get(pk=self.listings[0].pk).is_active)
+
+
+@override_settings(BID_LOG_FSYNC_BATCH=10 ** 6, BID_LOG_FSYNC_INTERVAL=3600)
+class CloseWorkersBidLogTests(TransactionTestCase):
+    """Closes logged by worker processes reach the log before the workers exit."""
+
+    def test_workers_flush_logged_closes(self):
+        seller = User.objects.create_user('seller', 'seller@example.com', 'pw')
+        bidder = User.objects.create_user('bidder', 'bidder@example.com', 'pw')
+        listings = [
+            Listing.objects.create(
+                title=f'Listing {i}',
+                description='Description',
+                starting_bid=Decimal('10.00'),
+                end_date=timezone.now() + timedelta(days=1),
+                seller=seller,
+            )
+            for i in range(4)
+        ]
+        Bid.objects.create(listing=listings[0], bidder=bidder, amount=Decimal('12.00'))
+        Listing.objects.update(end_date=timezone.now() - timedelta(minutes=1))
+        with tempfile.TemporaryDirectory() as directory, override_settings(BID_LOG_DIR=directory):
+            self.addCleanup(bid_log.bid_log.close)
+            # A worker thread stands in for each forked process: like a process
+            # ending in os._exit, it never closes the log
+            with mock.patch.object(closing, 'ProcessPoolExecutor', lambda workers, mp_context: ThreadPoolExecutor(1)):
+                call_command('close_ended_auctions', workers=2, stdout=io.StringIO())
+            state = bid_log.replay(directory=directory)
+            bid_log.bid_log.close()
+        self.assertEqual(set(state), {listing.pk for listing in listings})
+        self.assertTrue(all(closed for _, _, closed in state.values()))
+        self.assertEqual(state[listings[0].pk][1], bidder.pk)
+
+
+class BidLogReplayTests(TestCase):
+    def replay(self, *events):
+        with tempfile.TemporaryDirectory() as directory, override_settings(BID_LOG_DIR=directory):
+            log = bid_log.BidLog()
+            for event in events:
+                log.append(*event)
+            log.close()
+            return bid_log.replay(directory=directory)
+
+    def test_close_without_winner_has_no_winner(self):
+        # As logged before closes without a winner stopped recording a price
+        state = self.replay((bid_log.CLOSED, 1, None, Decimal('15.00')))
+        self.assertEqual(state, {1: (None, None, True)})
+
+    def test_winner_comes_from_accepted_bids(self):
+        state = self.replay(
+            (bid_log.ACCEPTED, 1, 7, Decimal('12.00')),
+            (bid_log.ACCEPTED, 1, 8, Decimal('14.00')),
+            (bid_log.CLOSED, 1, 8, Decimal('14.00')),
+        )
+        self.assertEqual(state, {1: (Decimal('14.00'), 8, True)})
+
+    def test_rejected_bids_alone_replay_nothing(self):
+        self.assertEqual(self.replay((bid_log.REJECTED, 1, 7, Decimal('5.00'))), {})
+
+    def test_apply_rewrites_drifted_listings_and_their_validators(self):
+        seller = User.objects.create_user('seller', 'seller@example.com', 'pw')
+        bidder = User.objects.create_user('bidder', 'bidder@example.com', 'pw')
+        listing = Listing.objects.create(
+            title='Listing',
+            description='Description',
+            starting_bid=Decimal('10.00'),
+            end_date=timezone.now() + timedelta(days=1),
+            seller=seller,
+        )
+        before = listing.updated_at
+        with tempfile.TemporaryDirectory() as directory, override_settings(BID_LOG_DIR=directory):
+            log = bid_log.BidLog()
+            log.append(bid_log.ACCEPTED, listing.pk, bidder.pk, Decimal('12.00'))
+            log.close()
+            call_command('replay_bid_log', apply=True, stdout=io.StringIO())
+        listing.refresh_from_db()
+        self.assertEqual(listing.current_bid, Decimal('12.00'))
+        self.assertGreater(listing.updated_at, before)
+
+
+class ConsistencyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', 'seller@example.com', 'pw')
+        cls.bidder = User.objects.create_user('bidder', 'bidder@example.com', 'pw')
+        cls.listings = [
+            Listing.objects.create(
+                title=f'Listing {i}',
+                description='Description',
+                starting_bid=Decimal('10.00'),
+                end_date=timezone.now() + timedelta(days=1),
+                seller=cls.seller,
+            )
+            for i in range(4)
+        ]
+        for listing in cls.listings:
+            Bid.objects.create(listing=listing, bidder=cls.bidder, amount=Decimal('12.00'))
+        Listing.objects.update(current_bid=Decimal('12.00'))
+
+    def check(self, listing, repair=False):
+        now = timezone.now()
+        _, violations = consistency.check_range(listing.pk - 1, listing.pk, now)
+        if repair:
+            consistency.repair(violations, now)
+        return violations[0]['invariants'] if violations else []
+
+    def test_consistent_listing(self):
+        self.assertEqual(self.check(self.listings[0]), [])
+
+    def test_current_bid_is_repaired_and_revalidated(self):
+        listing = self.listings[0]
+        Listing.objects.filter(pk=listing.pk).update(current_bid=Decimal('11.00'))
+        before = Listing.objects.get(pk=listing.pk).updated_at
+        self.assertEqual(self.check(listing, repair=True), ['current_bid'])
+        repaired = Listing.objects.get(pk=listing.pk)
+        self.assertEqual(repaired.current_bid, Decimal('12.00'))
+        self.assertGreater(repaired.updated_at, before)
+        self.assertEqual(self.check(listing), [])
+
+    def test_preset_bid(self):
+        listing = self.listings[1]
+        Bid.objects.filter(listing=listing).delete()
+        Listing.objects.filter(pk=listing.pk).update(current_bid=listing.starting_bid)
+        self.assertEqual(self.check(listing, repair=True), ['preset_bid'])
+        self.assertIsNone(Listing.objects.get(pk=listing.pk).current_bid)
+
+    def test_winner(self):
+        listing = self.listings[2]
+        Listing.objects.filter(pk=listing.pk).update(is_active=False, end_date=timezone.now() - timedelta(hours=1))
+        self.assertEqual(self.check(listing, repair=True), ['winner'])
+        self.assertEqual(Listing.objects.get(pk=listing.pk).winner, self.bidder)
+        Listing.objects.filter(pk=listing.pk).update(is_active=True, end_date=timezone.now() + timedelta(hours=1))
+        self.assertEqual(self.check(listing, repair=True), ['winner'])
+        self.assertIsNone(Listing.objects.get(pk=listing.pk).winner)
+
+    def test_active_past_end_is_reported_not_repaired(self):
+        listing = self.listings[3]
+        Listing.objects.filter(pk=listing.pk).update(end_date=timezone.now() - timedelta(hours=1))
+        self.assertEqual(self.check(listing, repair=True), ['active_past_end'])
+        self.assertTrue(Listing.objects.get(pk=listing.pk).is_active)
+
+    def test_resume_continues_from_the_checkpoint(self):
+        for listing in self.listings:
+            Listing.objects.filter(pk=listing.pk).update(current_bid=Decimal('11.00'))
+        JobCheckpoint.objects.create(
+            name=consistency.CHECKPOINT, position=self.listings[1].pk, timestamp=timezone.now()
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'report.jsonl')
+            with open(path, 'w') as f:
+                f.write('{"listing": 0}\n')
+            call_command(
+                'check_consistency', workers=1, chunk_size=1, resume=True, report=path, stdout=io.StringIO()
+            )
+            with open(path) as f:
+                reported = [json.loads(line)['listing'] for line in f]
+        self.assertEqual(reported, [0] + [listing.pk for listing in self.listings[2:]])
+        self.assertIsNone(JobCheckpoint.objects.get(name=consistency.CHECKPOINT).timestamp)
+
+
+class WithdrawnListingTests(TestCase):
+    def test_withdrawn_auction_is_not_given_to_its_top_bidder(self):
+        seller = User.objects.create_user('seller', 'seller@example.com', 'pw')
+        bidder = User.objects.create_user('bidder', 'bidder@example.com', 'pw')
+        listing = Listing.objects.create(
+            title='Listing',
+            description='Description',
+            starting_bid=Decimal('10.00'),
+            end_date=timezone.now() + timedelta(days=1),
+            seller=seller,
+        )
+        Bid.objects.create(listing=listing, bidder=bidder, amount=Decimal('12.00'))
+        Listing.objects.filter(pk=listing.pk).update(current_bid=Decimal('12.00'))
+        moderation.deactivate(Listing.objects.filter(pk=listing.pk))
+        # Long after the withdrawal, the auction's end_date has passed
+        later = timezone.now() + timedelta(days=2)
+        self.assertEqual(consistency.check_range(0, listing.pk, later)[1], [])
+        Listing.objects.filter(pk=listing.pk).update(winner=bidder)
+        _, violations = consistency.check_range(0, listing.pk, later)
+        self.assertEqual(violations[0]['invariants'], ['winner'])
+        consistency.repair(violations, later)
+        self.assertIsNone(Listing.objects.get(pk=listing.pk).winner)
+
+
+class ModerationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', 'seller@example.com', 'pw')
+        cls.bidder = User.objects.create_user('bidder', 'bidder@example.com', 'pw')
+        cls.old = Category.objects.create(name='Old', slug='old')
+        cls.new = Category.objects.create(name='New', slug='new')
+        cls.end_date = timezone.now() + timedelta(days=1)
+        cls.listings = [
+            Listing.objects.create(
+                title=f'Listing {i}',
+                description='Description',
+                starting_bid=Decimal('10.00'),
+                end_date=cls.end_date,
+                seller=cls.seller,
+                category=cls.old,
+            )
+            for i in range(3)
+        ]
+        cls.closed = Listing.objects.create(
+            title='Closed',
+            description='Description',
+            starting_bid=Decimal('10.00'),
+            end_date=timezone.now() - timedelta(days=1),
+            seller=cls.seller,
+            category=cls.old,
+            is_active=False,
+            winner=cls.bidder,
+        )
+
+    def selection(self, *listings):
+        return Listing.objects.filter(pk__in=[listing.pk for listing in listings])
+
+    def test_deactivate_withdraws_active_listings_only(self):
+        NotificationEvent.objects.create(user=self.bidder, listing=self.listings[0], kind='outbid')
+        NotificationEvent.objects.create(user=self.bidder, listing=self.closed, kind='won')
+        NotificationEvent.objects.create(user=self.seller, listing=self.closed, kind='ended')
+        result = moderation.deactivate(self.selection(self.listings[0], self.closed), chunk_size=1)
+        self.assertEqual(result.rows, 1)
+        withdrawn = Listing.objects.get(pk=self.listings[0].pk)
+        self.assertFalse(withdrawn.is_active)
+        self.assertIsNotNone(withdrawn.withdrawn_at)
+        self.assertIsNone(Listing.objects.get(pk=self.closed.pk).withdrawn_at)
+        self.assertEqual(
+            sorted(NotificationEvent.objects.values_list('listing_id', 'kind')),
+            [(self.closed.pk, 'ended'), (self.closed.pk, 'won')],
+        )
+
+    def test_extend_pushes_back_active_listings(self):
+        NotificationEvent.objects.create(user=self.bidder, listing=self.listings[0], kind='ending_soon')
+        result = moderation.extend(self.selection(self.listings[0], self.closed), timedelta(hours=2))
+        self.assertEqual(result.rows, 1)
+        self.assertEqual(Listing.objects.get(pk=self.listings[0].pk).end_date, self.end_date + timedelta(hours=2))
+        self.assertEqual(Listing.objects.get(pk=self.closed.pk).end_date, self.closed.end_date)
+        self.assertFalse(NotificationEvent.objects.exists())
+
+    def test_recategorize_counts_moved_listings(self):
+        Listing.objects.filter(pk=self.listings[1].pk).update(category=self.new)
+        self.assertEqual(moderation.recategorize(self.selection(*self.listings), self.new, chunk_size=2).rows, 2)
+        self.assertEqual(set(self.selection(*self.listings).values_list('category', flat=True)), {self.new.pk})
+        self.assertEqual(moderation.recategorize(self.selection(*self.listings), None).rows, 3)
+        self.assertFalse(self.selection(*self.listings).filter(category__isnull=False).exists())
+
+
+class ShillDetectionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', 'seller@example.com', 'pw')
+        cls.shill = User.objects.create_user('shill', 'shill@example.com', 'pw')
+        cls.buyer = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        cls.listings = [
+            Listing.objects.create(
+                title=f'Listing {i}',
+                description='Description',
+                starting_bid=Decimal('10.00'),
+                end_date=timezone.now() + timedelta(days=1),
+                seller=cls.seller,
+            )
+            for i in range(3)
+        ]
+
+    def later(self):
+        return timezone.now() + timedelta(seconds=shill_detection.COMMIT_LAG_SECONDS + 1)
+
+    def stats(self, bidder):
+        return BidderSellerStats.objects.filter(bidder=bidder, seller=self.seller).values_list(
+            *shill_detection.STAT_FIELDS
+        ).first()
+
+    def bid(self, listing, bidder, amount):
+        return Bid.objects.create(listing=listing, bidder=bidder, amount=Decimal(amount))
+
+    def test_bids_are_counted_once(self):
+        self.bid(self.listings[0], self.shill, '11.00')
+        self.bid(self.listings[1], self.shill, '11.00')
+        self.assertEqual(len(shill_detection.scan_new_bids(chunk_size=1, now=self.later())), 2)
+        self.bid(self.listings[2], self.shill, '11.00')
+        shill_detection.scan_new_bids(now=self.later())
+        self.assertEqual(shill_detection.scan_new_bids(now=self.later()), [])
+        self.assertEqual(self.stats(self.shill), (3, 0, 0, 0))
+
+    def test_recent_bids_hold_back_the_watermark(self):
+        older = self.bid(self.listings[0], self.shill, '11.00')
+        recent = self.bid(self.listings[1], self.shill, '11.00')
+        # A bid with a higher pk whose transaction committed first
+        Bid.objects.filter(pk=recent.pk).update(created_at=timezone.now() - timedelta(hours=1))
+        shill_detection.scan_new_bids()
+        self.assertIsNone(self.stats(self.shill))
+        Bid.objects.filter(pk=older.pk).update(created_at=timezone.now() - timedelta(hours=1))
+        shill_detection.scan_new_bids()
+        self.assertEqual(self.stats(self.shill), (2, 0, 0, 0))
+
+    def test_closed_auctions_are_counted_once_with_their_winner(self):
+        for listing in self.listings:
+            self.bid(listing, self.shill, '11.00')
+            self.bid(listing, self.buyer, '12.00')
+        Listing.objects.update(end_date=timezone.now() - timedelta(minutes=1))
+        closing.close_batch([listing.pk for listing in self.listings[:2]])
+        # Moderation set the winner by hand
+        Listing.objects.filter(pk=self.listings[1].pk).update(winner=self.shill)
+        moderation.extend(Listing.objects.filter(pk=self.listings[2].pk), timedelta(days=1))
+        shill_detection.scan_closed_listings(now=self.later())
+        self.assertEqual(shill_detection.scan_closed_listings(now=self.later()), [])
+        self.assertEqual(self.stats(self.shill), (0, 0, 2, 1))
+        self.assertEqual(self.stats(self.buyer), (0, 0, 2, 1))
+
+    def test_seller_focused_loser_is_flagged(self):
+        for listing in self.listings:
+            for amount in ('11.00', '13.00'):
+                self.bid(listing, self.shill, amount)
+            self.bid(listing, self.buyer, '15.00')
+        # Days before the end, so none of them is a late bid
+        Bid.objects.update(created_at=timezone.now() - timedelta(days=3))
+        Listing.objects.update(end_date=timezone.now() - timedelta(days=1))
+        closing.close_batch([listing.pk for listing in self.listings])
+        scored, flagged = shill_detection.run(now=self.later())
+        self.assertEqual((scored, flagged), (2, 1))
+        suspect = ShillSuspect.objects.get()
+        self.assertEqual(suspect.bidder, self.shill)
+        self.assertEqual(suspect.features['loss_rate'], 1.0)
+        pairs, scores, _ = shill_detection.score_pairs(np.array([[self.buyer.pk, self.seller.pk]]), min_bids=1)
+        self.assertEqual(scores.tolist(), [0.0])
+
+
+class ClientIPTests(SimpleTestCase):
+    def client_ip(self, remote, forwarded=None):
+        extra = {'REMOTE_ADDR': remote}
+        if forwarded is not None:
+            extra['HTTP_X_FORWARDED_FOR'] = forwarded
+        return throttling.client_ip(RequestFactory().get('/', **extra))
+
+    def test_forwarded_for_ignored_without_trusted_proxies(self):
+        self.assertEqual(self.client_ip('203.0.113.5', '198.51.100.1'), '203.0.113.5')
+
+    @override_settings(TRUSTED_PROXIES=['127.0.0.1', '10.0.0.0/8'])
+    def test_nearest_untrusted_hop_behind_trusted_proxies(self):
+        # The client can prepend anything; the hop our proxies added is used
+        self.assertEqual(self.client_ip('127.0.0.1', '1.2.3.4, 198.51.100.7, 10.1.2.3'), '198.51.100.7')
+        self.assertEqual(self.client_ip('127.0.0.1'), '127.0.0.1')
+        self.assertEqual(self.client_ip('203.0.113.5', '198.51.100.7'), '203.0.113.5')
+
+
+class FileServingTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for name, content in (('app.css', b'body {}'), ('app.css.br', b'br'), ('app.css.gz', b'gzip')):
+            with open(os.path.join(directory.name, name), 'wb') as f:
+                f.write(content)
+        with override_settings(STATIC_URL='/static/', STATIC_ROOT=directory.name, MEDIA_URL='', MEDIA_ROOT=''):
+            self.middleware = FileServingMiddleware(lambda request: HttpResponse(status=404))
+
+    def get(self, accept_encoding, **headers):
+        request = RequestFactory().get('/static/app.css', HTTP_ACCEPT_ENCODING=accept_encoding, **headers)
+        return self.middleware(request)
+
+    def test_refused_encodings_are_not_served(self):
+        self.assertEqual(self.get('gzip, br').headers['Content-Encoding'], 'br')
+        self.assertEqual(self.get('br;q=0, gzip').headers['Content-Encoding'], 'gzip')
+        self.assertEqual(self.get('br;q=0.5, gzip;q=0.8').headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Encoding', self.get('br;q=0, gzip;q=0').headers)
+        self.assertNotIn('Content-Encoding', self.get('*;q=0').headers)
+        self.assertNotIn('Content-Encoding', self.get('').headers)
+
+    def test_each_encoding_has_its_own_etag(self):
+        etags = {self.get(accept).headers['ETag'] for accept in ('br', 'gzip', 'identity')}
+        self.assertEqual(len(etags), 3)
+        br_etag = self.get('br').headers['ETag']
+        self.assertEqual(self.get('br', HTTP_IF_NONE_MATCH=br_etag).status_code, 304)
+        response = self.get('gzip', HTTP_IF_NONE_MATCH=br_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'gzip')
+
+
+class ThrottleTests(SimpleTestCase):
+    limits = [('ip', 2, 1 / 60), ('user', 1, 1 / 60)]
+
+    def setUp(self):
+        self.cache = LocMemCache('throttle-tests', {})
+
+    def check(self, user_pk, ip='203.0.113.5'):
+        request = RequestFactory().post('/', REMOTE_ADDR=ip)
+        request.user = SimpleNamespace(is_authenticated=True, pk=user_pk)
+        return throttling.check(request, 'bid', self.limits, self.cache)
+
+    def test_refused_request_spends_no_token(self):
+        self.assertEqual(self.check(1), 0)
+        self.assertEqual(self.check(1)[1], 'user')
+        # The refusal left the IP its second token
+        self.assertEqual(self.check(2), 0)
+        self.assertEqual(self.check(3)[1], 'ip')
+        self.assertIsNone(self.cache.get(throttling.BUCKET_KEY % ('bid', 'user', 3)))
+        self.assertEqual(self.check(3, ip='198.51.100.7'), 0)
+
+    async def test_async_check_runs_off_the_event_loop(self):
+        threads = []
+
+        def check(request, name, limits):
+            threads.append(threading.current_thread())
+            return 0
+
+        async def get_response(request):
+            return HttpResponse()
+
+        request = RequestFactory().post('/')
+        request.resolver_match = SimpleNamespace(view_name='toggle_watchlist')
+        with mock.patch.object(throttling, 'check', check):
+            self.assertIsNone(await ThrottleMiddleware(get_response).process_view(request, None, (), {}))
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+
+class ExportTests(TestCase):
+    def export(self, fmt):
+        rows = exports.export_rows('listings', Listing.objects.all())
+        streamer, _ = exports.STREAMERS[fmt]
+        return ''.join(streamer('listings', rows))
+
+    def test_formulas_are_quoted_and_unsold_listings_have_no_price(self):
+        seller = User.objects.create_user('@seller', 'seller@example.com', 'pw')
+        bidder = User.objects.create_user('bidder', 'bidder@example.com', 'pw')
+        listing = dict(description='=1', starting_bid=Decimal('10.00'), current_bid=Decimal('12.00'), seller=seller)
+        Listing.objects.create(title='=HYPERLINK("http://example.com")', end_date=timezone.now(), **listing)
+        Listing.objects.create(title='-5 lens', end_date=timezone.now(), winner=bidder, is_active=False, **listing)
+        rows = {row['title']: row for row in csv.DictReader(io.StringIO(self.export('csv')))}
+        self.assertEqual(set(rows), {'\'=HYPERLINK("http://example.com")', "'-5 lens"})
+        self.assertEqual(rows["'-5 lens"]['seller'], "'@seller")
+        self.assertEqual(rows["'-5 lens"]['final_price'], '12.00')
+        self.assertEqual(rows['\'=HYPERLINK("http://example.com")']['final_price'], '')
+        # JSON isn't opened as a spreadsheet and keeps the values as they are
+        records = [json.loads(line) for line in self.export('jsonl').splitlines()]
+        self.assertEqual(sorted(record['title'] for record in records), ['-5 lens', '=HYPERLINK("http://example.com")'])
+
+
+class EndingSoonIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', 'seller@example.com', 'pw')
+        cls.category = Category.objects.create(name='Cameras', slug='cameras')
+        cls.now = timezone.now()
+        cls.listings = [
+            Listing.objects.create(
+                title=f'Listing {hours}',
+                description='Description',
+                starting_bid=Decimal('10.00'),
+                end_date=cls.now + timedelta(hours=hours),
+                seller=cls.seller,
+                category=cls.category if hours % 2 else None,
+            )
+            for hours in (3, 1, 2, 4)
+        ]
+        cls.by_hours = {listing.end_date - cls.now: listing.pk for listing in cls.listings}
+
+    def ending_in(self, *hours):
+        return [self.by_hours[timedelta(hours=h)] for h in hours]
+
+    def test_ids_window_and_category(self):
+        index = ending_soon.EndingSoonIndex()
+        self.assertEqual(index.ids(self.now), self.ending_in(1, 2, 3, 4))
+        self.assertEqual(index.ids(self.now + timedelta(hours=1)), self.ending_in(2, 3, 4))
+        self.assertEqual(index.ids(self.now, before=self.now + timedelta(hours=3)), self.ending_in(1, 2))
+        self.assertEqual(index.ids(self.now, category_id=self.category.pk), self.ending_in(1, 3))
+
+    def test_updates_move_and_drop_listings(self):
+        index = ending_soon.EndingSoonIndex()
+        index.load()
+        listing = Listing.objects.get(pk=self.by_hours[timedelta(hours=4)])
+        listing.end_date = self.now + timedelta(minutes=30)
+        index.update(listing)
+        index.remove(self.by_hours[timedelta(hours=2)])
+        self.assertEqual(index.ids(self.now), [listing.pk] + self.ending_in(1, 3))
+
+    def test_changes_during_a_load_survive_the_swap(self):
+        index = ending_soon.EndingSoonIndex()
+        index.load()
+        removed = self.by_hours[timedelta(hours=1)]
+        read = index._read
+
+        def read_then_remove():
+            rows = read()
+            # Closed after the load's query ran
+            index.remove(removed)
+            return rows
+
+        with mock.patch.object(index, '_read', read_then_remove):
+            index.load()
+        self.assertEqual(index.ids(self.now), self.ending_in(2, 3, 4))
+
+
+class FlakyEmailBackend(EmailBackend):
+    """Refuses mail to fail@example.com; counts the connections opened."""
+
+    opened = 0
+
+    def open(self):
+        if not getattr(self, 'is_open', False):
+            FlakyEmailBackend.opened += 1
+            self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def send_messages(self, messages):
+        if any('fail@example.com' in message.to for message in messages):
+            raise ConnectionError('refused')
+        return super().send_messages(messages)
+
+
+class NotificationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seller = User.objects.create_user('seller', 'seller@example.com', 'pw')
+        cls.listing = Listing.objects.create(
+            title='Listing',
+            description='Description',
+            starting_bid=Decimal('10.00'),
+            end_date=timezone.now() + timedelta(minutes=30),
+            seller=seller,
+        )
+        cls.users = [
+            User.objects.create_user(name, f'{name}@example.com', 'pw') for name in ('ann', 'fail', 'bob', 'cy')
+        ]
+        for user in cls.users:
+            Watchlist.objects.create(user=user, listing=cls.listing)
+
+    def test_ending_soon_is_queued_once_per_watcher(self):
+        now = timezone.now()
+        self.assertEqual(notifications.collect_ending_soon(now, timedelta(hours=1)), 4)
+        self.assertEqual(notifications.collect_ending_soon(now, timedelta(hours=1)), 0)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            NotificationEvent.objects.create(user=self.users[0], listing=self.listing, kind='ending_soon')
+        # Other kinds repeat
+        for amount in ('11.00', '12.00'):
+            NotificationEvent.objects.create(user=self.users[0], listing=self.listing, kind='outbid', amount=amount)
+
+    @override_settings(EMAIL_BACKEND='auctions.tests.FlakyEmailBackend')
+    def test_failed_digest_leaves_only_its_events_pending(self):
+        FlakyEmailBackend.opened = 0
+        with self.assertLogs('auctions.notifications', 'ERROR'):
+            stats = notifications.run_cycle(sender=notifications.PooledMailSender(pool_size=1, batch_size=2))
+        self.assertEqual((stats['digests'], stats['events_delivered']), (3, 3))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [
+            'ann@example.com', 'bob@example.com', 'cy@example.com',
+        ])
+        pending = NotificationEvent.objects.filter(sent_at__isnull=True).values_list('user__username', flat=True)
+        self.assertEqual(list(pending), ['fail'])
+        # One connection for both batches, opened again after the failure
+        self.assertEqual(FlakyEmailBackend.opened, 2)
+
+
+class MediaBlobTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', 'seller@example.com', 'pw')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.directory = directory.name
+
+    def listing(self, content=None):
+        listing = Listing.objects.create(
+            title='Listing',
+            description='Description',
+            starting_bid=Decimal('10.00'),
+            end_date=timezone.now() + timedelta(days=1),
+            seller=self.seller,
+        )
+        if content is not None:
+            listing.image.save('Photo.JPG', ContentFile(content))
+        return listing
+
+    def references(self):
+        return dict(MediaBlob.objects.values_list('name', 'references'))
+
+    def test_identical_uploads_are_stored_once(self):
+        first, second = self.listing(b'photo'), self.listing(b'photo')
+        other = self.listing(b'other photo')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(storage.is_blob(first.image.name))
+        self.assertTrue(first.image.name.endswith('.jpg'))
+        self.assertEqual(self.references(), {first.image.name: 2, other.image.name: 1})
+        self.assertEqual(len(list(storage._blob_files(default_storage))), 2)
+
+    @override_settings(MEDIA_MAX_UPLOAD_SIZE=8)
+    def test_uploads_over_the_limit_are_refused(self):
+        with self.assertRaises(storage.FileTooLarge):
+            default_storage.save('big.jpg', ContentFile(b'x' * 9))
+        # A stream without a size is cut off once it has sent too much
+        stream = SimpleNamespace(chunks=lambda chunk_size: iter([b'x' * 5, b'x' * 5]))
+        with self.assertRaises(storage.FileTooLarge):
+            default_storage.save('big.jpg', stream)
+        self.assertFalse(MediaBlob.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.directory, storage.BLOB_DIR, 'tmp')), [])
+        self.assertTrue(storage.is_blob(default_storage.save('small.jpg', ContentFile(b'x' * 8))))
+
+    def test_references_follow_the_rows(self):
+        first, second = self.listing(b'photo'), self.listing(b'photo')
+        name = first.image.name
+        second.image.save('new.jpg', ContentFile(b'new photo'))
+        self.assertEqual(self.references(), {name: 1, second.image.name: 1})
+        # A loaded row knows its file; saving it neither reads the row again nor changes the counts
+        listing = Listing.objects.get(pk=first.pk)
+        with CaptureQueriesContext(connection) as queries:
+            listing.current_bid = Decimal('11.00')
+            listing.save()
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT')])
+        listing.save()
+        self.assertEqual(self.references()[name], 1)
+        listing.image = None
+        listing.save()
+        self.assertEqual(self.references()[name], 0)
+        # Not loaded with the row, so what it held is read when it is saved
+        deferred = Listing.objects.defer('image').get(pk=first.pk)
+        deferred.image = name
+        deferred.save()
+        self.assertEqual(self.references()[name], 1)
+        second.delete()
+        self.assertEqual(self.references(), {name: 1, second.image.name: 0})
+
+    def test_collect_garbage_removes_unreferenced_blobs_after_the_grace_period(self):
+        kept, released = self.listing(b'photo'), self.listing(b'released photo')
+        name = released.image.name
+        released.delete()
+        self.assertEqual(storage.collect_garbage(grace_period=60), (0, 0))
+        MediaBlob.objects.update(last_used=timezone.now() - timedelta(minutes=2))
+        self.assertEqual(storage.collect_garbage(grace_period=60, dry_run=True), (1, len(b'released photo')))
+        self.assertTrue(default_storage.exists(name))
+        out = io.StringIO()
+        call_command('collect_media_blobs', grace_period=60, stdout=out)
+        self.assertIn('Removed 1 files', out.getvalue())
+        self.assertFalse(default_storage.exists(name))
+        self.assertEqual(list(self.references()), [kept.image.name])
+        self.assertTrue(default_storage.exists(kept.image.name))
+
+
+class ViewCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seller = User.objects.create_user('seller', 'seller@example.com', 'pw')
+        cls.listings = [
+            Listing.objects.create(
+                title=f'Listing {i}',
+                description='Description',
+                starting_bid=Decimal('10.00'),
+                end_date=timezone.now() + timedelta(days=1),
+                seller=seller,
+            )
+            for i in range(3)
+        ]
+
+    def views(self, listing):
+        return ListingViews.objects.get(pk=listing.pk).views
+
+    def test_flush_adds_to_the_stored_counts(self):
+        counter = view_counts.ViewCounter()
+        first, second, _ = self.listings
+        for listing in (first, first, second):
+            counter.record(listing.pk)
+        self.assertEqual(counter.flush(), 2)
+        counter.record(first.pk)
+        counter.record(10 ** 9)  # deleted since it was viewed
+        self.assertEqual(counter.flush(), 2)
+        self.assertEqual(counter.flush(), 0)
+        self.assertEqual((self.views(first), self.views(second)), (3, 1))
+
+    def test_row_created_by_another_process_keeps_both_counts(self):
+        listing = self.listings[0]
+        # Created between this flush reading the existing rows and inserting its own
+        with mock.patch.object(view_counts, '_existing', side_effect=[set(), {listing.pk}]):
+            ListingViews.objects.create(listing=listing, views=4, trending=view_counts.trending_score(4, 0))
+            view_counts.write_views({listing.pk: 2}, 0)
+        self.assertEqual(self.views(listing), 6)
+
+    @override_settings(TRENDING_HALF_LIFE=3600)
+    def test_trending_favours_recent_views(self):
+        old, recent, unseen = self.listings
+        now = time.time()
+        view_counts.write_views({old.pk: 10}, now - 4 * 3600)
+        view_counts.write_views({recent.pk: 1}, now)
+        view_counts.write_views({recent.pk: 1}, now)
+        trending = view_counts.order_by_trending(Listing.objects.all())
+        # 10 views four half-lives ago weigh 0.625 now
+        self.assertEqual(list(trending), [recent, old])
+        self.assertAlmostEqual(ListingViews.objects.get(pk=recent.pk).trending, view_counts.trending_score(2, now))
+
+
+class PrefixIndexTests(SimpleTestCase):
+    def setUp(self):
+        # Small enough that "c" and "ca" keep top lists
+        self.index = autocomplete.PrefixIndex(scan_limit=2)
+        self.index.build({
+            'camera': ('Red camera', 5),
+            'canvas': ('Canvas bag', 3),
+            'cable': ('Cable', 1),
+            'lamp': ('Desk lamp', 4),
+        })
+
+    def test_search_ranks_matches_on_any_word(self):
+        self.assertEqual(self.index.search('ca', 10), ['camera', 'canvas', 'cable'])
+        self.assertEqual(self.index.search('red c', 10), ['camera'])
+        self.assertEqual(self.index.search('lamp', 10), ['lamp'])
+        self.assertEqual(self.index.search('x', 10), [])
+        self.assertIn('ca', self.index._top)
+
+    def test_set_and_discard_maintain_top_lists(self):
+        self.index.set('cap', 'Cap', 9)
+        self.index.set('cable', 'Cable', 6)
+        self.assertEqual(self.index.search('ca', 3), ['cap', 'cable', 'camera'])
+        self.index.discard('cap')
+        self.index.discard('camera')
+        self.assertEqual(self.index.search('ca', 10), ['cable', 'canvas'])
+        self.assertEqual(self.index.search('c', 10), ['cable', 'canvas'])
+        self.assertEqual(len(self.index), 3)
+        # Scanning the slice agrees with the maintained lists
+        self.assertEqual(self.index._top['ca'], self.index._scan('ca'))
+
+
+class AutocompleteIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', 'seller@example.com', 'pw')
+        cls.listing = Listing.objects.create(
+            title='Red camera',
+            description='Description',
+            starting_bid=Decimal('10.00'),
+            end_date=timezone.now() + timedelta(days=1),
+            seller=cls.seller,
+        )
+
+    def titles(self, index, query):
+        return [suggestion['title'] for suggestion in index.suggest(query)['listings']]
+
+    def test_changes_during_a_load_survive_the_swap(self):
+        index = autocomplete.AutocompleteIndex()
+        index.load()
+        read = index._read
+
+        def read_then_rename():
+            fresh = read()
+            # Saved after the load's query ran
+            self.listing.title = 'Blue camera'
+            index.update(self.listing)
+            return fresh
+
+        with mock.patch.object(index, '_read', read_then_rename):
+            index.load()
+        self.assertEqual(self.titles(index, 'camera'), ['Blue camera'])
+
+    @override_settings(AUTOCOMPLETE_INDEX_TTL=1)
+    def test_one_request_reloads_an_expired_index(self):
+        index = autocomplete.AutocompleteIndex()
+        index.load()
+        index._loaded_at -= 2
+        with index._load_lock, mock.patch.object(index, '_read') as read:
+            # Another request is reloading: the index as it is answers at once
+            self.assertEqual(self.titles(index, 'red'), ['Red camera'])
+        read.assert_not_called()
+        Listing.objects.filter(pk=self.listing.pk).update(title='Red lamp')
+        self.assertEqual(self.titles(index, 'red'), ['Red lamp'])
+
+    def test_clear_voids_a_load_running(self):
+        index = autocomplete.AutocompleteIndex()
+        read = index._read
+
+        def read_then_clear():
+            fresh = read()
+            index.clear()
+            return fresh
+
+        with mock.patch.object(index, '_read', read_then_clear):
+            index.load()
+        self.assertIsNone(index._loaded_at)
+        self.assertEqual(len(index), 0)
+
+
+class ImportListingsTests(TestCase):
+    def test_non_string_values_reject_only_their_row(self):
+        User.objects.create_user('seller', 'seller@example.com', 'pw')
+        end_date = (timezone.now() + timedelta(days=3)).isoformat()
+        rows = [
+            {'title': 12345, 'starting_bid': 10, 'end_date': end_date, 'description': 7},
+            {'title': ['not', 'text'], 'starting_bid': '10.00', 'end_date': end_date},
+            {'title': 'Camera', 'starting_bid': '10.00', 'end_date': end_date, 'seller': {'name': 'seller'}},
+            {'title': 'Lens', 'starting_bid': 12.5, 'end_date': end_date},
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'listings.jsonl')
+            with open(path, 'w') as f:
+                f.writelines(json.dumps(row) + '\n' for row in rows)
+            out = io.StringIO()
+            call_command('import_listings', path, seller='seller', stdout=out)
+        self.assertIn('Imported 2 listings, rejected 2 rows', out.getvalue())
+        self.assertEqual(
+            sorted(Listing.objects.values_list('title', 'description', 'starting_bid')),
+            [('12345', '7', Decimal('10.00')), ('Lens', '', Decimal('12.50'))],
+        )
+
+    def test_resumed_import_keeps_the_rows_rejected_before(self):
+        User.objects.create_user('seller', 'seller@example.com', 'pw')
+        end_date = (timezone.now() + timedelta(days=3)).isoformat()
+        rows = [
+            ['title', 'starting_bid', 'end_date'],
+            ['', '10.00', end_date],
+            ['Camera', '10.00', end_date],
+            ['Lens', 'cheap', end_date],
+            ['Tripod', '10.00', end_date],
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            errors = os.path.join(directory, 'errors.csv')
+            # The first run got as far as the second row, the second resumes after it
+            for name, count, offset in (('first.csv', 3, 0), ('all.csv', 5, 2)):
+                path = os.path.join(directory, name)
+                with open(path, 'w', newline='') as f:
+                    csv.writer(f).writerows(rows[:count])
+                call_command(
+                    'import_listings', path, seller='seller', errors=errors, offset=offset, stdout=io.StringIO()
+                )
+            with open(errors, newline='') as f:
+                rejected = [row[0] for row in csv.reader(f)]
+        self.assertEqual(rejected, ['row', '1', '3'])
+        self.assertEqual(sorted(Listing.objects.values_list('title', flat=True)), ['Camera', 'Tripod'])
+
+
+class SimilarListingsTests(TestCase):
+    def test_titles_stay_matched_when_listings_change_between_reads(self):
+        seller = User.objects.create_user('seller', 'seller@example.com', 'pw')
+        titles = ['Red vintage camera'] * 3 + ['Blue garden chair'] * 3
+        listings = [
+            Listing.objects.create(
+                title=title,
+                description='Description',
+                starting_bid=Decimal('10.00'),
+                end_date=timezone.now() + timedelta(days=1),
+                seller=seller,
+            )
+            for title in titles
+        ]
+        fetch_columns = recommendations.fetch_columns
+
+        def fetch_then_close_first(*args, **kwargs):
+            columns = fetch_columns(*args, **kwargs)
+            Listing.objects.filter(pk=listings[0].pk).update(is_active=False)
+            return columns
+
+        with mock.patch.object(recommendations, 'fetch_columns', fetch_then_close_first):
+            listing_ids, similar_ids, _, _ = recommendations.compute_similar_listings(
+                weights={'watch': 0, 'bid': 0, 'category': 0}, max_term_listings=3
+            )
+        title_of = {listing.pk: listing.title for listing in listings}
+        self.assertTrue(len(listing_ids))
+        for listing_id, similar_id in zip(listing_ids.tolist(), similar_ids.tolist()):
+            self.assertEqual(title_of[listing_id], title_of[similar_id])
@@ -0,0 +1,144 @@
+"""
+Token-bucket rate limiting for write endpoints.
+
+THROTTLE_RATES maps URL names to limits, e.g.
+
+    'toggle_watchlist': {'user': '30/m', 'ip': '60/m'},
+    'listing_detail': {'methods': ['POST'], 'user': '20/m', 'ip': '60/m'},
+
+A rate of N/period allows bursts of N requests and refills at N per period.
+Buckets live in the THROTTLE_CACHE_ALIAS cache, which must be shared by
+every worker (see auctions/checks.py); the read-modify-write is not atomic,
+so concurrent requests from one client can occasionally slip an extra
+request through.
+
+Behind a reverse proxy every request arrives from the proxy's address.
+When REMOTE_ADDR is one of TRUSTED_PROXIES (addresses or networks), the
+client is the nearest X-Forwarded-For hop that isn't a trusted proxy;
+earlier hops are whatever the client chose to send.
+"""
+import ipaddress
+import math
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+BUCKET_KEY = 'auctions:throttle:%s:%s:%s'
+REJECTED_KEY = 'auctions:throttle:rejected:%s:%s'
+
+# Checked in this order; the first empty bucket refuses the request
+SCOPES = ('ip', 'user')
+
+
+def parse_rate(rate):
+    """'30/m' -> (capacity 30, 0.5 tokens per second)."""
+    count, period = rate.split('/')
+    count = int(count)
+    return count, count / PERIODS[period.strip()[0]]
+
+
+def load_rules():
+    """Compile THROTTLE_RATES into {url name: (methods or None, [(scope, capacity, refill)])}."""
+    rules = {}
+    for name, config in getattr(settings, 'THROTTLE_RATES', {}).items():
+        methods = config.get('methods')
+        limits = [(scope, *parse_rate(config[scope])) for scope in SCOPES if config.get(scope)]
+        if limits:
+            rules[name] = (frozenset(m.upper() for m in methods) if methods else None, limits)
+    return rules
+
+
+def get_cache():
+    return caches[getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default')]
+
+
+def available(state, capacity, refill, now):
+    """Tokens in a bucket whose cached state is `state` (None for an untouched, full bucket)."""
+    if state is None:
+        return capacity
+    tokens, updated = state
+    return min(capacity, tokens + (now - updated) * refill)
+
+
+@lru_cache(maxsize=None)
+def _networks(proxies):
+    return tuple(ipaddress.ip_network(proxy, strict=False) for proxy in proxies)
+
+
+def _is_trusted(address, networks):
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(address in network for network in networks)
+
+
+def client_ip(request):
+    remote = request.META.get('REMOTE_ADDR', '')
+    networks = _networks(tuple(getattr(settings, 'TRUSTED_PROXIES', ())))
+    if not networks or not _is_trusted(remote, networks):
+        return remote
+    hops = [hop.strip() for hop in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if hop.strip()]
+    for hop in reversed(hops):
+        if not _is_trusted(hop, networks):
+            return hop
+    # Only proxies: the request started at the first of them
+    return hops[0] if hops else remote
+
+
+def check(request, name, limits, cache=None):
+    """
+    Take a token from each of the named URL's buckets, or from none of them
+    if any is empty, so a refused request costs the client nothing. Returns
+    0 or (seconds to wait, scope that refused).
+    """
+    cache = cache or get_cache()
+    # time.monotonic() is per host; buckets shared across hosts need wall-clock time
+    now = time.time()
+    buckets = {}
+    for scope, capacity, refill in limits:
+        if scope == 'user':
+            if not request.user.is_authenticated:
+                continue
+            ident = request.user.pk
+        else:
+            ident = client_ip(request)
+        buckets[BUCKET_KEY % (name, scope, ident)] = (scope, capacity, refill)
+    if not buckets:
+        return 0
+    states = cache.get_many(list(buckets))
+    taken = {}
+    for key, (scope, capacity, refill) in buckets.items():
+        tokens = available(states.get(key), capacity, refill, now)
+        if tokens < 1:
+            return (1 - tokens) / refill, scope
+        taken[key] = (tokens - 1, now)
+    # An untouched bucket is full again after capacity / refill seconds
+    cache.set_many(taken, max(math.ceil(capacity / refill) for _, capacity, refill in buckets.values()))
+    return 0
+
+
+def record_rejection(name, scope, cache=None):
+    cache = cache or get_cache()
+    key = REJECTED_KEY % (name, scope)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def rejection_counts(cache=None):
+    """Throttled request totals as {(url name, scope): count} for every configured limit."""
+    cache = cache or get_cache()
+    keys = {
+        REJECTED_KEY % (name, scope): (name, scope)
+        for name, (_, limits) in load_rules().items()
+        for scope, _, _ in limits
+    }
+    counts = cache.get_many(list(keys))
+    return {keys[key]: counts.get(key, 0) for key in keys}
@@ -1,9 +1,13 @@
+from django.conf import settings
 from django.urls import path
-from . import views, admin_views
+from . import views, admin_views, async_views
+
+# Served by asgi.py, the browse pages use the async views
+browse_views = async_views if getattr(settings, 'ASYNC_BROWSE_VIEWS', False) else views
 
 urlpatterns = [
-    path('', views.home, name='home'),
-    path('listing/<int:pk>/', views.listing_detail, name='listing_detail'),
+    path('', browse_views.home, name='home'),
+    path('listing/<int:pk>/', browse_views.listing_detail, name='listing_detail'),
     path('create-listing/', views.create_listing, name='create_listing'),
     path('add-to-watchlist/<int:pk>/', views.add_to_watchlist, name='add_to_watchlist'),
     path('remove-from-watchlist/<int:pk>/', views.remove_from_watchlist, name='remove_from_watchlist'),
@@ -16,5 +20,6 @@ urlpatterns = [
     path('edit-profile/', views.edit_profile, name='edit_profile'),
     path('toggle-watchlist/<int:pk>/', views.toggle_watchlist, name='toggle_watchlist'),
     path('won-auctions/', views.won_auctions, name='won_auctions'),
+    path('autocomplete/', views.autocomplete, name='autocomplete'),
     path('admin/dashboard/', admin_views.admin_dashboard, name='admin_dashboard'),
 ]
\ No newline at end of file
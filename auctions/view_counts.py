@@ -0,0 +1,166 @@
+"""
+Listing page views, counted in memory and written in batches.
+
+Each process adds up views per listing in a Counter and flushes the totals
+to ListingViews every VIEW_COUNT_FLUSH_INTERVAL seconds, or sooner once
+VIEW_COUNT_FLUSH_BATCH listings are waiting. The flush is done by the
+request that finds it due, with one UPDATE per distinct view count, so
+the database sees a handful of statements per interval however busy the
+pages are. Servers flush what is left when a worker stops (gunicorn's
+worker_exit hook, see gunicorn.conf.py); other processes, such as
+management commands, never count views and have nothing to write.
+
+Alongside the total, ListingViews.trending holds a time-decayed score
+where a view counts half as much every TRENDING_HALF_LIFE seconds. It is
+stored as
+
+    log(sum of exp(rate * (t - EPOCH)) over the views at times t)
+
+which differs from the decayed count at any moment only by a term shared
+by every listing. So listings are ranked by the stored column, through its
+index, and a listing nobody views sinks without ever being rewritten.
+Changing the half-life leaves existing scores on the old scale.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Abs, Exp, Greatest, Ln
+
+from .caching import trending_clock
+from .models import Listing, ListingViews
+
+logger = logging.getLogger(__name__)
+
+# 2024-01-01T00:00:00Z; scores are relative to it
+EPOCH = 1704067200
+
+
+def decay_rate():
+    return math.log(2) / getattr(settings, 'TRENDING_HALF_LIFE', 6 * 60 * 60)
+
+
+def trending_score(views, at):
+    """The trending score of `views` views at time `at` (a Unix timestamp)."""
+    return math.log(views) + decay_rate() * (at - EPOCH)
+
+
+def _existing(listing_ids):
+    return set(ListingViews.objects.filter(pk__in=list(listing_ids)).values_list('pk', flat=True))
+
+
+def write_views(counts, at):
+    """Add {listing id: views} seen at time `at` to ListingViews."""
+    existing = _existing(counts)
+    # Listings deleted since they were viewed are skipped
+    new = list(Listing.objects.filter(pk__in=[pk for pk in counts if pk not in existing]).values_list('pk', flat=True))
+    with transaction.atomic():
+        while new:
+            try:
+                with transaction.atomic():
+                    ListingViews.objects.bulk_create([
+                        ListingViews(listing_id=listing_id, views=counts[listing_id],
+                                     trending=trending_score(counts[listing_id], at))
+                        for listing_id in new
+                    ])
+                break
+            except IntegrityError:
+                # Another process created some of these rows since they were read; add to those instead
+                created = _existing(new)
+                if not created:
+                    raise
+                existing |= created
+                new = [listing_id for listing_id in new if listing_id not in created]
+        by_count = defaultdict(list)
+        for listing_id in existing:
+            by_count[counts[listing_id]].append(listing_id)
+        for views, listing_ids in by_count.items():
+            score = Value(trending_score(views, at))
+            # log(exp(a) + exp(b)) without overflowing exp()
+            ListingViews.objects.filter(pk__in=listing_ids).update(
+                views=F('views') + views,
+                trending=Greatest(F('trending'), score) + Ln(Value(1.0) + Exp(-Abs(F('trending') - score))),
+            )
+        # The trending pages are reordered
+        transaction.on_commit(trending_clock.stamp)
+
+
+class ViewCounter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._pending_since = None
+
+    def record(self, listing_id):
+        """Count a view. Returns True when the counts are due to be flushed."""
+        with self._lock:
+            self._counts[listing_id] += 1
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            return (
+                len(self._counts) >= getattr(settings, 'VIEW_COUNT_FLUSH_BATCH', 1000)
+                or time.monotonic() - self._pending_since >= getattr(settings, 'VIEW_COUNT_FLUSH_INTERVAL', 30)
+            )
+
+    def flush(self):
+        """Write the buffered counts; returns the number of listings written."""
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            self._pending_since = None
+        if not counts:
+            return 0
+        try:
+            write_views(counts, time.time())
+        except DatabaseError:
+            logger.exception('Could not write %d listing view counts', len(counts))
+            # Kept for the next flush
+            with self._lock:
+                self._counts.update(counts)
+                if self._pending_since is None:
+                    self._pending_since = time.monotonic()
+            return 0
+        return len(counts)
+
+
+view_counter = ViewCounter()
+# A forked child starts empty; the views counted so far are the parent's to write
+os.register_at_fork(after_in_child=view_counter.__init__)
+
+
+def _is_view(request, response):
+    return request.method == 'GET' and response.status_code in (200, 304)
+
+
+def count_views(view):
+    """
+    Count successful GETs of a listing page. Applied outside the caching
+    decorators, so cached pages and 304 responses count too.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, pk, *args, **kwargs):
+            response = await view(request, pk, *args, **kwargs)
+            if _is_view(request, response) and view_counter.record(pk):
+                await sync_to_async(view_counter.flush)()
+            return response
+    else:
+        @wraps(view)
+        def wrapper(request, pk, *args, **kwargs):
+            response = view(request, pk, *args, **kwargs)
+            if _is_view(request, response) and view_counter.record(pk):
+                view_counter.flush()
+            return response
+    return wrapper
+
+
+def order_by_trending(listings):
+    """Viewed listings only, most trending first."""
+    return listings.filter(view_stats__isnull=False).order_by('-view_stats__trending', '-pk')
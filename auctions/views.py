@@ -6,53 +6,96 @@ from django.contrib import messages
 from django.db.models import Q
 from django.utils import timezone
 from django.core.paginator import Paginator
-from .models import Listing, Bid, Comment, Watchlist, Category, UserProfile
+from django.http import JsonResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_GET
+from datetime import timedelta
+from .autocomplete import MAX_SUGGESTIONS, autocomplete_index
+from .bid_log import record_rejected
+from .caching import (
+    cache_anonymous_page, catalog_etag, catalog_last_modified, listing_etag, listing_last_modified,
+)
+from .ending_soon import ending_soon_index, listings_for_ids
+from .facets import facet_counts, filter_listings, parse_filters
+from .view_counts import count_views, order_by_trending
+from .models import Listing, Bid, Comment, Watchlist, Category, UserProfile, SimilarListing, CategoryPriceStats
 from .forms import SignUpForm, ListingForm, BidForm, CommentForm, UserProfileForm, UserUpdateForm
 
 
+@condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)
+@cache_anonymous_page(catalog_etag)
 def home(request):
-    listings = Listing.objects.filter(is_active=True).select_related('seller', 'category')
-    
-    # Filter by category
-    category_slug = request.GET.get('category')
-    if category_slug:
-        listings = listings.filter(category__slug=category_slug)
-    
-    # Filter by search query
-    search_query = request.GET.get('search')
-    if search_query:
-        listings = listings.filter(
-            Q(title__icontains=search_query) | Q(description__icontains=search_query)
-        )
+    filters = parse_filters(request.GET)
+    categories = list(Category.objects.all())
+    category_ids = {category.slug: category.pk for category in categories}
+
+    # Filter by category, price range and search query
+    listings = filter_listings(
+        Listing.objects.filter(is_active=True).select_related('seller', 'category'), filters, category_ids
+    )
+    # Counts for every filter option; the cube is cached, so the results are counted live below
+    _, facets = facet_counts(filters, categories)
     
     # Filter by status
-    status = request.GET.get('status')
-    if status == 'ending_soon':
-        listings = listings.filter(end_date__gt=timezone.now()).order_by('end_date')
+    now = timezone.now()
+    status = filters.status
+    use_index = (
+        status == 'ending_soon' and not filters.search and not filters.prices and len(filters.categories) <= 1
+    )
+    if use_index:
+        # Ordered ids come from the in-memory index instead of sorting in the database
+        category_id = None
+        if filters.categories:
+            category_id = category_ids.get(filters.categories[0])
+        if filters.categories and category_id is None:
+            listings = []
+        else:
+            listings = ending_soon_index.ids(now, category_id=category_id)
+    elif status == 'ending_soon':
+        listings = listings.filter(end_date__gt=now).order_by('end_date')
     elif status == 'new':
         listings = listings.order_by('-created_at')
     elif status == 'no_bids':
         listings = listings.filter(current_bid__isnull=True)
+    elif status == 'trending':
+        listings = order_by_trending(listings)
     
     # Pagination
     paginator = Paginator(listings, 12)  # Show 12 listings per page
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
+    if use_index:
+        page_obj.object_list = listings_for_ids(list(page_obj.object_list))
     
-    categories = Category.objects.all()
+    category_slug = filters.categories[0] if len(filters.categories) == 1 else None
+    category_stats = None
+    if category_slug:
+        category_stats = CategoryPriceStats.objects.filter(category__slug=category_slug).first()
+    ending_within_hour = listings_for_ids(
+        ending_soon_index.ids(now, before=now + timedelta(hours=1))[:5]
+    )
     
     context = {
         'listings': page_obj,
         'categories': categories,
-        'search_query': search_query,
+        'search_query': filters.search,
         'selected_category': category_slug,
+        'selected_categories': filters.categories,
+        'selected_prices': filters.prices,
         'selected_status': status,
+        'facets': facets,
+        'result_count': paginator.count,
         'page_obj': page_obj,
         'is_paginated': paginator.num_pages > 1,
+        'ending_within_hour': ending_within_hour,
+        'category_stats': category_stats,
     }
     return render(request, 'auctions/home.html', context)
 
 
+@count_views
+@condition(etag_func=listing_etag, last_modified_func=listing_last_modified)
+@cache_anonymous_page(listing_etag)
 def listing_detail(request, pk):
     listing = get_object_or_404(Listing, pk=pk)
     bids = listing.bids.select_related('bidder')
@@ -80,8 +123,12 @@ def listing_detail(request, pk):
                 
                 messages.success(request, 'Your bid has been placed successfully!')
                 return redirect('listing_detail', pk=listing.pk)
+            record_rejected(listing.pk, request.user.pk, request.POST.get('amount'))
         else:
             bid_form = BidForm(listing=listing, user=request.user)
+    elif request.user.is_authenticated and request.method == 'POST' and 'bid_submit' in request.POST:
+        # The auction closed before the bid arrived
+        record_rejected(listing.pk, request.user.pk, request.POST.get('amount'))
     
     # Handle commenting
     comment_form = None
@@ -98,6 +145,13 @@ def listing_detail(request, pk):
         else:
             comment_form = CommentForm()
     
+    # Precomputed by the build_recommendations command
+    similar_listings = [
+        similar.similar for similar in
+        SimilarListing.objects.filter(listing=listing, similar__is_active=True)
+        .select_related('similar__seller', 'similar__category')
+    ]
+    
     context = {
         'listing': listing,
         'bids': bids,
@@ -106,6 +160,7 @@ def listing_detail(request, pk):
         'comment_form': comment_form,
         'is_watched': is_watched,
         'total_bids': bids.count(),
+        'similar_listings': similar_listings,
     }
     return render(request, 'auctions/listing_detail.html', context)
 
@@ -123,7 +178,9 @@ def create_listing(request):
     else:
         form = ListingForm()
     
-    return render(request, 'auctions/create_listing.html', {'form': form})
+    # What comparable items sold for, per category
+    price_stats = CategoryPriceStats.objects.select_related('category')
+    return render(request, 'auctions/create_listing.html', {'form': form, 'price_stats': price_stats})
 
 
 @login_required
@@ -157,13 +214,17 @@ def remove_from_watchlist(request, pk):
 
 @login_required
 def my_watchlist(request):
-    watchlist_items = Watchlist.objects.filter(user=request.user).select_related('listing', 'listing__seller')
+    watchlist_items = Watchlist.objects.filter(user=request.user).select_related('listing__seller', 'listing__category')
     return render(request, 'auctions/watchlist.html', {'watchlist_items': watchlist_items})
 
 
 @login_required
 def my_listings(request):
-    listings = Listing.objects.filter(seller=request.user).order_by('-created_at')
+    listings = (
+        Listing.objects.filter(seller=request.user)
+        .select_related('seller', 'category', 'winner')
+        .order_by('-created_at')
+    )
     
     # Pagination
     paginator = Paginator(listings, 10)  # Show 10 listings per page
@@ -181,7 +242,11 @@ def my_listings(request):
 
 @login_required
 def my_bids(request):
-    bids = Bid.objects.filter(bidder=request.user).select_related('listing').order_by('-created_at')
+    bids = (
+        Bid.objects.filter(bidder=request.user)
+        .select_related('listing__seller', 'listing__category')
+        .order_by('-created_at')
+    )
     return render(request, 'auctions/my_bids.html', {'bids': bids})
 
 
@@ -208,9 +273,11 @@ def profile(request, username=None):
         user = request.user
     
     profile = get_object_or_404(UserProfile, user=user)
-    user_listings = Listing.objects.filter(seller=user).order_by('-created_at')
-    user_bids = Bid.objects.filter(bidder=user).order_by('-created_at')
-    won_auctions = Listing.objects.filter(winner=user).order_by('-end_date')
+    user_listings = Listing.objects.filter(seller=user).select_related('seller', 'category').order_by('-created_at')
+    user_bids = (
+        Bid.objects.filter(bidder=user).select_related('listing__seller', 'listing__category').order_by('-created_at')
+    )
+    won_auctions = Listing.objects.filter(winner=user).select_related('seller', 'category').order_by('-end_date')
     
     context = {
         'profile_user': user,
@@ -248,7 +315,7 @@ def edit_profile(request):
 
 @login_required
 def won_auctions(request):
-    won_listings = Listing.objects.filter(winner=request.user).order_by('-end_date')
+    won_listings = Listing.objects.filter(winner=request.user).select_related('seller', 'category').order_by('-end_date')
     return render(request, 'auctions/won_auctions.html', {'won_auctions': won_listings})
 
 
@@ -267,3 +334,14 @@ def toggle_watchlist(request, pk):
         messages.success(request, 'Removed from your watchlist.')
     
     return redirect('listing_detail', pk=listing.pk)
+
+
+@require_GET
+@cache_control(public=True, max_age=30)
+def autocomplete(request):
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(int(request.GET.get('limit', 10)), MAX_SUGGESTIONS)
+    except ValueError:
+        limit = 10
+    return JsonResponse({'query': query, **autocomplete_index.suggest(query, limit)})
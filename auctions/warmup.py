@@ -0,0 +1,146 @@
+"""
+Pay the one-off costs of a fresh process up front: template compilation,
+URL resolver population, crispy form rendering, ORM query compilation and
+the in-memory listing indexes.
+Run in the server's parent process before forking so every worker starts
+warm (see gunicorn.conf.py), or via `manage.py warmup` to time it.
+"""
+import os
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.db import connections
+from django.forms.renderers import get_default_renderer
+from django.template import Context, Template, TemplateDoesNotExist, TemplateSyntaxError, engines
+from django.template.backends.django import DjangoTemplates
+from django.urls import NoReverseMatch, URLResolver, get_resolver, reverse
+from django.utils import translation
+
+from .autocomplete import autocomplete_index
+from .ending_soon import ending_soon_index
+from .form_cache import render_form
+from .forms import BidForm, CommentForm, ListingForm
+
+CRISPY_FORMS = [BidForm, CommentForm, ListingForm]
+
+
+def _template_names(engine):
+    """Every template the engine's loaders can find, relative to their directories."""
+    names = set()
+    for loader in engine.template_loaders:
+        for inner in getattr(loader, 'loaders', [loader]):
+            # Only filesystem-style loaders can be enumerated
+            for directory in getattr(inner, 'get_dirs', list)():
+                for root, _, files in os.walk(directory):
+                    for filename in files:
+                        if not filename.startswith('.'):
+                            names.add(os.path.relpath(os.path.join(root, filename), directory).replace(os.sep, '/'))
+    return sorted(names)
+
+
+def warm_templates():
+    compiled = 0
+    # Widgets render through the form renderer's own engine
+    renderer = get_default_renderer()
+    for backend in engines.all() + [getattr(renderer, 'engine', None)]:
+        if not isinstance(backend, DjangoTemplates):
+            continue
+        for name in _template_names(backend.engine):
+            try:
+                backend.engine.get_template(name)
+            except (TemplateDoesNotExist, TemplateSyntaxError, UnicodeDecodeError):
+                # Not a template (or one for an app that isn't installed)
+                continue
+            compiled += 1
+    return compiled
+
+
+def _reverse_all(resolver, prefix=''):
+    """Reverse every named pattern, namespaces included, so each namespace's resolver is built."""
+    count = 0
+    for name in list(resolver.reverse_dict):
+        if isinstance(name, str):
+            try:
+                reverse(prefix + name)
+            except NoReverseMatch:
+                # Needs arguments; the lookup tables are built either way
+                pass
+            count += 1
+    for namespace, (_, sub_resolver) in resolver.namespace_dict.items():
+        count += _reverse_all(sub_resolver, prefix + namespace + ':')
+    return count
+
+
+def _compile_patterns(resolver):
+    for pattern in resolver.url_patterns:
+        pattern.pattern.regex
+        if isinstance(pattern, URLResolver):
+            _compile_patterns(pattern)
+
+
+def warm_urls():
+    resolver = get_resolver()
+    _compile_patterns(resolver)
+    with translation.override(settings.LANGUAGE_CODE):
+        return _reverse_all(resolver)
+
+
+def warm_forms():
+    template = Template('{% load crispy_forms_tags %}{% crispy form %}{{ form|crispy }}')
+    for form_class in CRISPY_FORMS:
+        template.render(Context({'form': form_class(), 'csrf_token': 'warmup'}))
+        # Seed the pre-rendered layouts used by the cached_crispy tag and filter
+        render_form(form_class())
+        render_form(form_class(), use_filter=True)
+    return len(CRISPY_FORMS)
+
+
+def warm_orm():
+    """Compile (without running) a query per model, filling the ORM's lazy metadata caches."""
+    models = apps.get_models()
+    for model in models:
+        manager = model._default_manager
+        manager.select_related().query.sql_with_params()
+        manager.filter(pk=0).query.sql_with_params()
+    return len(models)
+
+
+def warm_indexes():
+    ending_soon_index.load()
+    return len(ending_soon_index)
+
+
+def warm_autocomplete():
+    autocomplete_index.load()
+    return len(autocomplete_index)
+
+
+def warm_static():
+    return len(getattr(staticfiles_storage, 'hashed_files', {}))
+
+
+STEPS = [
+    ('templates', warm_templates),
+    ('url patterns', warm_urls),
+    ('crispy forms', warm_forms),
+    ('model queries', warm_orm),
+    ('ending-soon index', warm_indexes),
+    ('autocomplete index', warm_autocomplete),
+    ('static manifest', warm_static),
+]
+
+
+def warm_up():
+    """Run every warmup step; returns [(step, items warmed, seconds)]."""
+    timings = []
+    try:
+        for name, step in STEPS:
+            started = time.monotonic()
+            count = step()
+            timings.append((name, count, time.monotonic() - started))
+    finally:
+        # Forked workers must not share the parent's database connections
+        connections.close_all()
+    return timings
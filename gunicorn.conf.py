@@ -0,0 +1,50 @@
+"""
+Production server profile, picked up automatically by
+`gunicorn online_auction.wsgi` when run from the project root.
+
+The application is imported and warmed once in the arbiter (see
+auctions/warmup.py) and workers are forked from it, so a new worker's
+first request costs the same as any other. Several workers need a cache
+they all share (set REDIS_URL); the server refuses to start without one.
+"""
+import multiprocessing
+import os
+import time
+
+_started = time.monotonic()
+
+wsgi_app = 'online_auction.wsgi'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+preload_app = True
+
+
+def on_starting(server):
+    from auctions.checks import process_local_caches
+
+    local = process_local_caches()
+    if server.num_workers > 1 and local:
+        uses = '; '.join(f'{", ".join(what)} in {alias!r}' for alias, what in local.items())
+        raise SystemExit(
+            f'{server.num_workers} workers would each keep their own copy of {uses}. '
+            'Set REDIS_URL to share the cache, or GUNICORN_WORKERS=1.'
+        )
+
+
+def when_ready(server):
+    from auctions.warmup import warm_up
+
+    for name, count, seconds in warm_up():
+        server.log.info('Warmed %s: %d in %.0fms', name, count, seconds * 1000)
+    server.log.info('Ready to fork workers %.2fs after startup', time.monotonic() - _started)
+
+
+def worker_exit(server, worker):
+    from auctions.view_counts import view_counter
+
+    # Views counted since the last flush would otherwise be lost
+    written = view_counter.flush()
+    if written:
+        server.log.info('Wrote view counts for %d listings on exit', written)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,12 +45,15 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'auctions.middleware.RepeatedQueryMiddleware',
+    'auctions.middleware.FileServingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'auctions.middleware.ThrottleMiddleware',
 ]
 
 ROOT_URLCONF = 'online_auction.urls'
@@ -58,13 +62,20 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Compiled templates are kept for the life of the process (and
+            # reset by the autoreloader when a template changes under DEBUG)
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
@@ -83,6 +94,36 @@ DATABASES = {
 }
 
 
+# Cache
+# Use a shared backend (Redis, Memcached) in production so invalidation
+# reaches every worker process.
+
+# Sessions, cached users and throttle buckets are invalidated across worker
+# processes through this cache, so with several workers it must be shared:
+# set REDIS_URL. LocMemCache is private to each process (see auctions/checks.py).
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Seconds a rendered browse page is cached for anonymous users
+ANONYMOUS_PAGE_CACHE_TIMEOUT = 30
+
+# Seconds each process reuses its read of the catalog's last-modified time
+# (kept in the database so every worker agrees on it; see auctions/caching.py)
+# and the least time between its writes of it
+CATALOG_VERSION_TTL = 1
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -118,6 +159,7 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
 STATIC_URL = 'static/'
+STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATICFILES_DIRS = [
     BASE_DIR / 'static',
 ]
@@ -125,10 +167,98 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'auctions.storage.DeduplicatingStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'auctions.storage.CompressedManifestStaticFilesStorage',
+    },
+}
+
+# Cache lifetimes (seconds) used by FileServingMiddleware
+STATIC_IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+STATIC_MAX_AGE = 60
+MEDIA_MAX_AGE = 60 * 60
+
+# Uploaded media is stored once per distinct file (see auctions/storage.py).
+# Larger uploads are refused; unreferenced files are kept this many seconds before
+# collect_media_blobs removes them
+MEDIA_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+MEDIA_BLOB_GRACE_PERIOD = 24 * 60 * 60
+
 # Crispy Forms
 CRISPY_ALLOWED_TEMPLATE_PACKS = 'bootstrap5'
 CRISPY_TEMPLATE_PACK = 'bootstrap5'
 
+# Admin changelists skip COUNT(*) on unfiltered tables larger than this
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 100000
+
+# Seconds before the in-memory ending-soon index is reloaded from the database
+ENDING_SOON_INDEX_TTL = 60
+
+# Seconds before the search autocomplete index (and its popularity ranking) is rebuilt
+AUTOCOMPLETE_INDEX_TTL = 10 * 60
+
+# Seconds the browse page's facet counts are cached for (per search text and catalog version)
+FACET_CACHE_TIMEOUT = 60
+
+# Listing page views are counted in memory and written every VIEW_COUNT_FLUSH_INTERVAL
+# seconds (or once this many listings are waiting); a view's weight in the trending
+# sort halves every TRENDING_HALF_LIFE seconds
+VIEW_COUNT_FLUSH_INTERVAL = 30
+VIEW_COUNT_FLUSH_BATCH = 1000
+TRENDING_HALF_LIFE = 6 * 60 * 60
+
+# Under DEBUG, flag requests running one query shape more than this many times
+# ('warn' logs the statements and their call sites, 'raise' fails the request)
+REPEATED_QUERY_THRESHOLD = 10
+REPEATED_QUERY_ACTION = 'warn'
+
+# Append-only bid event log (see auctions/bid_log.py)
+BID_LOG_DIR = BASE_DIR / 'bid_log'
+BID_LOG_SEGMENT_SIZE = 64 * 1024 * 1024
+BID_LOG_FSYNC_BATCH = 256
+BID_LOG_FSYNC_INTERVAL = 0.05
+
+# Seconds a close_ended_auctions worker holds a batch of listings before another
+# worker may take them over (see auctions/closing.py)
+AUCTION_CLOSE_LEASE = 60
+
+# Notification digests (seconds)
+NOTIFICATION_DIGEST_INTERVAL = 15 * 60
+NOTIFICATION_ENDING_SOON_WINDOW = 60 * 60
+NOTIFICATION_MAIL_CONNECTIONS = 4
+
+# Sessions are served from the cache and written through to the database;
+# the authenticated user is cached for AUTH_USER_CACHE_TIMEOUT seconds and
+# invalidated whenever it is saved. Both caches must be shared by every
+# worker process (`check --deploy` warns otherwise).
+SESSION_ENGINE = 'auctions.sessions'
+SESSION_CACHE_ALIAS = 'default'
+AUTHENTICATION_BACKENDS = ['auctions.backends.CachedModelBackend']
+AUTH_USER_CACHE_ALIAS = 'default'
+AUTH_USER_CACHE_TIMEOUT = 5 * 60
+
+# Route home and listing_detail to their async versions (set by asgi.py)
+ASYNC_BROWSE_VIEWS = os.environ.get('AUCTIONS_ASYNC_VIEWS') == '1'
+
+# Token-bucket limits per user and per client IP for write endpoints, keyed
+# by URL name; a rate of N/period allows bursts of N (see auctions.throttling)
+THROTTLE_RATES = {
+    'listing_detail': {'methods': ['POST'], 'user': '20/m', 'ip': '60/m'},
+    'add_to_watchlist': {'user': '30/m', 'ip': '90/m'},
+    'remove_from_watchlist': {'user': '30/m', 'ip': '90/m'},
+    'toggle_watchlist': {'user': '30/m', 'ip': '90/m'},
+}
+# Shared by every worker (see CACHES), so a limit holds across all of them
+THROTTLE_CACHE_ALIAS = 'default'
+
+# Reverse proxies (addresses or networks, e.g. "127.0.0.1 10.0.0.0/8") whose
+# X-Forwarded-For header names the client; requests from anywhere else are
+# taken to come from REMOTE_ADDR
+TRUSTED_PROXIES = os.environ.get('TRUSTED_PROXIES', '').split()
+
 # Login URLs
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'home'